@@ -9,16 +9,20 @@ import nibabel as nb
 
 # local inputs
 from ..io.get_filename import get_filename
+from ..io.vol import nifti_memmap
 
 
 def clean_coordinate_mapping(cmap_source, cmap_target, overwrite_file=True,
-                             save_mask=False):
+                             save_mask=False, block_size=16):
     """Clean coordinate mapping.
 
     Voxels in the target coordinate mapping are masked out based on found voxel 
     displacements in the source coordinate mapping. This is done to remove 
     smeared regions caused by interpolations with background values in the case 
-    of deforming a slab within a larger image array.    
+    of deforming a slab within a larger image array. Both coordinate mappings
+    are read in blocks of slices from their (memory-mapped) data objects. If
+    the target coordinate mapping is overwritten, the cleaned coordinate
+    mapping is streamed to disk so that it is never held in memory.
 
     Parameters
     ----------
@@ -30,6 +34,8 @@ def clean_coordinate_mapping(cmap_source, cmap_target, overwrite_file=True,
         Overwrite target coordinate mapping. The default is True.
     save_mask : bool, optional
         Write out mask. The default is False.
+    block_size : int, optional
+        Number of slices which are processed at once. The default is 16.
 
     Returns
     -------
@@ -39,82 +45,68 @@ def clean_coordinate_mapping(cmap_source, cmap_target, overwrite_file=True,
     """
 
     # get filename    
-    path_file, _, _ = get_filename(cmap_target)
+    path_file, name_file, ext_file = get_filename(cmap_target)
 
     # load data
     cmap1_img = nb.load(cmap_source)
-    cmap1_array = cmap1_img.get_fdata()
-
     cmap2_img = nb.load(cmap_target)
-    cmap2_array = cmap2_img.get_fdata()
-
-    mask_img = nb.load(cmap_target)
-    mask_img.header["dim"][0] = 3
-    mask_img.header["dim"][4] = 1
-    mask_array = np.zeros_like(mask_img.get_fdata()[:, :, :, 0])
-
-    x_max = cmap2_img.header["dim"][1]
-    y_max = cmap2_img.header["dim"][2]
-    z_max = cmap2_img.header["dim"][3]
-
-    # get nearest voxel coordinates
-    x0 = np.floor(cmap1_array[:, :, :, 0].flatten()).astype(int)
-    x1 = np.ceil(cmap1_array[:, :, :, 0].flatten()).astype(int)
-    y0 = np.floor(cmap1_array[:, :, :, 1].flatten()).astype(int)
-    y1 = np.ceil(cmap1_array[:, :, :, 1].flatten()).astype(int)
-    z0 = np.floor(cmap1_array[:, :, :, 2].flatten()).astype(int)
-    z1 = np.ceil(cmap1_array[:, :, :, 2].flatten()).astype(int)
-
-    # exclude voxels which do not fit in the target array
-    outlier = []
-    outlier.extend(np.where(x0 < 0)[0])
-    outlier.extend(np.where(x1 < 0)[0])
-    outlier.extend(np.where(y0 < 0)[0])
-    outlier.extend(np.where(y1 < 0)[0])
-    outlier.extend(np.where(z0 < 0)[0])
-    outlier.extend(np.where(z1 < 0)[0])
-    outlier.extend(np.where(x0 >= x_max)[0])
-    outlier.extend(np.where(x1 >= x_max)[0])
-    outlier.extend(np.where(y0 >= y_max)[0])
-    outlier.extend(np.where(y1 >= y_max)[0])
-    outlier.extend(np.where(z0 >= z_max)[0])
-    outlier.extend(np.where(z1 >= z_max)[0])
-    outlier = list(np.unique(outlier))
-
-    x0 = np.delete(x0, outlier)
-    x1 = np.delete(x1, outlier)
-    y0 = np.delete(y0, outlier)
-    y1 = np.delete(y1, outlier)
-    z0 = np.delete(z0, outlier)
-    z1 = np.delete(z1, outlier)
+    dims = cmap2_img.shape[:3]
+
+    # flat indices of all voxel corners which fit in the target array
+    ind = []
+    corners = np.array(list(np.ndindex(2, 2, 2)))
+    for z0 in range(0, cmap1_img.shape[2], block_size):
+        z1 = min(z0 + block_size, cmap1_img.shape[2])
+        arr = np.asarray(cmap1_img.dataobj[:, :, z0:z1, :3], dtype=np.float64)
+        arr = arr.reshape(-1, 3)
+
+        # exclude voxels which do not fit in the target array
+        inside = np.all(np.isfinite(arr), axis=1)
+        inside[inside] = np.all((np.floor(arr[inside]) >= 0) &
+                                (np.ceil(arr[inside]) < dims), axis=1)
+        arr = arr[inside]
+
+        # lower and upper corners
+        c = np.where(corners[:, None, :], np.ceil(arr), np.floor(arr))
+        c = c.astype(np.int64).reshape(-1, 3)
+        ind.append(np.unique(np.ravel_multi_index(tuple(c.T), dims)))
 
     # get final mask
-    mask_array[x0, y0, z0] = 1
-    mask_array[x1, y1, z1] = 1
-    mask_array[x1, y0, z0] = 1
-    mask_array[x0, y1, z0] = 1
-    mask_array[x0, y0, z1] = 1
-    mask_array[x1, y1, z0] = 1
-    mask_array[x0, y1, z1] = 1
-    mask_array[x1, y0, z1] = 1
+    ind = np.concatenate(ind) if ind else np.empty(0, dtype=np.int64)
+    mask_array = np.bincount(ind, minlength=int(np.prod(dims))) > 0
+    mask_array = mask_array.reshape(dims).astype(np.float32)
 
     # apply mask to cmap
-    cmap2_array[:, :, :, 0] *= mask_array
-    cmap2_array[:, :, :, 1] *= mask_array
-    cmap2_array[:, :, :, 2] *= mask_array
+    header = cmap2_img.header.copy()
+    header.set_data_dtype(np.float32)
+    if overwrite_file:
+        file_tmp = os.path.join(path_file, "tmp_" + name_file + ext_file)
+        with nifti_memmap(file_tmp, cmap2_img.shape, cmap2_img.affine, header,
+                          np.float32) as arr_out:
+            _mask_cmap(cmap2_img, mask_array, arr_out, block_size)
+        os.replace(file_tmp, cmap_target)
+        cmap = nb.load(cmap_target)
+    else:
+        arr_out = np.zeros(cmap2_img.shape, dtype=np.float32)
+        _mask_cmap(cmap2_img, mask_array, arr_out, block_size)
+        cmap = nb.Nifti1Image(arr_out, cmap2_img.affine, header)
 
     # get output
     results = dict()
-    results["cmap"] = nb.Nifti1Image(cmap2_array, cmap2_img.affine,
-                                     cmap2_img.header)
-    results["mask"] = nb.Nifti1Image(mask_array, mask_img.affine,
-                                     mask_img.header)
+    results["cmap"] = cmap
+    results["mask"] = nb.Nifti1Image(mask_array, cmap2_img.affine, header)
 
     # write output
-    if overwrite_file:
-        nb.save(results["cmap"], cmap_target)
-
     if save_mask:
         nb.save(results["mask"], os.path.join(path_file, "cmap_mask.nii"))
 
     return results
+
+
+def _mask_cmap(img, mask_array, arr_out, block_size):
+    """Multiply blocks of slices of a coordinate mapping with a mask."""
+
+    for z0 in range(0, img.shape[2], block_size):
+        z1 = min(z0 + block_size, img.shape[2])
+        arr = np.asarray(img.dataobj[:, :, z0:z1, ...], dtype=np.float32)
+        arr_out[:, :, z0:z1, ...] = arr * mask_array[:, :, z0:z1, np.newaxis]
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+from scipy.ndimage import map_coordinates
+from scipy.sparse import csr_matrix
+
+# local inputs
+from ..io.vol import nifti_memmap
+from ..utils.interpolation import interpolation_weights3d
+
+__all__ = ["CoordinateMapping"]
+
+
+class CoordinateMapping:
+    """In-memory coordinate mapping.
+
+    A coordinate mapping (cmap) is defined on the voxel grid of the target space
+    and contains for each target voxel the voxel coordinates in the source space
+    (last axis with x-, y- and z-coordinate). Applying the cmap to a source
+    volume therefore samples the source volume at the stored coordinates. The
+    coordinates are either given as (memory-mapped) array or are generated
+    lazily as identity grid in blocks of slices along the z-axis so that a chain
+    of transformations can be computed without writing intermediate files and
+    without ever materializing identity grids.
+
+    Parameters
+    ----------
+    arr : np.ndarray, shape=(X,Y,Z,3), optional
+        Array of source voxel coordinates. If None, an identity grid of shape
+        `shape` is used. The default is None.
+    affine : np.ndarray, optional
+        Affine transformation matrix of the target space. The default is None.
+    header : Nifti1Header, optional
+        Image header of the target space. The default is None.
+    shape : tuple, optional
+        Spatial shape of the identity grid. Only used if `arr` is None. The
+        default is None.
+    pad : int, optional
+        Image padding of the identity grid, i.e., the grid is expanded by `pad`
+        voxels in both directions of each axis. The default is 0.
+
+    Raises
+    ------
+    ValueError
+        If neither `arr` nor `shape` is given.
+
+    """
+
+    def __init__(self, arr=None, affine=None, header=None, shape=None, pad=0):
+        if arr is None and shape is None:
+            raise ValueError("Either coordinate array or shape must be given!")
+
+        self.arr = arr
+        self.pad = pad
+        self.affine = np.eye(4) if affine is None else affine
+        self.header = header
+        if arr is None:
+            self.shape = tuple(int(n) + 2 * pad for n in shape[:3])
+        else:
+            self.shape = tuple(int(n) for n in np.shape(arr)[:3])
+
+    @property
+    def is_identity(self):
+        """True if coordinates are generated lazily as identity grid."""
+        return self.arr is None
+
+    def block(self, z0, z1):
+        """Coordinates of a block of slices along the z-axis.
+
+        Parameters
+        ----------
+        z0 : int
+            First slice.
+        z1 : int
+            Last slice (exclusive).
+
+        Returns
+        -------
+        np.ndarray, shape=(X,Y,z1-z0,3)
+            Source voxel coordinates in float32.
+
+        """
+        if self.is_identity:
+            coords = np.indices(self.shape[:2] + (z1 - z0,), dtype=np.float32)
+            coords[2] += z0
+            coords -= self.pad
+            return np.moveaxis(coords, 0, -1)
+
+        return np.asarray(self.arr[:, :, z0:z1, :3], dtype=np.float32)
+
+    def blocks(self, block_size=16):
+        """Iterate over blocks of slices along the z-axis.
+
+        Parameters
+        ----------
+        block_size : int, optional
+            Number of slices per block. The default is 16.
+
+        Yields
+        ------
+        z0 : int
+            First slice.
+        z1 : int
+            Last slice (exclusive).
+        np.ndarray, shape=(X,Y,z1-z0,3)
+            Source voxel coordinates.
+
+        """
+        for z0 in range(0, self.shape[2], block_size):
+            z1 = min(z0 + block_size, self.shape[2])
+            yield z0, z1, self.block(z0, z1)
+
+    def apply(self, arr, order=1, cval=0, block_size=16):
+        """Apply coordinate mapping to an array. The array is sampled at the source
+        coordinates in blocks of slices along the z-axis. All dimensions after the
+        third dimension (e.g. time points or coordinate components) are sampled
+        with the same coordinates.
+
+        Parameters
+        ----------
+        arr : np.ndarray, shape=(X,Y,Z,...)
+            Source array.
+        order : int, optional
+            Spline interpolation order (0: nearest neighbor, 1: linear). The
+            default is 1.
+        cval : float, optional
+            Value for coordinates outside of the source array. The default is 0.
+        block_size : int, optional
+            Number of slices per block. The default is 16.
+
+        Returns
+        -------
+        np.ndarray, shape=(X',Y',Z',...)
+            Array sampled on the grid of the coordinate mapping.
+
+        """
+        arr = np.asanyarray(arr)
+        shape_extra = np.shape(arr)[3:]
+        arr = arr.reshape(np.shape(arr)[:3] + (-1,))
+        res = np.zeros(self.shape + (arr.shape[3],), dtype=np.float32)
+        for z0, z1, coords in self.blocks(block_size):
+            coords = np.moveaxis(coords, -1, 0)
+            for i in range(arr.shape[3]):
+                res[:, :, z0:z1, i] = map_coordinates(
+                    arr[:, :, :, i], coords, order=order, mode="constant",
+                    cval=cval,
+                )
+
+        return res.reshape(self.shape + shape_extra)
+
+    def sampling_matrix(self, dims, method="linear", padding="zero",
+                        block_size=16):
+        """Sparse sampling operator of the coordinate mapping. The operator maps a
+        flattened (C-ordered) source volume onto the flattened target grid and is
+        computed once so that it can be applied to an arbitrary number of volumes
+        (e.g. all time points of a time series). Target voxels with all source
+        coordinates equal to zero are treated as background and get zero weight.
+
+        Parameters
+        ----------
+        dims : tuple
+            Spatial shape of the source volume.
+        method : str, optional (linear | nearest)
+            Interpolation method. The default is "linear".
+        padding : str, optional (zero | closest)
+            Coordinates outside of the source volume are either sampled as zero
+            or clipped to the closest voxel. The default is "zero".
+        block_size : int, optional
+            Number of slices per block. The default is 16.
+
+        Raises
+        ------
+        ValueError
+            If `padding` is not supported.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix, shape=(X'*Y'*Z', X*Y*Z)
+            Sparse sampling matrix.
+
+        """
+        if padding not in ["zero", "closest"]:
+            raise ValueError("Unknown padding: " + str(padding))
+
+        dims = tuple(int(n) for n in dims[:3])
+        rows, cols, vals = [], [], []
+        for z0, z1, coords in self.blocks(block_size):
+            coords = coords.reshape(-1, 3)
+            background = np.all(coords == 0, axis=1)
+            if padding == "closest":
+                coords = np.clip(coords, 0, np.array(dims) - 1)
+            ind, w = interpolation_weights3d(coords[:, 0], coords[:, 1],
+                                             coords[:, 2], dims, method)
+            w[background] = 0
+
+            # flat (C-ordered) target voxel indices of the block
+            grid = np.indices(self.shape[:2] + (z1 - z0,))
+            grid[2] += z0
+            row = np.ravel_multi_index(tuple(grid.reshape(3, -1)), self.shape)
+
+            keep = w != 0
+            rows.append(np.broadcast_to(row[:, None], w.shape)[keep])
+            cols.append(ind[keep])
+            vals.append(w[keep].astype(np.float32))
+
+        mat = csr_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(int(np.prod(self.shape)), int(np.prod(dims))),
+        )
+
+        return mat
+
+    def compose(self, other, order=1, block_size=16):
+        """Compose two coordinate mappings. The returned mapping is equivalent to
+        applying this mapping first and `other` afterwards, i.e., this mapping is
+        interpolated at the coordinates of `other`.
+
+        Parameters
+        ----------
+        other : CoordinateMapping
+            Coordinate mapping from the target space of this mapping to a new
+            target space.
+        order : int, optional
+            Spline interpolation order (0: nearest neighbor, 1: linear). The
+            default is 1.
+        block_size : int, optional
+            Number of slices per block. The default is 16.
+
+        Returns
+        -------
+        CoordinateMapping
+            Composed coordinate mapping on the grid of `other`.
+
+        """
+        if self.is_identity and not self.pad:
+            return other
+
+        arr = other.apply(self.to_array(block_size), order, 0, block_size)
+
+        return CoordinateMapping(arr, other.affine, other.header)
+
+    def inverse(self, shape, affine=None, header=None):
+        """Approximate inverse coordinate mapping. Target voxel coordinates are
+        scattered to the eight neighboring voxels of the corresponding source
+        coordinates with trilinear weights and averaged. Target voxels with all
+        source coordinates equal to zero are background and are not scattered.
+        Source voxels which are not reached by any target voxel are set to zero
+        (background).
+
+        Parameters
+        ----------
+        shape : tuple
+            Spatial shape of the source space.
+        affine : np.ndarray, optional
+            Affine transformation matrix of the source space. The default is None.
+        header : Nifti1Header, optional
+            Image header of the source space. The default is None.
+
+        Returns
+        -------
+        CoordinateMapping
+            Inverse coordinate mapping on the grid of the source space.
+
+        """
+        shape = tuple(int(n) for n in shape[:3])
+        n_vox = int(np.prod(shape))
+        arr_sum = np.zeros((n_vox, 3))
+        weight_sum = np.zeros(n_vox)
+        for z0, z1, coords in self.blocks():
+            coords = coords.reshape(-1, 3).astype(np.float64)
+            ident = CoordinateMapping(shape=self.shape).block(z0, z1)
+            ident = ident.reshape(-1, 3).astype(np.float64)
+            valid = np.all(np.isfinite(coords), axis=1)
+            valid &= np.any(coords != 0, axis=1)
+            coords = coords[valid]
+            ident = ident[valid]
+
+            c0 = np.floor(coords).astype(int)
+            frac = coords - c0
+            for corner in np.ndindex(2, 2, 2):
+                c = c0 + corner
+                w = np.prod(np.where(corner, frac, 1 - frac), axis=1)
+                inside = np.all((c >= 0) & (c < shape), axis=1) & (w > 0)
+                ind = np.ravel_multi_index(tuple(c[inside].T), shape)
+                weight_sum += np.bincount(ind, w[inside], n_vox)
+                for i in range(3):
+                    arr_sum[:, i] += np.bincount(ind, w[inside] * ident[inside, i],
+                                                 n_vox)
+
+        arr = np.divide(arr_sum, weight_sum[:, np.newaxis],
+                        out=np.zeros_like(arr_sum), where=weight_sum[:, None] > 0)
+
+        return CoordinateMapping(arr.reshape(shape + (3,)).astype(np.float32),
+                                 affine, header)
+
+    def to_array(self, block_size=16):
+        """Materialize coordinate mapping as float32 array."""
+        if not self.is_identity:
+            return np.asarray(self.arr, dtype=np.float32)
+
+        arr = np.zeros(self.shape + (3,), dtype=np.float32)
+        for z0, z1, coords in self.blocks(block_size):
+            arr[:, :, z0:z1] = coords
+        return arr
+
+    def to_file(self, file_out, block_size=16):
+        """Write coordinate mapping in blocks of slices to a float32 nifti file."""
+        with nifti_memmap(file_out, self.shape + (3,), self.affine, self.header,
+                          np.float32) as arr:
+            for z0, z1, coords in self.blocks(block_size):
+                arr[:, :, z0:z1, :] = coords
+
+    @classmethod
+    def from_file(cls, file_in):
+        """Initialize coordinate mapping from a (memory-mapped) nifti file."""
+        img = nb.load(file_in)
+        return cls(img.dataobj, img.affine, img.header)
+
+    @classmethod
+    def identity(cls, file_in, pad=0):
+        """Initialize lazy identity coordinate mapping from the grid of a volume."""
+        img = nb.load(file_in)
+        return cls(None, img.affine, img.header, shape=img.shape[:3], pad=pad)
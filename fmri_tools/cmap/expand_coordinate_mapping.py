@@ -2,7 +2,6 @@
 
 # python standard library inputs
 import os
-import random
 
 # external inputs
 import numpy as np
@@ -10,24 +9,26 @@ import nibabel as nb
 
 # local inputs
 from ..io.get_filename import get_filename
-from ..cmap.generate_coordinate_mapping import generate_coordinate_mapping
-from ..utils.apply_affine_chunked import apply_affine_chunked
+from ..cmap.coordinate_mapping import CoordinateMapping
 
 
 def expand_coordinate_mapping(cmap_in, path_output=None, name_output=None,
-                              write_output=False):
+                              write_output=False, n_samples=100000,
+                              ransac_iter=0, ransac_threshold=1.0, seed=0,
+                              block_size=16):
     """Expand coordinate mapping.
     
     This function removes black background in a coordinate mapping to omit 
     interpolation problems at the edges of a coordinate slab within a larger 
-    volume. Based on the cmap, a transformation matrix is computed from randomly 
-    sampled data points within the slab. The transformation matrix is then 
-    applied to all background voxels. Hence, this method is only really precise 
-    for coordinate mappings representing an affine transformation. However, this 
-    function can also be applied to nonlinear coordinate mappings since the 
-    preliminary goal is to avoid problems at the slab edges. Therefore, the 
-    actual data sampling should not be affected. The code snippet for computing 
-    the transformation matrix is taken from [1].
+    volume. Based on the cmap, an affine transformation is fitted by least
+    squares to a random subsample of voxels within the slab. Optionally, outlier
+    voxels are excluded from the fit with RANSAC [1]_. The transformation is
+    then applied to all background voxels. Hence, this method is only really
+    precise for coordinate mappings representing an affine transformation.
+    However, this function can also be applied to nonlinear coordinate mappings
+    since the preliminary goal is to avoid problems at the slab edges.
+    Therefore, the actual data sampling should not be affected. The result is
+    deterministic for a given seed.
 
     Parameters
     ----------
@@ -39,6 +40,22 @@ def expand_coordinate_mapping(cmap_in, path_output=None, name_output=None,
         Basename of output volume. The default is None.
     write_output : bool, optional
         Write nifti volume. The default is False.
+    n_samples : int, optional
+        Maximum number of voxels used for fitting. The default is 100000.
+    ransac_iter : int, optional
+        Number of RANSAC iterations (no outlier rejection if 0). The default is
+        0.
+    ransac_threshold : float, optional
+        Maximum residual in voxels of RANSAC inliers. The default is 1.0.
+    seed : int, optional
+        Seed of the random number generator. The default is 0.
+    block_size : int, optional
+        Number of slices which are processed at once. The default is 16.
+
+    Raises
+    ------
+    ValueError
+        If the coordinate mapping contains less than four valid voxels.
 
     Returns
     -------
@@ -47,97 +64,78 @@ def expand_coordinate_mapping(cmap_in, path_output=None, name_output=None,
 
     References
     -------
-    .. [1] https://stackoverflow.com/questions/56220626/how-to-compute-
-    conformal-affine-transformation
+    .. [1] Fischler MA, Bolles RC. Random sample consensus: a paradigm for
+       model fitting with applications to image analysis and automated
+       cartography. Commun ACM 24(6), 381--395 (1981).
     
     """
 
     # get file extension of cmap
     _, _, ext_cmap = get_filename(cmap_in)
 
-    # load target cmap and generate source cmap 
+    # load target cmap and generate lazy source grid
     cmap_target = nb.load(cmap_in)
-    cmap_source = generate_coordinate_mapping(cmap_in, pad=0)
-
-    arr_cmap_target = cmap_target.get_fdata()
-    arr_cmap_source = cmap_source.get_fdata()
-
-    # get image dimensions
-    xdim = cmap_source.header["dim"][1]
-    ydim = cmap_source.header["dim"][2]
-    zdim = cmap_source.header["dim"][3]
-
-    # random selection of 4 data points
-    s_coords = []
-    t_coords = []
-
-    pts = np.where(arr_cmap_target[:, :, :, 0] != 0)
-    r = random.sample(np.arange(len(pts[0])).tolist(), len(pts[0]))[:4]
-
-    s_coords.append([pts[0][r[0]], pts[1][r[0]], pts[2][r[0]]])
-    s_coords.append([pts[0][r[1]], pts[1][r[1]], pts[2][r[1]]])
-    s_coords.append([pts[0][r[2]], pts[1][r[2]], pts[2][r[2]]])
-    s_coords.append([pts[0][r[3]], pts[1][r[3]], pts[2][r[3]]])
-
-    t_coords.append(arr_cmap_target[s_coords[0][0], s_coords[0][1], s_coords[0][2], :].tolist())
-    t_coords.append(arr_cmap_target[s_coords[1][0], s_coords[1][1], s_coords[1][2], :].tolist())
-    t_coords.append(arr_cmap_target[s_coords[2][0], s_coords[2][1], s_coords[2][2], :].tolist())
-    t_coords.append(arr_cmap_target[s_coords[3][0], s_coords[3][1], s_coords[3][2], :].tolist())
-
-    # get transformation matrix (target -> source)
-    l = len(t_coords)
-    B = np.vstack([np.transpose(t_coords), np.ones(l)])
-    D = 1.0 / np.linalg.det(B)
-
-    entry = lambda r, d: np.linalg.det(np.delete(np.vstack([r, B]), (d + 1), axis=0))
-    M = [[(-1) ** i * D * entry(R, i) for i in range(l)] for R in np.transpose(s_coords)]
-    A, t = np.hsplit(np.array(M), [l - 1])
-    t = np.transpose(t)[0]
-
-    # unittests
+    arr_cmap_target = cmap_target.get_fdata(dtype=np.float32)
+    grid = CoordinateMapping(shape=arr_cmap_target.shape[:3])
+
+    # random subsample of voxels within the slab
+    rng = np.random.default_rng(seed)
+    pts = np.flatnonzero(arr_cmap_target[:, :, :, 0] != 0)
+    if len(pts) < 4:
+        raise ValueError("Coordinate mapping contains less than four data points!")
+    if len(pts) > n_samples:
+        pts = np.sort(rng.choice(pts, n_samples, replace=False))
+    s_coords = np.column_stack(np.unravel_index(pts, grid.shape)).astype(np.float64)
+    t_coords = arr_cmap_target[:, :, :, :3].reshape(-1, 3)[pts].astype(np.float64)
+    s_coords = np.column_stack((s_coords, np.ones(len(s_coords))))
+
+    # get transformation matrix (source grid -> cmap coordinates)
+    inlier = np.ones(len(pts), dtype=bool)
+    if ransac_iter:
+        inlier = _ransac(s_coords, t_coords, ransac_iter, ransac_threshold, rng)
+    M, _, _, _ = np.linalg.lstsq(s_coords[inlier], t_coords[inlier], rcond=None)
+    M = M.T.astype(np.float32)
+
+    # fit residuals
+    res = np.linalg.norm(s_coords.dot(M.T) - t_coords, axis=1)
     print("Test cmap expansion:")
-    for p, P in zip(np.array(t_coords), np.array(s_coords)):
-        image_p = np.dot(A, p) + t
-        result = "[OK]" if np.allclose(image_p, P) else "[ERROR]"
-        print(p, " mapped to: ", image_p, " ; expected: ", P, result)
-
-    # get affine transformation matrix by adding translation vector
-    M = np.zeros((4, 4))
-    M[:3, :3] = A
-    M[:3, -1] = t
-    M[-1, -1] = 1
-
-    # get final transformation matrix (source -> target)
-    M = np.linalg.inv(M)
-
-    # transform source volume
-    x = arr_cmap_source[:, :, :, 0].flatten()
-    y = arr_cmap_source[:, :, :, 1].flatten()
-    z = arr_cmap_source[:, :, :, 2].flatten()
-
-    source_listed = np.array([x, y, z]).T
-    source_transformed = apply_affine_chunked(M, source_listed)
-
-    x_new = np.reshape(source_transformed[:, 0], (xdim, ydim, zdim))
-    y_new = np.reshape(source_transformed[:, 1], (xdim, ydim, zdim))
-    z_new = np.reshape(source_transformed[:, 2], (xdim, ydim, zdim))
-
-    # overwrite new cmap with old coordinate mapping (so that only background remains)    
-    x_new[arr_cmap_target[:, :, :, 0] > 0] = arr_cmap_target[:, :, :, 0][arr_cmap_target[:, :, :, 0] > 0]
-    y_new[arr_cmap_target[:, :, :, 1] > 0] = arr_cmap_target[:, :, :, 1][arr_cmap_target[:, :, :, 1] > 0]
-    z_new[arr_cmap_target[:, :, :, 2] > 0] = arr_cmap_target[:, :, :, 2][arr_cmap_target[:, :, :, 2] > 0]
-
-    # overwrite input cmap array with final cmap array
-    arr_cmap_target[:, :, :, 0] = x_new
-    arr_cmap_target[:, :, :, 1] = y_new
-    arr_cmap_target[:, :, :, 2] = z_new
+    print("Inliers: " + str(np.sum(inlier)) + " / " + str(len(pts)))
+    print("Residual (median, max): " + str(np.median(res)) + ", " + str(np.max(res)))
+
+    # transform source grid and fill background voxels
+    for z0, z1, coords in grid.blocks(block_size):
+        arr = arr_cmap_target[:, :, z0:z1, :3]
+        coords = coords.dot(M[:, :3].T) + M[:, 3]
+        arr[arr <= 0] = coords[arr <= 0]
 
     # nibabel instance of final cmap
-    output = nb.Nifti1Image(arr_cmap_target, cmap_target.affine,
-                            cmap_target.header)
+    header = cmap_target.header.copy()
+    header.set_data_dtype(np.float32)
+    output = nb.Nifti1Image(arr_cmap_target, cmap_target.affine, header)
 
     # write output
     if write_output:
         nb.save(output, os.path.join(path_output, name_output + ext_cmap))
 
     return output
+
+
+def _ransac(s_coords, t_coords, n_iter, threshold, rng):
+    """Inliers of the affine transformation with the largest consensus set.
+    Minimal four-point fits of all iterations are solved at once."""
+
+    ind = np.array([rng.choice(len(s_coords), 4, replace=False)
+                    for _ in range(n_iter)])
+    a = s_coords[ind]
+    well_posed = np.abs(np.linalg.det(a)) > 1e-6
+    if not np.any(well_posed):
+        return np.ones(len(s_coords), dtype=bool)
+
+    M = np.linalg.solve(a[well_posed], t_coords[ind[well_posed]])
+    n_inlier = np.zeros(len(M), dtype=int)
+    for i, m in enumerate(M):
+        res = np.linalg.norm(s_coords.dot(m) - t_coords, axis=1)
+        n_inlier[i] = np.sum(res < threshold)
+    m = M[np.argmax(n_inlier)]
+
+    return np.linalg.norm(s_coords.dot(m) - t_coords, axis=1) < threshold
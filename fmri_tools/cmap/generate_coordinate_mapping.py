@@ -2,21 +2,28 @@
 
 # python standard library inputs
 import os
+import json
 
 # external inputs
 import numpy as np
 import nibabel as nb
-from numpy.matlib import repmat
+
+# local inputs
+from ..cmap.coordinate_mapping import CoordinateMapping
 
 
 def generate_coordinate_mapping(file_in, pad, path_output=None, suffix=None,
-                                time=False, write_output=False):
+                                time=False, write_output=False, lazy=False):
     """Generate coordinate mapping.
     
-    Generates coordinate mapping for an input volume. Either one or multiple 
-    coordinate maps are saved in the output folder depending on the 
-    dimensionality (3d or 4d) of the input image. Image padding can be applied 
-    which expands the image matrix of each axis in both directions.    
+    Generates coordinate mapping for an input volume. The coordinate mapping is
+    an identity grid which is generated lazily in blocks of slices and is only
+    written as float32 volume if requested. If a coordinate mapping is needed
+    for each time step of a 4d image, the same coordinate mapping would be
+    written repeatedly. Therefore, only one file is written together with a
+    json manifest which lists the coordinate mapping of each time step. Image
+    padding can be applied which expands the image matrix of each axis in both
+    directions.
 
     Parameters
     ----------
@@ -32,10 +39,13 @@ def generate_coordinate_mapping(file_in, pad, path_output=None, suffix=None,
         Compute coordinate map for each time step. The default is False.
     write_output : bool, optional
         Write nifti volume. The default is False.
+    lazy : bool, optional
+        Return the lazy identity grid instead of a nibabel image. The default
+        is False.
 
     Returns
     -------
-    output : niimg
+    output : niimg or CoordinateMapping
         Coordinate mapping.
     
     """
@@ -48,53 +58,27 @@ def generate_coordinate_mapping(file_in, pad, path_output=None, suffix=None,
     # load data
     data_img = nb.load(file_in)
 
-    # get matrix size
-    x_size = data_img.header["dim"][1] + 2 * pad
-    y_size = data_img.header["dim"][2] + 2 * pad
-    z_size = data_img.header["dim"][3] + 2 * pad
-
-    if time is False:
-        t_size = 1
-    else:
-        t_size = data_img.header["dim"][4]
-
-    # define coordinate
-    coordinate_mapping = np.zeros((x_size, y_size, z_size, 3), dtype='float')
-
-    # coordinate mapping in x-direction
-    x = np.array(np.arange(-pad, x_size - pad, 1), dtype='float')
-    x = np.transpose(repmat(x, y_size, 1))
-    x = np.dstack([x] * z_size)
-
-    # coordinate mapping in y-direction
-    y = np.array(np.arange(-pad, y_size - pad), dtype='float')
-    y = repmat(y, x_size, 1)
-    y = np.dstack([y] * z_size)
-
-    # coordinate mapping in z-direction
-    z = np.ones((x_size, y_size, z_size))
-    z = np.arange(-pad, z_size - pad) * z
-
-    # merge directions
-    coordinate_mapping[:, :, :, 0] = x
-    coordinate_mapping[:, :, :, 1] = y
-    coordinate_mapping[:, :, :, 2] = z
+    # lazy coordinate mapping
+    cmap = CoordinateMapping(affine=data_img.affine, shape=data_img.shape[:3],
+                             pad=pad)
 
     # write coordinate mapping
-    output = nb.Nifti1Image(coordinate_mapping, data_img.affine,
-                            nb.Nifti1Header())
-
-    # write coordinate mapping for each time point   
-    if t_size == 1:
-        if write_output:
-            file_out = os.path.join(path_output, 'cmap_' + suffix + '.nii')
-            nb.save(output, file_out)
-    else:
-        for i in range(t_size):
-            if write_output:
-                file_out = os.path.join(path_output,
-                                        'cmap_' + suffix + '_' + str(i) +
-                                        '.nii')
-                nb.save(output, file_out)
-
-    return output
+    if write_output:
+        file_out = 'cmap_' + suffix + '.nii'
+        cmap.to_file(os.path.join(path_output, file_out))
+
+        # manifest of coordinate mapping for each time point
+        if time is not False:
+            t_size = data_img.shape[3] if len(data_img.shape) > 3 else 1
+            manifest = {"shape": list(cmap.shape) + [3],
+                        "pad": pad,
+                        "volumes": [file_out] * t_size,
+                        }
+            with open(os.path.join(path_output, 'cmap_' + suffix + '.json'),
+                      'w') as f:
+                json.dump(manifest, f, indent=4)
+
+    if lazy:
+        return cmap
+
+    return nb.Nifti1Image(cmap.to_array(), data_img.affine, nb.Nifti1Header())
@@ -2,6 +2,7 @@
 
 # python standard library inputs
 import os
+from itertools import product
 
 # external inputs
 import numpy as np
@@ -9,9 +10,11 @@ import nibabel as nb
 
 # local inputs
 from ..io.get_filename import get_filename
+from ..io.vol import nifti_memmap
 
 
-def remove_edge_cmap(input_cmap, edge_threshold=5, min_threshold=5):
+def remove_edge_cmap(input_cmap, edge_threshold=5, min_threshold=5,
+                     neighborhood=18, block_size=16):
     """Remove edge cmap.
     
     This function removes smeared edges from a coordinate mapping. Depending on 
@@ -22,7 +25,11 @@ def remove_edge_cmap(input_cmap, edge_threshold=5, min_threshold=5):
     assumed to be filled by zeroes and identified edge voxels are set to the 
     background value. A voxels is classified as edge outlier if its difference 
     to one local neighbour is larger than edge_threshold or if its cmap value is 
-    below min_threshold in all dimensions.    
+    below min_threshold in all dimensions. Differences to all neighbours are 
+    computed at once from shifted views of the nan-padded array, i.e., all 
+    voxels are compared to the input coordinate mapping. Nan neighbours and 
+    neighbours outside of the volume are ignored. The coordinate mapping is 
+    processed in blocks of slices along the z-axis.
 
     Parameters
     ----------
@@ -33,6 +40,16 @@ def remove_edge_cmap(input_cmap, edge_threshold=5, min_threshold=5):
         is 5.
     min_threshold : float, optional
         Minimum cmap value in all dimensions (in voxel units). The default is 5.
+    neighborhood : int, optional
+        Neighbourhood connectivity (6, 18 or 26). The default is 18.
+    block_size : int, optional
+        Number of slices along the z-axis which are processed at once. The 
+        default is 16.
+
+    Raises
+    ------
+    ValueError
+        If `neighborhood` is not supported.
 
     Returns
     -------
@@ -40,140 +57,51 @@ def remove_edge_cmap(input_cmap, edge_threshold=5, min_threshold=5):
 
     """
 
-    # load input
-    cmap = nb.load(input_cmap)
-    cmap_array = cmap.get_fdata()
-
-    # get slab coordinates within volume (assumes background filled with zeroes)
-    cmap_slab_coords = np.where(cmap_array != 0)
-
-    # number of voxels
-    n_vox = len(cmap_slab_coords[0])
-    c_vox = 0
-
-    # initialise for printing out loop status
-    c_step = 0
-    n_step = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-
-    # identify edges
-    for n in range(n_vox):
-
-        # current voxel
-        i = cmap_slab_coords[0][n]
-        j = cmap_slab_coords[1][n]
-        k = cmap_slab_coords[2][n]
-        t = cmap_slab_coords[3][n]
-
-        # initialise voxel and its neighbours
-        cmap_point = cmap_array[i, j, k, t]
-        cmap_neighbour = []
-
-        # consider neighour if not at edge of image volume
-        if i > 0:
-            cmap_neighbour.append(cmap_array[i - 1, j, k, t])
-
-        if j > 0:
-            cmap_neighbour.append(cmap_array[i, j - 1, k, t])
-
-        if k > 0:
-            cmap_neighbour.append(cmap_array[i, j, k - 1, t])
-
-        if i < np.shape(cmap_array)[0] - 1:
-            cmap_neighbour.append(cmap_array[i + 1, j, k, t])
-
-        if j < np.shape(cmap_array)[1] - 1:
-            cmap_neighbour.append(cmap_array[i, j + 1, k, t])
-
-        if k < np.shape(cmap_array)[2] - 1:
-            cmap_neighbour.append(cmap_array[i, j, k + 1, t])
-
-        if i > 0 and j > 0:
-            cmap_neighbour.append(cmap_array[i - 1, j - 1, k, t])
-
-        if i > 0 and j < np.shape(cmap_array)[1] - 1:
-            cmap_neighbour.append(cmap_array[i - 1, j + 1, k, t])
-
-        if i > np.shape(cmap_array)[0] - 1 and j > 0:
-            cmap_neighbour.append(cmap_array[i + 1, j - 1, k, t])
-
-        if i > np.shape(cmap_array)[0] - 1 and j < np.shape(cmap_array)[1] - 1:
-            cmap_neighbour.append(cmap_array[i + 1, j + 1, k, t])
-
-        if i > 0 and k > 0:
-            cmap_neighbour.append(cmap_array[i - 1, j, k - 1, t])
+    if neighborhood not in [6, 18, 26]:
+        raise ValueError("Neighborhood must be 6, 18 or 26!")
 
-        if i > 0 and k < np.shape(cmap_array)[2] - 1:
-            cmap_neighbour.append(cmap_array[i - 1, j, k + 1, t])
+    # neighbour offsets
+    offsets = np.array(list(product([-1, 0, 1], repeat=3)))
+    offsets = offsets[np.sum(offsets != 0, axis=1) > 0]
+    offsets = offsets[np.sum(offsets != 0, axis=1) <= {6: 1, 18: 2, 26: 3}[neighborhood]]
 
-        if i > np.shape(cmap_array)[0] - 1 and k > 0:
-            cmap_neighbour.append(cmap_array[i + 1, j, k - 1, t])
-
-        if i > np.shape(cmap_array)[0] - 1 and j < np.shape(cmap_array)[2] - 1:
-            cmap_neighbour.append(cmap_array[i + 1, j, k + 1, t])
-
-        if j > 0 and k > 0:
-            cmap_neighbour.append(cmap_array[i, j - 1, k - 1, t])
-
-        if j > 0 and k < np.shape(cmap_array)[2] - 1:
-            cmap_neighbour.append(cmap_array[i, j - 1, k + 1, t])
-
-        if j > np.shape(cmap_array)[1] - 1 and k > 0:
-            cmap_neighbour.append(cmap_array[i, j + 1, k - 1, t])
-
-        if j > np.shape(cmap_array)[1] - 1 and j < np.shape(cmap_array)[2] - 1:
-            cmap_neighbour.append(cmap_array[i, j + 1, k + 1, t])
-
-        # compare voxel to its neighbours
-        cmap_temp = np.abs(np.array(cmap_neighbour) - cmap_point)
-        cmap_temp = cmap_temp[~np.isnan(cmap_temp)]
-        cmap_temp = np.any(cmap_temp > edge_threshold)
-
-        if cmap_temp:
-            cmap_array[i, j, k, t] = np.nan
-
-        # print status
-        counter = np.floor(c_vox / n_vox * 100).astype(int)
-        if counter == n_step[c_step]:
-            print("cmap edge removal: " + str(counter) + " %")
-            c_step += 1
-
-        # counter loop cycles
-        c_vox += 1
-
-    # remove edges
-    cmap_array[np.isnan(cmap_array)] = 0
-
-    # get binary mask from single dimensions
-    mask_array = cmap_array[:, :, :, 0] * cmap_array[:, :, :, 1] * cmap_array[:, :, :, 2]
-    mask_array[mask_array != 0] = 1
-
-    # get binary mask from min threshold
-    min_array1 = cmap_array[:, :, :, 0].copy()
-    min_array2 = cmap_array[:, :, :, 1].copy()
-    min_array3 = cmap_array[:, :, :, 2].copy()
-
-    min_array1[min_array1 < min_threshold] = 0
-    min_array2[min_array2 < min_threshold] = 0
-    min_array3[min_array3 < min_threshold] = 0
-
-    min_array1[min_array1 != 0] = 1
-    min_array2[min_array2 != 0] = 1
-    min_array3[min_array3 != 0] = 1
-
-    min_array = min_array1 + min_array2 + min_array3
-    min_array[min_array != 0] = 1
-
-    # mask cmap
-    cmap_array[:, :, :, 0] = cmap_array[:, :, :, 0] * mask_array
-    cmap_array[:, :, :, 1] = cmap_array[:, :, :, 1] * mask_array
-    cmap_array[:, :, :, 2] = cmap_array[:, :, :, 2] * mask_array
-
-    cmap_array[:, :, :, 0] = cmap_array[:, :, :, 0] * min_array
-    cmap_array[:, :, :, 1] = cmap_array[:, :, :, 1] * min_array
-    cmap_array[:, :, :, 2] = cmap_array[:, :, :, 2] * min_array
+    # load input
+    cmap = nb.load(input_cmap)
+    nx, ny, nz = cmap.shape[:3]
 
     # write output
     path_output, basename_output, ext_output = get_filename(input_cmap)
-    output = nb.Nifti1Image(cmap_array, cmap.affine, cmap.header)
-    nb.save(output,
-            os.path.join(path_output, basename_output + "_edge" + ext_output))
+    file_out = os.path.join(path_output, basename_output + "_edge" + ext_output)
+    with nifti_memmap(file_out, cmap.shape, cmap.affine, cmap.header) as arr_out:
+        for z0 in range(0, nz, block_size):
+            z1 = min(z0 + block_size, nz)
+            print("cmap edge removal: " + str(int(z0 / nz * 100)) + " %")
+
+            # load block with one neighbouring slice on each side
+            h0 = max(z0 - 1, 0)
+            h1 = min(z1 + 1, nz)
+            cmap_array = np.asarray(cmap.dataobj[:, :, h0:h1, :], dtype=np.float64)
+            cmap_array = np.pad(
+                cmap_array,
+                ((1, 1), (1, 1), (1 - z0 + h0, 1 - h1 + z1), (0, 0)),
+                constant_values=np.nan,
+            )
+            cmap_block = cmap_array[1:-1, 1:-1, 1:-1].copy()
+
+            # identify edges (comparisons with nan are false)
+            edge = np.zeros(np.shape(cmap_block), dtype=bool)
+            for i, j, k in offsets:
+                cmap_neighbour = cmap_array[1 + i:nx + 1 + i, 1 + j:ny + 1 + j,
+                                            1 + k:z1 - z0 + 1 + k]
+                edge |= np.abs(cmap_neighbour - cmap_block) > edge_threshold
+
+            # remove edges
+            cmap_block[edge | np.isnan(cmap_block)] = 0
+
+            # binary mask from single dimensions and from min threshold
+            mask_array = np.all(cmap_block[:, :, :, :3] != 0, axis=3)
+            mask_array &= np.any(cmap_block[:, :, :, :3] >= min_threshold, axis=3)
+
+            # mask cmap
+            cmap_block[:, :, :, :3] *= mask_array[:, :, :, np.newaxis]
+            arr_out[:, :, z0:z1, :] = cmap_block
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 
+# python standard library inputs
+import os
+import gzip
+import shutil as sh
+import tempfile
+import contextlib
+
 # external inputs
+import numpy as np
 import nibabel as nb
 
-__all__ = ['copy_header']
+__all__ = ['copy_header', 'nifti_memmap']
 
 
 def copy_header(file_in):
@@ -76,3 +84,97 @@ def copy_header(file_in):
     header_new["magic"] = header["magic"]
 
     return header_new
+
+
+@contextlib.contextmanager
+def nifti_memmap(file_out, shape, affine, header=None, dtype=np.float32):
+    """Nifti memmap.
+
+    This context manager pre-allocates a nifti file on disk and yields a
+    writable memory-mapped array of its data section. This enables writing
+    large volumes block by block without holding the whole array in memory.
+    The data is written into a unique temporary file in the output folder,
+    which is (compressed and) moved onto the output file when the context is
+    closed. Therefore, existing files are never truncated before the context
+    is closed, i.e., the output file can also be the input file which is read
+    while writing.
+
+    Parameters
+    ----------
+    file_out : str
+        Filename of output nifti volume.
+    shape : tuple
+        Shape of the output array.
+    affine : ndarray
+        Affine transformation matrix.
+    header : Nifti1Header, optional
+        Image header. The default is None.
+    dtype : type, optional
+        Data type of the output array. The default is np.float32.
+
+    Yields
+    ------
+    np.memmap
+        Writable memory-mapped output array.
+
+    """
+
+    file_out = str(file_out)
+
+    # make output folder
+    path_output = os.path.dirname(os.path.abspath(file_out))
+    if not os.path.exists(path_output):
+        os.makedirs(path_output)
+
+    # prepare header
+    header = nb.Nifti1Header() if header is None else header.copy()
+    if not isinstance(header, nb.Nifti1Header):
+        header = nb.Nifti1Header.from_header(header)
+    header.set_data_dtype(dtype)
+    header.set_data_shape(shape)
+    header.set_qform(affine)
+    header.set_sform(affine)
+    header.set_slope_inter(1, 0)
+    offset = int(352 + header.extensions.get_sizeondisk())
+    header.set_data_offset(offset)
+
+    # write header and allocate data section in a temporary file
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    with tempfile.NamedTemporaryFile(dir=path_output, suffix=".nii",
+                                     delete=False) as f:
+        file_tmp = f.name
+        header.write_to(f)
+        f.truncate(offset + nbytes)
+
+    try:
+        arr = np.memmap(file_tmp, dtype=header.get_data_dtype(), mode="r+",
+                        offset=offset, shape=tuple(shape), order="F")
+        try:
+            yield arr
+        finally:
+            arr.flush()
+            del arr
+
+        # compress output
+        if file_out.endswith(".gz"):
+            with tempfile.NamedTemporaryFile(dir=path_output, suffix=".nii.gz",
+                                             delete=False) as f:
+                file_gz = f.name
+            try:
+                with open(file_tmp, "rb") as f_in, \
+                        gzip.open(file_gz, "wb") as f_out:
+                    sh.copyfileobj(f_in, f_out)
+            except BaseException:
+                os.remove(file_gz)
+                raise
+            os.remove(file_tmp)
+            file_tmp = file_gz
+
+        # temporary files are only readable by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(file_tmp, 0o666 & ~umask)
+        os.replace(file_tmp, file_out)
+    finally:
+        if os.path.exists(file_tmp):
+            os.remove(file_tmp)
@@ -2,6 +2,7 @@
 
 # python standard library inputs
 import os
+import functools
 
 # external inputs
 import numpy as np
@@ -43,17 +44,16 @@ def map2grid(file_grid, file_input, sigma, path_output="", basename_output="",
 
     # load data
     grid_img = nb.load(file_grid)
-    grid_array = grid_img.get_fdata()
+    grid_ind, grid_mask = grid_index(file_grid)
     if os.path.splitext(file_input)[1] == ".mgh":
         morph = nb.load(file_input).get_fdata()
     else:
         morph = read_morph_data(file_input)
+    morph = np.ravel(morph)
 
     # sample data onto grid
-    for i in range(np.size(grid_array, 0)):
-        for j in range(np.size(grid_array, 1)):
-            if grid_array[i, j] != 0:
-                grid_array[i, j] = morph[grid_array[i, j].astype(int)]
+    grid_array = np.zeros(grid_ind.shape)
+    grid_array[grid_mask] = morph[grid_ind[grid_mask]]
 
     # gaussian filter (opt)
     if sigma != 0:
@@ -97,3 +97,44 @@ def map2grid(file_grid, file_input, sigma, path_output="", basename_output="",
         nb.save(output, filenameOUT)
 
     return grid_array
+
+
+def grid_index(file_grid):
+    """Grid index.
+
+    This function reads a grid coordinate mapping and returns the vertex index
+    of each grid point together with a mask of all grid points which are
+    sampled. Results are cached, i.e., the grid file is only read once as long
+    as it is not modified. The returned arrays are read-only.
+
+    Parameters
+    ----------
+    file_grid : str
+        Filename of grid coordinate mapping.
+
+    Returns
+    -------
+    grid_ind : ndarray
+        Integer vertex index of each grid point.
+    grid_mask : ndarray
+        Boolean mask of grid points which are sampled.
+
+    """
+
+    file_grid = os.path.abspath(file_grid)
+
+    return _grid_index(file_grid, os.path.getmtime(file_grid))
+
+
+@functools.lru_cache(maxsize=8)
+def _grid_index(file_grid, mtime):
+    """Cached version of grid_index. The modification time is only used as
+    part of the cache key."""
+
+    grid_array = nb.load(file_grid).get_fdata()
+    grid_ind = grid_array.astype(int)
+    grid_mask = grid_array != 0
+    grid_ind.flags.writeable = False
+    grid_mask.flags.writeable = False
+
+    return grid_ind, grid_mask
@@ -8,13 +8,17 @@ import numpy as np
 import nibabel as nb
 from scipy.ndimage.filters import gaussian_filter
 
+# local inputs
+from .map2grid import grid_index
+
 
 def map2stack(file_data, file_grid, sigma, path_output):
     """Map to stack.
 
     This function allows you to sample surface data to a patch defined on a 
     regular grid. If multiple data files are given in a list, all grids are 
-    stacked together.    
+    stacked together. The optional gaussian filter is applied once to each
+    stacked grid.
 
     Parameters
     ----------
@@ -39,39 +43,34 @@ def map2stack(file_data, file_grid, sigma, path_output):
 
     # load data
     grid_img = nb.load(file_grid)
-    grid_array = grid_img.get_fdata()
+    grid_ind, grid_mask = grid_index(file_grid)
 
     # dim
     x = grid_img.header["dim"][1]
     y = grid_img.header["dim"][2]
     z = len(file_data)
+    grid_ind = grid_ind.reshape(x, y)
+    grid_mask = grid_mask.reshape(x, y)
+
+    # overlay matrix (vertex x file)
+    data_array = np.column_stack(
+        [np.ravel(nb.load(f).get_fdata()) for f in file_data]
+    )
 
-    # sample data onto grid
+    # sample all data onto grid at once
     stack_array = np.zeros((x, y, z))
-    for i in range(z):
-
-        # load data
-        data_img = nb.load(file_data[i])
-        data_array = data_img.get_fdata()
-
-        # map to stack
-        for j in range(x):
-            for k in range(y):
-                if grid_array[j, k] != 0:
-                    stack_array[j, k, i] = data_array[
-                        grid_array[j, k].astype(int)]
-
-        # gaussian filter (opt)
-        if sigma != 0:
-            order = 0
-            mode = "reflect"
-            truncate = 4.0
-            for j in range(np.size(stack_array, 2)):
-                stack_array[:, :, j] = gaussian_filter(stack_array[:, :, j],
-                                                       sigma=sigma,
-                                                       order=order,
-                                                       mode=mode,
-                                                       truncate=truncate)
+    stack_array[grid_mask] = data_array[grid_ind[grid_mask]]
+
+    # gaussian filter (opt) along in-plane axes
+    if sigma != 0:
+        order = 0
+        mode = "reflect"
+        truncate = 4.0
+        stack_array = gaussian_filter(stack_array,
+                                      sigma=(sigma, sigma, 0),
+                                      order=order,
+                                      mode=mode,
+                                      truncate=truncate)
 
     # write output data
     filename_out = os.path.join(path_output,
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+
+# local inputs
+from ..io.affine import vox2ras_tkr
+from ..io.hdf5 import write_hdf5
+from ..utils.apply_affine_chunked import apply_affine_chunked
+from ..utils.interpolation import sampling_matrix3d
+
+
+def map_laminar(vtx, arr, dims, ds, vtx_pial=None, depths=None,
+                interpolation="linear", file_out=None, chunk_size=10000):
+    """Map volume data onto multiple cortical layers at once. Layers are either given
+    as list of vertex arrays or are computed from corresponding white and pial
+    surfaces with fractional cortical depths (0: white, 1: pial). The volume is
+    sampled once for all layers and a contiguous array with dimensions vertex x layer
+    (x time point) is returned. All vertices outside the volume are set to nan.
+
+    Parameters
+    ----------
+    vtx : list or np.ndarray, shape=(N,3)
+        List of vertex-wise arrays of each layer (same number of vertices) or
+        vertex-wise array of the white surface if `vtx_pial` is given.
+    arr : np.ndarray, shape=(X,Y,Z) or (X,Y,Z,T)
+        3D volume or 4D array of fMRI time series.
+    dims : tuple
+        Tuple containing volume dimensions in x-, y- and z-direction.
+    ds : tuple
+        Tuple containing voxel sizes in x-, y- and z-direction.
+    vtx_pial : np.ndarray, shape=(N,3), optional
+        Vertex-wise array of the pial surface. The default is None.
+    depths : list, optional
+        Fractional cortical depths between white and pial surface. Only used if
+        `vtx_pial` is given. The default is None.
+    interpolation : str, optional (linear | nearest)
+        Interpolation method (linear or nearest neighbor interpolation).
+    file_out : str, optional
+        If given, the sampled array is additionally written to an hdf5 file. The
+        array is stored with dimensions vertex x time point x layer to be consistent
+        with `extract_mgh_from_hdf5`. The default is None.
+    chunk_size : int, optional
+        Number of vertices which are sampled at once. The default is 10000.
+
+    Raises
+    ------
+    ValueError
+        If layers cannot be determined from the input arguments.
+
+    Returns
+    -------
+    arr_sampled : np.ndarray, shape=(N,L) or (N,L,T)
+        Vertex-wise sampled data for each layer.
+
+    """
+
+    # get layers
+    if vtx_pial is not None:
+        if depths is None:
+            raise ValueError("Cortical depths are needed with white and pial surface!")
+        depths = np.asarray(depths, dtype=np.float64)
+        vtx_layers = (
+            np.asarray(vtx)[:, None, :] * (1 - depths[None, :, None])
+            + np.asarray(vtx_pial)[:, None, :] * depths[None, :, None]
+        )
+    elif isinstance(vtx, (list, tuple)):
+        vtx_layers = np.stack(vtx, axis=1)
+    else:
+        raise ValueError("Layers must be given as list or by white and pial surface!")
+
+    nv, nl, _ = np.shape(vtx_layers)
+    shape_out = (nv, nl) + tuple(np.shape(arr)[3:])
+
+    # transform all layers to voxel space at once
+    _, ras2vox = vox2ras_tkr(dims, ds)
+    vtx_vox = apply_affine_chunked(ras2vox, vtx_layers.reshape(-1, 3))
+    vtx_vox = vtx_vox.reshape(nv, nl, 3)
+
+    # exclude nans and vertices outside of the volume
+    mask = np.all(np.isfinite(vtx_vox), axis=2)
+    for i, n in enumerate(np.shape(arr)[:3]):
+        mask[vtx_vox[:, :, i] < 0] = 0
+        mask[vtx_vox[:, :, i] > n - 1] = 0
+
+    # sample all layers and time points with one sparse operator per chunk
+    arr_flat = np.reshape(arr, (-1, int(np.prod(shape_out[2:]))))
+    arr_sampled = np.empty((nv, nl, arr_flat.shape[1]))
+    for i in range(0, nv, chunk_size):
+        pts = vtx_vox[i:i + chunk_size].reshape(-1, 3)
+        op = sampling_matrix3d(
+            pts[:, 0], pts[:, 1], pts[:, 2], np.shape(arr)[:3], interpolation
+        )
+        arr_sampled[i:i + chunk_size] = (op @ arr_flat).reshape(
+            -1, nl, arr_flat.shape[1]
+        )
+    arr_sampled[~mask] = np.nan
+    arr_sampled = arr_sampled.reshape(shape_out)
+
+    if file_out:
+        if arr_sampled.ndim == 2:
+            write_hdf5(file_out, arr_sampled[:, None, :])
+        else:
+            write_hdf5(file_out, np.transpose(arr_sampled, (0, 2, 1)))
+
+    return arr_sampled
@@ -4,15 +4,152 @@
 import os
 
 # external inputs
+import numpy as np
 from nibabel.freesurfer.io import read_morph_data, write_morph_data, \
     read_geometry
-from scipy.interpolate import griddata
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
 
 
-def morph2dense(source_sphere, target_sphere, input_morph, path_output):
+class SphereResampler:
+    """Sphere resampler.
+
+    Resampling of vertex-wise data between two spherical surface meshes. A
+    kd-tree of the source sphere is built once and the resampling is
+    expressed as sparse transfer matrix with shape (n_target, n_source), which
+    can be applied to an arbitrary number of overlays at once.
+
+    Parameters
+    ----------
+    source_sphere : str
+        Source surface.
+    target_sphere : str
+        Target surface.
+    method : str, optional
+        Interpolation method (nearest or barycentric). For barycentric
+        interpolation, each target vertex is projected onto the closest
+        triangle of the source mesh. The default is "nearest".
+
+    Raises
+    ------
+    ValueError
+        If `method` is not supported.
+
+    """
+
+    def __init__(self, source_sphere, target_sphere, method="nearest"):
+        self.vtx_source, self.fac_source = read_geometry(source_sphere)
+        self.vtx_target, _ = read_geometry(target_sphere)
+        self.method = method
+        self.tree = cKDTree(self.vtx_source)
+
+        if method == "nearest":
+            self.transfer = self._nearest()
+        elif method == "barycentric":
+            self.transfer = self._barycentric()
+        else:
+            raise ValueError("Unknown interpolation method: " + str(method))
+
+    def __call__(self, arr):
+        """Apply transfer matrix.
+
+        Parameters
+        ----------
+        arr : ndarray, shape=(n_source,) or (n_source, K)
+            Vertex-wise data on the source sphere.
+
+        Returns
+        -------
+        ndarray, shape=(n_target,) or (n_target, K)
+            Vertex-wise data on the target sphere.
+
+        """
+
+        return self.transfer @ np.asarray(arr)
+
+    def _nearest(self):
+        """Transfer matrix for nearest neighbor interpolation."""
+
+        n_target = len(self.vtx_target)
+        _, ind = self.tree.query(self.vtx_target)
+
+        return csr_matrix(
+            (np.ones(n_target), ind, np.arange(n_target + 1)),
+            shape=(n_target, len(self.vtx_source)),
+        )
+
+    def _barycentric(self):
+        """Transfer matrix for barycentric interpolation. Candidate triangles
+        are all faces adjacent to the nearest source vertex. The triangle with
+        the largest minimum barycentric coordinate is chosen and coordinates of
+        vertices outside of all candidates are clipped and renormalized."""
+
+        n_source = len(self.vtx_source)
+        n_target = len(self.vtx_target)
+        n_faces = len(self.fac_source)
+        _, ind = self.tree.query(self.vtx_target)
+
+        # vertex-face associations
+        vfm = csr_matrix(
+            (np.ones(3 * n_faces), (np.ravel(self.fac_source.T),
+                                    np.tile(np.arange(n_faces), 3))),
+            shape=(n_source, n_faces),
+        )
+
+        # expand all (target vertex, candidate face) pairs
+        n_cand = np.diff(vfm.indptr)[ind]
+        row = np.repeat(np.arange(n_target), n_cand)
+        start = np.repeat(vfm.indptr[ind] - np.cumsum(n_cand) + n_cand, n_cand)
+        face = vfm.indices[start + np.arange(len(row))]
+
+        # barycentric coordinates of projected points
+        tris = self.vtx_source[self.fac_source[face]]
+        v0 = tris[:, 1] - tris[:, 0]
+        v1 = tris[:, 2] - tris[:, 0]
+        v2 = self.vtx_target[row] - tris[:, 0]
+        d00 = np.sum(v0 * v0, axis=1)
+        d01 = np.sum(v0 * v1, axis=1)
+        d11 = np.sum(v1 * v1, axis=1)
+        d20 = np.sum(v2 * v0, axis=1)
+        d21 = np.sum(v2 * v1, axis=1)
+        denom = d00 * d11 - d01 * d01
+        denom[denom == 0] = np.nan
+        b1 = (d11 * d20 - d01 * d21) / denom
+        b2 = (d00 * d21 - d01 * d20) / denom
+        bary = np.column_stack((1 - b1 - b2, b1, b2))
+        bary[~np.all(np.isfinite(bary), axis=1)] = -np.inf
+
+        # choose best candidate for each target vertex
+        score = np.min(bary, axis=1)
+        order = np.lexsort((-score, row))
+        first = np.ones(len(row), dtype=bool)
+        first[1:] = row[order][1:] != row[order][:-1]
+        best = order[first]
+
+        bary = np.clip(bary[best], 0, None)
+        bary_sum = np.sum(bary, axis=1)
+
+        # fall back to nearest neighbor if no valid triangle was found
+        invalid = ~(bary_sum > 0)
+        bary[~invalid] /= bary_sum[~invalid, None]
+        bary[invalid] = 0
+        bary[invalid, 0] = 1
+        cols = self.fac_source[face[best]]
+        cols[invalid, 0] = ind[invalid]
+
+        return csr_matrix(
+            (bary.ravel(), cols.ravel(), np.arange(0, 3 * n_target + 1, 3)),
+            shape=(n_target, n_source),
+        )
+
+
+def morph2dense(source_sphere, target_sphere, input_morph, path_output,
+                method="nearest", resampler=None):
     """Morph to dense.
-    
-    This function maps a morphological file from a source to a target surface.
+
+    This function maps morphological files from a source to a target surface.
+    The transfer matrix between both spheres is computed once and applied to
+    all input files at once.
 
     Parameters
     ----------
@@ -20,10 +157,17 @@ def morph2dense(source_sphere, target_sphere, input_morph, path_output):
         Source surface.
     target_sphere : str
         Target surface.
-    input_morph : str
-        Morphological input file.
+    input_morph : str or list
+        Morphological input file or list of files.
     path_output : str
         Path where output is saved.
+    method : str, optional
+        Interpolation method (nearest or barycentric). The default is
+        "nearest".
+    resampler : SphereResampler, optional
+        Precomputed resampler between source and target sphere. If given,
+        `source_sphere`, `target_sphere` and `method` are ignored. The default
+        is None.
 
     Returns
     -------
@@ -35,17 +179,20 @@ def morph2dense(source_sphere, target_sphere, input_morph, path_output):
     if not os.path.exists(path_output):
         os.mkdir(path_output)
 
-    # transform morphological data to dense surfaces
-    pts_sphere_dense, _ = read_geometry(target_sphere)
-    pts_sphere, _ = read_geometry(source_sphere)
+    if isinstance(input_morph, str):
+        input_morph = [input_morph]
+
+    # transfer matrix between spheres
+    if resampler is None:
+        resampler = SphereResampler(source_sphere, target_sphere, method)
 
     # get morphological data
-    morph = read_morph_data(input_morph)
+    morph = np.column_stack([read_morph_data(f) for f in input_morph])
 
     # do the transformation
-    method = "nearest"
-    morph_dense = griddata(pts_sphere, morph, pts_sphere_dense, method)
+    morph_dense = resampler(morph)
 
     # write dense morphological data
-    write_morph_data(os.path.join(path_output, os.path.basename(input_morph)),
-                     morph_dense)
+    for i, f in enumerate(input_morph):
+        write_morph_data(os.path.join(path_output, os.path.basename(f)),
+                         morph_dense[:, i])
@@ -2,12 +2,16 @@
 
 # python standard library inputs
 import os
-import datetime
 
 # external inputs
 import numpy as np
 import nibabel as nb
-import shutil as sh
+from nibabel.freesurfer.io import read_geometry
+
+# local inputs
+from ..io.surf import read_mgh, read_patch, write_mgh
+from ..surface.filter import IterativeNN
+from ..surface.mesh import Mesh
 
 __all__ = ['get_vfs', 'get_weighted_vfs']
 
@@ -18,24 +22,29 @@ def get_vfs(input_sphere, input_white, input_patch, input_aparc, hemi, ecc_real,
     """Get VFS.
 
     The purpose of the following function is to calculate the visual field sign
-    (vfs) map from retinotopy data. The FREESURFER environment has to be set.
-    The function was only tested with an annotation file not converted to the
-    upsampled dense format. However, results seem to be correct and for the
-    moment, nothing is changed. Different smoothing kernels can be set for
-    eccentricity and polar angle. Eccentricity is much smoother and higher
-    filters can be applied. The final visual fieldsign map is saved as
-    <hemi>.fieldsign in the output folder.
+    (vfs) map from retinotopy data. The computation follows mri_fieldsign but
+    is done in-process without a FREESURFER environment. First, complex
+    eccentricity and polar angle maps are smoothed on the white surface by
+    iterative nearest neighbor smoothing (as in mris_fwhm). Different smoothing
+    kernels can be set for eccentricity and polar angle. Eccentricity is much
+    smoother and higher filters can be applied. Then, 2D gradients of both
+    phase maps are computed for each face of the flattened patch and the sign
+    of the Jacobian determinant is mapped to vertices. The resulting map is
+    smoothed and its sign is saved as <hemi>.fieldsign.mgh in the output
+    folder. Vertices outside the patch are set to zero.
 
     Parameters
     ----------
     input_sphere : str
-        Input freesurfer sphere.
+        Input freesurfer sphere. Not used anymore and only kept for backwards
+        compatibility.
     input_white : str
         Input white matter surface.
     input_patch : str
         Flattened patch.
     input_aparc : str
-        Input annotation file <hemi>.aparc.annot
+        Input annotation file <hemi>.aparc.annot. Not used anymore and only
+        kept for backwards compatibility.
     hemi : str
         Hemisphere.
     ecc_real : str
@@ -55,7 +64,9 @@ def get_vfs(input_sphere, input_white, input_patch, input_aparc, hemi, ecc_real,
     fwhm_vfs : float, optional
         Smoothing kernel for vfs calculation input in mm. The default is 8.0.
     cleanup : bool, optional
-        Delete intermediate files.  The default is True.
+        Delete intermediate files. No intermediate files are written anymore
+        and the argument is only kept for backwards compatibility. The default
+        is True.
 
     Returns
     -------
@@ -63,78 +74,85 @@ def get_vfs(input_sphere, input_white, input_patch, input_aparc, hemi, ecc_real,
 
     """
 
-    # set freesurfer path environment
-    os.environ["SUBJECTS_DIR"] = path_output
-
-    # freesurfer subject
-    tmp1 = np.random.randint(0, 10, 5)
-    tmp1 = ''.join(str(i) for i in tmp1)
-    tmp2 = datetime.datetime.now().strftime("%S%f")
-    tmp_string = tmp1 + tmp2
-    sub = "tmp_" + tmp_string
-
     # make output folder
     if not os.path.exists(path_output):
         os.mkdir(path_output)
 
-    # mimic freesurfer folder structure (with some additional folder for intermediate files)
-    path_sub = os.path.join(path_output, sub)
-    path_surf = os.path.join(path_sub, "surf")
-    path_label = os.path.join(path_sub, "label")
-
-    if not os.path.exists(path_sub):
-        os.makedirs(path_sub)
-    else:
-        raise FileExistsError("Temporary folder already exists!")
-
-    os.makedirs(path_surf)
-    os.makedirs(path_label)
-
-    # copy surfaces to mimicked freesurfer folders
-    sh.copyfile(input_white, os.path.join(path_surf, hemi + ".white"))
-    sh.copyfile(input_sphere, os.path.join(path_surf, hemi + ".sphere"))
-    sh.copyfile(input_patch,
-                os.path.join(path_surf, hemi + ".occip.patch.flat"))
-    sh.copyfile(ecc_real, os.path.join(path_surf, hemi + ".ecc_real.mgh"))
-    sh.copyfile(ecc_imag, os.path.join(path_surf, hemi + ".ecc_imag.mgh"))
-    sh.copyfile(pol_real, os.path.join(path_surf, hemi + ".pol_real.mgh"))
-    sh.copyfile(pol_imag, os.path.join(path_surf, hemi + ".pol_imag.mgh"))
-    sh.copyfile(input_aparc, os.path.join(path_label, hemi + ".aparc.annot"))
-
-    # smooth surface
-    input_data = ["ecc_real", "ecc_imag", "pol_real", "pol_imag"]
-    input_fwhm = [fwhm_ecc, fwhm_ecc, fwhm_pol, fwhm_pol]
-    for i in range(len(input_data)):
-        os.system("mris_fwhm" +
-                  " --s " + sub +
-                  " --hemi " + hemi +
-                  " --smooth-only " +
-                  " --fwhm " + str(input_fwhm[i]) +
-                  " --i " + os.path.join(path_surf,
-                                         hemi + "." + input_data[i] + ".mgh") +
-                  " --o " + os.path.join(path_surf, hemi + "." + input_data[i] +
-                                         "_smooth.mgh"))
-
-    # file names of smoothed eccentricity and polar angle files
-    ecc_real = os.path.join(path_surf, hemi + "." + input_data[0] + "_smooth.mgh")
-    ecc_imag = os.path.join(path_surf, hemi + "." + input_data[1] + "_smooth.mgh")
-    pol_real = os.path.join(path_surf, hemi + "." + input_data[2] + "_smooth.mgh")
-    pol_imag = os.path.join(path_surf, hemi + "." + input_data[3] + "_smooth.mgh")
-
-    # create fiedsign map
-    os.system("mri_fieldsign" +
-              " --s " + sub +
-              " --hemi " + hemi +
-              " --patch occip.patch.flat" +
-              " --new " +
-              " --eccen " + ecc_real + " " + ecc_imag +
-              " --polar " + pol_real + " " + pol_imag +
-              " --fs " + os.path.join(path_output, hemi + ".fieldsign.mgh") +
-              " --fwhm " + str(fwhm_vfs))
-
-    # delete intermediate files
-    if cleanup:
-        sh.rmtree(path_sub, ignore_errors=True)
+    # load surface and patch
+    vtx, fac = read_geometry(input_white)
+    x, y, _, ind = read_patch(input_patch)
+
+    # smooth complex eccentricity and polar angle maps
+    nn = IterativeNN(vtx, fac)
+    vtx_area = np.sum(Mesh(vtx, fac).face_areas) / len(vtx)
+    ecc = _smooth(nn, read_mgh(ecc_real)[0], fwhm_ecc, vtx_area) + \
+        1j * _smooth(nn, read_mgh(ecc_imag)[0], fwhm_ecc, vtx_area)
+    pol = _smooth(nn, read_mgh(pol_real)[0], fwhm_pol, vtx_area) + \
+        1j * _smooth(nn, read_mgh(pol_imag)[0], fwhm_pol, vtx_area)
+
+    # only keep faces which are completely contained in the patch
+    in_patch = np.zeros(len(vtx), dtype=bool)
+    in_patch[ind] = True
+    fac_patch = fac[np.all(in_patch[fac], axis=1)]
+
+    # flat coordinates for all vertices
+    pts = np.zeros((len(vtx), 2))
+    pts[ind, 0] = x
+    pts[ind, 1] = y
+
+    # face-wise jacobian of the (eccentricity, polar angle) map
+    grad_ecc, area = _face_gradient(pts, fac_patch, ecc)
+    grad_pol, _ = _face_gradient(pts, fac_patch, pol)
+    jac = grad_ecc[:, 0] * grad_pol[:, 1] - grad_ecc[:, 1] * grad_pol[:, 0]
+
+    # area-weighted average of face signs at each vertex
+    vfs = np.zeros(len(vtx))
+    vfs_area = np.zeros(len(vtx))
+    for i in range(3):
+        vfs += np.bincount(fac_patch[:, i], np.sign(jac) * area, len(vtx))
+        vfs_area += np.bincount(fac_patch[:, i], area, len(vtx))
+    vfs[vfs_area > 0] /= vfs_area[vfs_area > 0]
+
+    # smooth and binarize fieldsign map
+    vfs = np.sign(_smooth(nn, vfs, fwhm_vfs, vtx_area))
+    vfs[~in_patch] = 0
+
+    write_mgh(os.path.join(path_output, hemi + ".fieldsign.mgh"), vfs)
+
+
+def _smooth(nn, arr, fwhm, vtx_area):
+    """Iterative nearest neighbor smoothing. The number of iterations is
+    computed from the FWHM and the average vertex area as in mris_fwhm."""
+
+    if not fwhm:
+        return arr
+
+    gstd = fwhm / np.sqrt(np.log(256.0))
+    n_iter = np.floor(
+        1.14 * (4 * np.pi * gstd ** 2) / (7 * np.sqrt(3) * vtx_area) + 0.5
+    ).astype(int)
+
+    return nn.apply(arr, n_iter) if n_iter > 0 else arr
+
+
+def _face_gradient(pts, fac, arr):
+    """Face-wise 2D gradient of a phase map given as complex array. Phase
+    differences along edges are wrapped to [-pi, pi]."""
+
+    d1 = pts[fac[:, 1]] - pts[fac[:, 0]]
+    d2 = pts[fac[:, 2]] - pts[fac[:, 0]]
+    f1 = np.angle(arr[fac[:, 1]] * np.conj(arr[fac[:, 0]]))
+    f2 = np.angle(arr[fac[:, 2]] * np.conj(arr[fac[:, 0]]))
+
+    # solve [d1; d2] * g = [f1; f2] for each face
+    det = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+    area = np.abs(det) / 2
+    det[det == 0] = np.inf
+    grad = np.zeros((len(fac), 2))
+    grad[:, 0] = (f1 * d2[:, 1] - f2 * d1[:, 1]) / det
+    grad[:, 1] = (f2 * d1[:, 0] - f1 * d2[:, 0]) / det
+
+    return grad, area
 
 
 def get_weighted_vfs(input_vfs, input_snr, hemi, path_output):
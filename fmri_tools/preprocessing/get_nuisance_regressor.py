@@ -9,11 +9,23 @@ import nibabel as nb
 import matplotlib.pyplot as plt
 
 
-def get_nuisance_regressor(file_in, wm_mask, csf_mask, path_output):
+def get_nuisance_regressor(file_in, wm_mask, csf_mask, path_output, n_compcor=0,
+                           brain_mask=None, tcompcor_fraction=0.02, t_block=64,
+                           seed=0):
     """Get nuisance regressor.
-    
-    This function creates nuisance regressors from a functional time series 
-    using wm and csf masks.    
+
+    This function creates nuisance regressors from a functional time series
+    using wm and csf masks. All voxels within the union of masks are gathered
+    once into a contiguous voxel x time point array. The time series is read
+    in blocks of volumes so that the full 4D array is never loaded into memory.
+    Mean wm and csf signals are computed by a single reduction of the gathered
+    array. Optionally, aCompCor components (principal components of the
+    combined wm and csf time series) and tCompCor components (principal
+    components of the voxels with highest temporal standard deviation) are
+    computed from the same array using a randomized SVD. The mean wm and csf
+    signals are saved in nuisance_regressor.txt. The full regressor table with
+    column names is saved in nuisance_regressor.tsv and can be regressed out
+    with `ScaleTimeseries.regress_out`.
 
     Parameters
     ----------
@@ -25,34 +37,83 @@ def get_nuisance_regressor(file_in, wm_mask, csf_mask, path_output):
         CSF mask registered to the time series.
     path_output : str
         Path where output is saved.
+    n_compcor : int, optional
+        Number of aCompCor and tCompCor components. The default is 0.
+    brain_mask : str, optional
+        Brain mask used for the voxel selection of tCompCor, i.e., voxels are
+        selected within the brain mask only. If not given, voxels are selected
+        within the wm and csf masks. Voxels with zero temporal standard
+        deviation are never selected. The default is None.
+    tcompcor_fraction : float, optional
+        Fraction of voxels with highest temporal standard deviation used for
+        tCompCor. The default is 0.02.
+    t_block : int, optional
+        Number of volumes which are read at once. The default is 64.
+    seed : int, optional
+        Seed of the random number generator for the randomized SVD. The default
+        is 0.
 
     Returns
     -------
-    None.
-    
+    nuisance_regressor : np.ndarray, shape=(T,K)
+        Regressor table.
+    names : list
+        Column names of the regressor table.
+
     """
 
     # make output folder
     if not os.path.exists(path_output):
         os.mkdir(path_output)
 
-    # get mean signal in mask
-    wm_array = nb.load(wm_mask).get_fdata()
-    csf_array = nb.load(csf_mask).get_fdata()
+    # get masks
+    wm_array = np.asarray(nb.load(wm_mask).dataobj) == 1
+    csf_array = np.asarray(nb.load(csf_mask).dataobj) == 1
+    mask = wm_array | csf_array
+    tcompcor_mask = mask
+    if n_compcor and brain_mask:
+        tcompcor_mask = np.asarray(nb.load(brain_mask).dataobj) > 0
+        mask = mask | tcompcor_mask
 
-    # make regressor
-    func_array = nb.load(file_in).get_fdata()
-    nt = np.shape(func_array)[3]
+    # gather all time series in mask
+    coords = np.nonzero(mask)
+    arr = _gather(file_in, coords, t_block)
+    is_wm = wm_array[coords]
+    is_csf = csf_array[coords]
+    is_tcompcor = tcompcor_mask[coords]
 
     # get ROI mean signal
-    nuisance_regressor = np.zeros((nt, 2))
-    for i in range(nt):
-        nuisance_regressor[i, 0] = np.mean(func_array[:, :, :, i][wm_array == 1])
-        nuisance_regressor[i, 1] = np.mean(func_array[:, :, :, i][csf_array == 1])
+    nuisance_regressor = [np.mean(arr[is_wm], axis=0), np.mean(arr[is_csf], axis=0)]
+    names = ["wm", "csf"]
+
+    # compcor
+    if n_compcor:
+        rng = np.random.default_rng(seed)
+        arr = _detrend(arr)
+
+        # acompcor
+        comp = _randomized_svd(arr[is_wm | is_csf], n_compcor, rng)
+        nuisance_regressor.extend(comp.T)
+        names.extend(["acompcor_" + str(i) for i in range(comp.shape[1])])
+
+        # tcompcor (voxels with zero variance are excluded)
+        arr_std = np.std(arr, axis=1)
+        ind = np.flatnonzero(is_tcompcor & (arr_std > 0))
+        n_voxel = int(np.ceil(tcompcor_fraction * len(ind)))
+        ind = ind[np.argsort(arr_std[ind])[::-1]][:max(n_compcor, n_voxel)]
+        arr_t = arr[ind] / arr_std[ind, np.newaxis]
+        comp = _randomized_svd(arr_t, n_compcor, rng)
+        nuisance_regressor.extend(comp.T)
+        names.extend(["tcompcor_" + str(i) for i in range(comp.shape[1])])
+
+    nuisance_regressor = np.column_stack(nuisance_regressor)
 
     # save regressor
     np.savetxt(os.path.join(path_output, "nuisance_regressor.txt"),
-               nuisance_regressor, fmt='%.7e', delimiter='\t')
+               nuisance_regressor[:, :2], fmt='%.7e', delimiter='\t')
+    np.savetxt(os.path.join(path_output, "nuisance_regressor.tsv"),
+               nuisance_regressor, fmt='%.7e', delimiter='\t',
+               header="\t".join(names), comments="")
 
     # plot regressor
     plt.figure(1, figsize=(12, 6))
@@ -70,3 +131,57 @@ def get_nuisance_regressor(file_in, wm_mask, csf_mask, path_output):
     plt.xlabel('Volume')
     plt.xticks(np.arange(0, len(nuisance_regressor[:, 1])))
     plt.savefig(os.path.join(path_output, 'csf_regressor.png'))
+
+    return nuisance_regressor, names
+
+
+def _gather(file_in, coords, t_block):
+    """Gather voxel time series at given coordinates in blocks of volumes."""
+
+    img = nb.load(file_in)
+    nt = img.shape[3]
+    arr = np.empty((len(coords[0]), nt))
+    for t0 in range(0, nt, t_block):
+        t1 = min(t0 + t_block, nt)
+        arr[:, t0:t1] = np.asarray(img.dataobj[..., t0:t1])[coords]
+
+    return arr
+
+
+def _detrend(arr):
+    """Remove mean and linear trend from each row."""
+
+    nt = arr.shape[1]
+    q, _ = np.linalg.qr(np.column_stack((np.ones(nt), np.linspace(-1, 1, nt))))
+
+    return arr - arr.dot(q).dot(q.T)
+
+
+def _randomized_svd(arr, n_components, rng, n_oversamples=10, n_iter=4):
+    """Leading right singular vectors (temporal components) of a voxel x time
+    array computed with a randomized range finder and power iterations [1]_.
+
+    References
+    ----------
+    .. [1] Halko N, et al. Finding structure with randomness: probabilistic
+       algorithms for constructing approximate matrix decompositions. SIAM Rev
+       53(2), 217--288 (2011).
+
+    """
+
+    nv, nt = np.shape(arr)
+    n_components = min(n_components, nv, nt)
+    k = min(n_components + n_oversamples, nv, nt)
+
+    # range of the temporal space
+    q = arr.T.dot(rng.standard_normal((nv, k)))
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(q)
+        q, _ = np.linalg.qr(arr.dot(q))
+        q = arr.T.dot(q)
+    q, _ = np.linalg.qr(q)
+
+    # svd of the projected array
+    _, _, vt = np.linalg.svd(arr.dot(q), full_matrices=False)
+
+    return q.dot(vt[:n_components].T)
@@ -2,35 +2,44 @@
 
 # python standard library inputs
 import os
+from functools import partial
 
 # external inputs
 import numpy as np
 import nibabel as nb
-from scipy.interpolate import InterpolatedUnivariateSpline as Interp
 
 # local inputs
 #from ..io.get_filename import get_filename
 from fmri_tools.io.get_filename import get_filename
+from fmri_tools.preprocessing.timeseries import MaskedTimeseries
+from fmri_tools.utils.interpolation import resampling_matrix1d, resample1d
+from fmri_tools.utils.parallel import apply_parallel
 
 
-def _set_tr(img, tr):
+def _set_tr(header, tr):
     """Helper function to set tr in nifti header."""
     
-    header = img.header.copy()
+    header = header.copy()
     zooms = header.get_zooms()[:3] + (tr,)
     header.set_zooms(zooms)
     
-    return img.__class__(img.get_fdata().copy(), img.affine, header)
+    return header
 
 
 def slice_timing_correction(file_in, TR_old, TR_new, order, mb=None, 
-                            manufacturer="siemens", prefix="a"):
+                            manufacturer="siemens", prefix="a", method="cubic",
+                            n_jobs=1, file_mask=None):
     """Slice timing correction.
 
     This function performs slice timing correction of a nifti time series. For 
     interleaved slice ordering, interleaved ascending is assumed. The correction 
     is done by temporal interpolation of single voxel time series using cubic 
-    interpolation. To omit extrapolation errors at the edges, the first and last 
+    spline or fourier (phase shift) interpolation. All voxels within one slice 
+    share the same acquisition times. Therefore, the interpolation is computed 
+    once as resampling matrix for each slice and applied to all voxels of the 
+    slice by a single matrix multiplication. If a mask is given, only in-mask 
+    voxels of each slice are gathered and interpolated and voxels outside of 
+    the mask are set to zero. To omit extrapolation errors at the edges, the first and last 
     volumes of the time series are appended at the beginning and at the end, 
     respectively. These time points are removed again after the interpolation 
     step. The interpolated time series is sampled onto a regular grid with a 
@@ -58,6 +67,13 @@ def slice_timing_correction(file_in, TR_old, TR_new, order, mb=None,
         Sequence type (siemens, cmrr).
     prefix : str, optional
         Prefix of output time series basename. The default is "a".
+    method : str, optional
+        Interpolation method (cubic, fourier). The default is "cubic".
+    n_jobs : int, optional
+        Number of worker processes used to interpolate chunks of voxels within
+        each slice in parallel (-1: all cores). The default is 1.
+    file_mask : str, optional
+        Binary mask (e.g. from skullstrip_epi). The default is None.
 
     Returns
     -------
@@ -80,12 +96,10 @@ def slice_timing_correction(file_in, TR_old, TR_new, order, mb=None,
     ny = data.header["dim"][2]
     nz = data.header["dim"][3]
     nt = data.header["dim"][4]
-
-    # load array with appended volumes
-    data_array = np.zeros((nx, ny, nz, nt + 2))
-    data_array[:, :, :, 0] = data.get_fdata()[:, :, :, 0]
-    data_array[:, :, :, -1] = data.get_fdata()[:, :, :, -1]
-    data_array[:, :, :, 1:-1] = data.get_fdata()
+    if file_mask is None:
+        mask = np.ones((nx, ny, nz), dtype=bool)
+    else:
+        mask = MaskedTimeseries.load_mask(file_mask)
 
     # effective number of sequentially acquired slices
     mb_package = nz/mb
@@ -135,34 +149,48 @@ def slice_timing_correction(file_in, TR_old, TR_new, order, mb=None,
         int) * TR_new  # number of appended TRs in output array
     t_new = np.arange(-TR_append, TT + TR_append, TR_new)  # grid points of output array
 
-    # temporal interpolation
-    data_array_corrected = np.zeros((nx, ny, nz, len(t_new)))
-    for z in range(nz):
-        print("Slice timing correction for slice: " + str(z + 1) + "/" + str(nz))
-        for x in range(nx):
-            for y in range(ny):
-                t = np.arange(temporal_order[z] * TA - TR_old, temporal_order[z] * TA + (nt + 1) * TR_old, TR_old)
-                cubic_interper = Interp(t, data_array[x, y, slice_order[z], :], k=3)
-                data_array_corrected[x, y, slice_order[z], :] = cubic_interper(t_new)
-
-    # delete appended volumes
+    # only keep output volumes without appended volumes
     vols_keep1 = t_new >= 0
     vols_keep2 = t_new < TT
     vols_keep = vols_keep1 * vols_keep2
-    data_array_corrected = data_array_corrected[:, :, :, vols_keep]
+    t_new = t_new[vols_keep]
+
+    # temporal interpolation with one resampling matrix per slice timing offset
+    mat = {}
+    data_min = np.inf
+    data_max = -np.inf
+    data_array_corrected = np.zeros((nx, ny, nz, len(t_new)))
+    for z in range(nz):
+        print("Slice timing correction for slice: " + str(z + 1) + "/" + str(nz))
+        if temporal_order[z] not in mat:
+            t = np.arange(nt + 2) * TR_old + temporal_order[z] * TA - TR_old
+            mat[temporal_order[z]] = resampling_matrix1d(t, t_new, method)
+
+        # gather in-mask voxels of slice with appended volumes
+        s = slice_order[z]
+        ts = MaskedTimeseries(data.dataobj[:, :, s:s + 1, :], mask[:, :, s:s + 1])
+        if not ts.nv:
+            continue
+        arr_slice = np.pad(ts.data, ((0, 0), (1, 1)), "edge")
+        data_min = min(data_min, np.min(arr_slice))
+        data_max = max(data_max, np.max(arr_slice))
+
+        arr_slice = apply_parallel(
+            partial(resample1d, mat=mat[temporal_order[z]]), arr_slice, n_jobs
+        )
+        data_array_corrected[:, :, s:s + 1, :] = ts.scatter(arr_slice)
 
     # clean corrected array
-    data_min = np.min(data.get_fdata())
-    data_max = np.max(data.get_fdata())
     data_array_corrected[np.isnan(data_array_corrected)] = 0
     data_array_corrected[data_array_corrected < data_min] = data_min
     data_array_corrected[data_array_corrected > data_max] = data_max
+    data_array_corrected[~mask] = 0
 
     # update data header
     data.header["dim"][4] = np.shape(data_array_corrected)[3]
     data.header["datatype"] = 16
 
     # write output
-    output = nb.Nifti1Image(data_array_corrected, data.affine, data.header)
-    output = _set_tr(output, TR_new)
+    output = nb.Nifti1Image(data_array_corrected, data.affine,
+                            _set_tr(data.header, TR_new))
     nb.save(output, os.path.join(path_file, prefix + name_file + ext_file))
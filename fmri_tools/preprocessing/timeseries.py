@@ -1,16 +1,34 @@
 # -*- coding: utf-8 -*-
 
 # python standard library inputs
+import warnings
+from functools import partial
 from math import prod
 
 # external inputs
 import numpy as np
 import nibabel as nb
-from numpy.fft import fft, ifft
-from scipy.ndimage import gaussian_filter
-from nilearn.signal import clean
+from numpy.fft import fft, ifft, rfft, irfft
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import gaussian_filter1d, uniform_filter1d, minimum_filter1d, \
+    maximum_filter1d
+from scipy.signal import butter, sosfiltfilt
 
-__all__ = ["ScaleTimeseries", "FilterTimeseries"]
+# local inputs
+from ..io.vol import nifti_memmap
+from ..utils.parallel import apply_parallel
+
+__all__ = ["ScaleTimeseries", "FilterTimeseries", "MaskedTimeseries", "apply_chunked"]
+
+# edge modes of running filters (scipy.ndimage name -> np.pad name)
+_PAD_MODE = {
+    "shrink": None,
+    "reflect": "symmetric",
+    "mirror": "reflect",
+    "nearest": "edge",
+    "wrap": "wrap",
+    "constant": "constant",
+}
 
 
 class ScaleTimeseries:
@@ -39,46 +57,75 @@ class ScaleTimeseries:
 
     @property
     def arr_mean_repeated(self):
-        """Expanded temporal mean."""
-        return np.repeat(self.arr_mean[:, :, :, np.newaxis], self.nt, axis=3)
+        """Expanded temporal mean (read-only broadcast view)."""
+        return np.broadcast_to(self.arr_mean[:, :, :, np.newaxis], np.shape(self.arr))
 
     @property
     def arr_std_repeated(self):
-        """Expanded temporal standard deviation."""
-        return np.repeat(self.arr_std[:, :, :, np.newaxis], self.nt, axis=3)
+        """Expanded temporal standard deviation (read-only broadcast view)."""
+        return np.broadcast_to(self.arr_std[:, :, :, np.newaxis], np.shape(self.arr))
 
     def psc(self, cutoff_size=None):
         """Percent signal change conversion."""
-        self.arr = self._save_division(self.arr, self.arr_mean_repeated) * 100
+        arr_mean = self.arr_mean[:, :, :, np.newaxis]
+        self.arr = self._save_division(self.arr, arr_mean) * 100
         if cutoff_size:
             self.arr = self._cutoff(100, cutoff_size)
         return self.arr
 
     def normalize(self, cutoff_size=None):
         """Normalize time series."""
-        self.arr = self._save_division(self.arr, self.arr_mean_repeated)
+        arr_mean = self.arr_mean[:, :, :, np.newaxis]
+        self.arr = self._save_division(self.arr, arr_mean)
         if cutoff_size:
             self.arr = self._cutoff(1, cutoff_size)
         return self.arr
 
     def standardize(self, cutoff_size=None):
         """Standardize time series."""
-        self.arr = self._save_division(
-            self.arr - self.arr_mean_repeated, self.arr_std_repeated
-        )
+        arr_mean = self.arr_mean[:, :, :, np.newaxis]
+        arr_std = self.arr_std[:, :, :, np.newaxis]
+        self.arr = self._save_division(self.arr - arr_mean, arr_std)
         if cutoff_size:
             self.arr = self._cutoff(0, cutoff_size)
         return self.arr
 
     def demean(self, cutoff_size=None):
         """Demean time series."""
-        self.arr = self._save_division(
-            self.arr - self.arr_mean_repeated, self.arr_mean_repeated
-        )
+        arr_mean = self.arr_mean[:, :, :, np.newaxis]
+        self.arr = self._save_division(self.arr - arr_mean, arr_mean)
         if cutoff_size:
             self.arr = self._cutoff(0, cutoff_size)
         return self.arr
 
+    def regress_out(self, regressors, keep_mean=True):
+        """Regress nuisance regressors out of the time series. The regression model
+        with intercept is fitted to all voxels at once with one least-squares call.
+
+        Parameters
+        ----------
+        regressors : ndarray, shape=(T,) or (T,K)
+            Regressor table (e.g. from get_nuisance_regressor).
+        keep_mean : bool, optional
+            Keep the temporal mean of the time series. The default is True.
+
+        Returns
+        -------
+        ndarray
+            Residual array.
+
+        """
+        regressors = np.reshape(regressors, (self.nt, -1))
+        regressors = regressors - np.mean(regressors, axis=0)
+        design = np.column_stack((np.ones(self.nt), regressors))
+
+        arr2d = np.reshape(self.arr, (-1, self.nt)).T
+        beta, _, _, _ = np.linalg.lstsq(design, arr2d, rcond=None)
+        if keep_mean:
+            beta[0] = 0
+        self.arr = np.reshape((arr2d - design.dot(beta)).T, np.shape(self.arr))
+        return self.arr
+
     def _cutoff(self, mu, width):
         """Threshold outliers."""
         arr_max = np.max(self.arr, axis=3)
@@ -92,10 +139,11 @@ class ScaleTimeseries:
         return np.divide(arr1, arr2, out=np.zeros_like(arr1), where=arr2 != 0)
 
     @classmethod
-    def from_file(cls, file_data):
-        """Initialize class object from file."""
+    def from_file(cls, file_data, *args, dtype=np.float64):
+        """Initialize class object from file. Additional arguments are passed to the
+        class constructor."""
         data = nb.load(file_data)
-        return cls(data.get_fdata())
+        return cls(data.get_fdata(dtype=dtype), *args)
 
 
 class FilterTimeseries(ScaleTimeseries):
@@ -107,12 +155,16 @@ class FilterTimeseries(ScaleTimeseries):
         4D time series array.
     TR : float
         Repetition time in s.
+    n_jobs : int, optional
+        Number of worker processes used to filter chunks of voxels in parallel
+        (-1: all cores). The default is 1.
 
     """
 
-    def __init__(self, arr, TR):
+    def __init__(self, arr, TR, n_jobs=1):
         super().__init__(arr)
         self.TR = TR
+        self.n_jobs = n_jobs
 
     def detrend(self, cutoff_sec, store_dc=False):
         """Detrend time series by convolving the time series with a gaussian running
@@ -135,11 +187,9 @@ class FilterTimeseries(ScaleTimeseries):
         .. [1] https://lukas-snoek.com/NI-edu/fMRI-introduction/week_4/temporal_preprocessing.html
 
         """
-        arr0 = self.arr_mean_repeated  # dc component
+        arr0 = self.arr_mean[:, :, :, np.newaxis]  # dc component
         sigma = cutoff_sec / (np.sqrt(8 * np.log(2)) * self.TR)  # kernel definition
-        arr_filtered = np.zeros_like(self.arr)
-        for ix, iy, iz in np.ndindex(self.arr.shape[:-1]):
-            arr_filtered[ix, iy, iz] = gaussian_filter(self.arr[ix, iy, iz], sigma)
+        arr_filtered = self._run(partial(_gaussian_lowpass, sigma=sigma), self.arr)
         self.arr = self.arr - arr_filtered  # remove lowpass
         # store dc component
         if store_dc:
@@ -149,8 +199,9 @@ class FilterTimeseries(ScaleTimeseries):
     def lowpass_sma(self, window_size):
         """Filters time series data using a simple moving average (SMA) filter. The SMA
         filter is a simple average of the data points within a user-defined window. The
-        window is centered on each data point. Note that an even filter of size n will
-        effectively have the same filter size as an odd filter of size n+1.
+        window is centered on each data point and shrinks at the edges of the time
+        series. Note that an even filter of size n will effectively have the same filter
+        size as an odd filter of size n+1.
 
         Parameters
         ----------
@@ -163,20 +214,45 @@ class FilterTimeseries(ScaleTimeseries):
             Filtered array.
 
         """
-        # parameters
-        n = int(window_size / 2)  # one-sided window size
-
-        arr2d = self._reshape(self.arr)
-        arr2d_filt = np.zeros_like(arr2d)
-        for t in range(self.nt):
-            if t < n:
-                arr2d_filt[:, t] = np.mean(arr2d[:, : t + n], axis=1)
-            elif t > self.arr.shape[-1] - n:
-                arr2d_filt[:, t] = np.mean(arr2d[:, t - n:], axis=1)
-            else:
-                arr2d_filt[:, t] = np.mean(arr2d[:, t - n: t + n], axis=1)
+        return self.running_filter(2 * int(window_size / 2) + 1, "mean", "shrink")
 
-        return self._reshape_back(arr2d_filt, np.shape(self.arr))
+    def running_filter(self, window_size, func="mean", mode="shrink"):
+        """Filters time series data with a running window along the time axis of all
+        voxels at once. The moving mean is computed with cumulative sums (O(T)), the
+        moving minimum and maximum with running min/max filters and the moving median
+        on a sliding-window view of the padded time series. For even window sizes, the
+        window covers one more time point before than after the center time point.
+
+        Parameters
+        ----------
+        window_size : int
+            Size of the window in time points.
+        func : str, optional (mean | median | min | max)
+            Statistic computed within the window. The default is "mean".
+        mode : str, optional (shrink | reflect | mirror | nearest | wrap | constant)
+            Edge mode. With shrink, windows are truncated at the edges of the time
+            series and only contain valid time points. All other modes extend the
+            time series with the same convention as scipy.ndimage (constant: zeros).
+            The default is "shrink".
+
+        Raises
+        ------
+        ValueError
+            If `func` or `mode` is not supported.
+
+        Returns
+        -------
+        ndarray
+            Filtered array.
+
+        """
+        if func not in ["mean", "median", "min", "max"]:
+            raise ValueError("Unknown running filter: " + str(func))
+        if mode not in _PAD_MODE:
+            raise ValueError("Unknown edge mode: " + str(mode))
+
+        kernel = partial(_running_filter, size=int(window_size), func=func, mode=mode)
+        return self._run(kernel, self.arr)
 
     def lowpass_gaussian(self, sigma, normalize=False):
         """Filters time series data using a Gaussian filter. Thr filter size can be
@@ -197,10 +273,7 @@ class FilterTimeseries(ScaleTimeseries):
         """
         # gaussian filter definition
         x = np.linspace(-int(self.nt / 2), int(self.nt / 2), self.nt) * self.TR
-        f = [
-            1 / (sigma * np.sqrt(2 * np.pi)) * np.exp(-(t**2) / (2 * sigma**2))
-            for t in x
-        ]
+        f = 1 / (sigma * np.sqrt(2 * np.pi)) * np.exp(-(x**2) / (2 * sigma**2))
         f_fft = np.abs(fft(f))
 
         # normalize filter
@@ -257,7 +330,7 @@ class FilterTimeseries(ScaleTimeseries):
 
         f_fft = ((f_fft + f_fft[::-1]) > 0).astype(int)
         if np.all(f_fft == 1):
-            print("No filtering applied.")
+            warnings.warn("No filtering applied.")
             return self.arr
 
         # apply filter in spatial frequency space
@@ -268,6 +341,9 @@ class FilterTimeseries(ScaleTimeseries):
     def bandpass_butterworth(self, cutoff_low=10, cutoff_high=1000):
         """Filters time series data using a Butterworth filter. Optionally, only the
         lowpass or highpass filter can be applied by setting the other cutoff to None.
+        A fifth order filter is designed once and applied forward and backward along
+        the time axis of all voxels at once (same as butterworth filtering in
+        nilearn.signal.clean).
 
         Parameters
         ----------
@@ -283,30 +359,38 @@ class FilterTimeseries(ScaleTimeseries):
 
         """
         # parameters
+        nyq = 0.5 / self.TR
         low_pass = 1.0 / cutoff_low if cutoff_low is not None else None
         high_pass = 1.0 / cutoff_high if cutoff_high is not None else None
+        if low_pass is not None and low_pass >= nyq:
+            low_pass = None
+        if high_pass is not None and high_pass <= 0:
+            high_pass = None
+
+        critical_freq = []
+        if high_pass is not None:
+            btype = "high"
+            critical_freq.append(high_pass / nyq)
+        if low_pass is not None:
+            btype = "low"
+            critical_freq.append(low_pass / nyq)
+        if not critical_freq:
+            warnings.warn("No filtering applied.")
+            return self.arr
+        if len(critical_freq) == 2:
+            btype = "band"
+        else:
+            critical_freq = critical_freq[0]
 
-        arr2d = self._reshape(self.arr)
-        arr2d_filt = np.zeros_like(arr2d)
-        ndata = arr2d.shape[0]
-        for i in range(ndata):
-            # filter parameters can be butterworth, cosine (lowpass not available)
-            # or False. Optionally, the time series can be standardized (zscore) or
-            # converted to a percent signal change (psc).
-            arr2d_filt[i, :] = clean(
-                arr2d[i, :],
-                filter="butterworth",
-                detrend=False,
-                standardize=False,
-                t_r=self.TR,
-                low_pass=low_pass,
-                high_pass=high_pass,
-            )
+        sos = butter(N=5, Wn=critical_freq, btype=btype, output="sos")
+        arr2d_filt = self._run(partial(_sos_filter, sos=sos), self.arr)
 
         return self._reshape_back(arr2d_filt, np.shape(self.arr))
 
     def _apply_filter(self, arr, f_fft):
-        """Apply filter in spatial frequency space.
+        """Apply filter in spatial frequency space. The filter is applied along the
+        time axis of all voxels at once. For symmetric filters, real-input FFTs are
+        used.
 
         Parameters
         ----------
@@ -321,13 +405,28 @@ class FilterTimeseries(ScaleTimeseries):
             Filtered array.
 
         """
-        arr2d = self._reshape(arr)
-        arr2d_filt = np.zeros_like(arr2d)
-        ndata = arr2d.shape[0]
-        for i in range(ndata):
-            arr2d_filt[i, :] = np.real(ifft(fft(arr2d[i, :]) * f_fft))
+        return self._run(partial(_fft_filter, f_fft=f_fft), arr)
 
-        return arr2d_filt
+    def _run(self, func, arr):
+        """Apply a function along the time axis of the array reshaped to 2D. Chunks
+        of voxels are processed in parallel if n_jobs > 1.
+
+        Parameters
+        ----------
+        func : callable
+            Picklable function which maps a 2D array onto a 2D array.
+        arr : ndarray
+            Array to be filtered.
+
+        Returns
+        -------
+        ndarray
+            Filtered array with original shape.
+
+        """
+        arr2d = apply_parallel(func, self._reshape(arr), self.n_jobs)
+
+        return self._reshape_back(arr2d, np.shape(arr))
 
     @staticmethod
     def _reshape(array):
@@ -367,3 +466,204 @@ class FilterTimeseries(ScaleTimeseries):
 
         """
         return np.reshape(array, shape)
+
+
+def _running_filter(arr, size, func, mode, max_elements=2**24):
+    """Running window filter along the last axis (see FilterTimeseries)."""
+    left = size // 2
+    right = size - left - 1
+    if func == "mean" and mode == "shrink":
+        nt = arr.shape[-1]
+        arr_sum = np.zeros(arr.shape[:-1] + (nt + 1,))
+        np.cumsum(arr, axis=-1, out=arr_sum[..., 1:])
+        lo = np.maximum(np.arange(nt) - left, 0)
+        hi = np.minimum(np.arange(nt) + right + 1, nt)
+        return (arr_sum[..., hi] - arr_sum[..., lo]) / (hi - lo)
+    if func == "mean":
+        return uniform_filter1d(arr, size, axis=-1, mode=mode)
+    if func in ["min", "max"]:
+        # edge replication does not change extrema of truncated windows
+        mode = "nearest" if mode == "shrink" else mode
+        f = minimum_filter1d if func == "min" else maximum_filter1d
+        return f(arr, size, axis=-1, mode=mode)
+
+    # moving median in chunks of rows to bound the size of window copies
+    pad = [(0, 0)] * (arr.ndim - 1) + [(left, right)]
+    if mode == "shrink":
+        arr_pad = np.pad(np.asarray(arr, dtype=np.float64), pad, constant_values=np.nan)
+    else:
+        arr_pad = np.pad(arr, pad, mode=_PAD_MODE[mode])
+    arr_pad = arr_pad.reshape(-1, arr_pad.shape[-1])
+    res = np.empty((len(arr_pad), arr.shape[-1]))
+    step = max(1, max_elements // (arr.shape[-1] * size))
+    for i in range(0, len(arr_pad), step):
+        win = sliding_window_view(arr_pad[i:i + step], size, axis=-1)
+        res[i:i + step] = np.nanmedian(win, axis=-1)
+    return res.reshape(arr.shape)
+
+
+def _gaussian_lowpass(arr, sigma):
+    """Gaussian lowpass along the last axis."""
+    return gaussian_filter1d(arr, sigma, axis=-1)
+
+
+def _sos_filter(arr, sos):
+    """Forward-backward filtering along the last axis."""
+    return sosfiltfilt(sos, arr, axis=-1)
+
+
+def _fft_filter(arr, f_fft):
+    """Filter in frequency space along the last axis. For symmetric filters,
+    real-input FFTs are used."""
+    nt = arr.shape[-1]
+    if np.allclose(f_fft[1:], f_fft[:0:-1]):
+        return irfft(rfft(arr, axis=-1) * f_fft[: nt // 2 + 1], n=nt, axis=-1)
+
+    return np.real(ifft(fft(arr, axis=-1) * f_fft, axis=-1))
+
+
+class MaskedTimeseries:
+    """Container for mask-compressed fmri time series data. All in-mask voxels are
+    gathered into a contiguous 2D array with dimensions voxel x time point together
+    with an index map into the 4D volume. Scaling and filtering methods of
+    ScaleTimeseries and FilterTimeseries are applied on the compressed array and data
+    is only scattered back to 4D on write. The index map can be reused to gather
+    further time series with the same mask.
+
+    Parameters
+    ----------
+    arr : np.ndarray or nibabel ArrayProxy
+        4D time series array or (memory-mapped) image data object. If None, only
+        the index map is created and time series can be gathered later.
+    mask : np.ndarray
+        3D binary mask (e.g. the brain mask written by skullstrip_epi).
+    block_size : int, optional
+        Number of slices along the z-axis which are read at once, i.e., an image
+        data object is never loaded into memory as a whole. The default is 8.
+
+    """
+
+    def __init__(self, arr, mask, block_size=8):
+        self.mask = np.asarray(mask) > 0
+        self.shape = self.mask.shape if arr is None else np.shape(arr)
+        self.coords = np.nonzero(self.mask)
+        self.data = None if arr is None else self.gather(arr, block_size)
+
+    @property
+    def nv(self):
+        """Number of in-mask voxels."""
+        return len(self.coords[0])
+
+    def gather(self, arr, block_size=8):
+        """Gather in-mask voxels of a 4D array or image data object with the same
+        index map. Data is read blockwise along the z-axis."""
+        data = np.empty((self.nv,) + np.shape(arr)[3:])
+        for z0 in range(0, self.mask.shape[2], block_size):
+            z1 = min(z0 + block_size, self.mask.shape[2])
+            ind = (self.coords[2] >= z0) & (self.coords[2] < z1)
+            if not np.any(ind):
+                continue
+            arr_block = np.asarray(arr[:, :, z0:z1])
+            data[ind] = arr_block[self.coords[0][ind], self.coords[1][ind],
+                                  self.coords[2][ind] - z0]
+        return data
+
+    def scatter(self, data=None, fill_value=0):
+        """Scatter compressed data (default: stored data) back to a 4D array."""
+        data = self.data if data is None else data
+        arr = np.full(self.mask.shape + np.shape(data)[1:], fill_value, data.dtype)
+        arr[self.coords] = data
+        return arr
+
+    def apply(self, method, *args, TR=None, n_jobs=1, **kwargs):
+        """Apply a method of ScaleTimeseries (or FilterTimeseries if TR is given) to
+        the compressed array. Stored data is updated and returned."""
+        arr = self.data[:, np.newaxis, np.newaxis, :]
+        ts = FilterTimeseries(arr, TR, n_jobs) if TR is not None else ScaleTimeseries(arr)
+        self.data = np.reshape(getattr(ts, method)(*args, **kwargs), (self.nv, -1))
+        return self.data
+
+    def to_file(self, file_out, affine, header=None, dtype=np.float32):
+        """Scatter stored data into a pre-allocated nifti file on disk."""
+        shape = self.mask.shape + np.shape(self.data)[1:]
+        with nifti_memmap(file_out, shape, affine, header, dtype) as arr_out:
+            for z in np.unique(self.coords[2]):
+                ind = self.coords[2] == z
+                arr_slice = np.zeros(shape[:2] + shape[3:], dtype=dtype)
+                arr_slice[self.coords[0][ind], self.coords[1][ind]] = self.data[ind]
+                arr_out[:, :, z] = arr_slice
+
+    @staticmethod
+    def load_mask(file_mask):
+        """Load 3D binary mask from file (first volume of 4D masks)."""
+        mask = np.asarray(nb.load(file_mask).dataobj) > 0
+        return mask[:, :, :, 0] if mask.ndim > 3 else mask
+
+    @classmethod
+    def from_file(cls, file_data, file_mask, block_size=8):
+        """Initialize class object from file. In-mask voxels are gathered blockwise
+        along the z-axis so that the full 4D array is never loaded into memory."""
+        img = nb.load(file_data)
+        return cls(img.dataobj, cls.load_mask(file_mask), block_size)
+
+
+def apply_chunked(file_in, file_out, method, *args, TR=None, block_size=8,
+                  dtype=np.float32, n_jobs=1, file_mask=None, **kwargs):
+    """Apply a scaling or filtering method out-of-core. The input time series is
+    streamed in blocks of slices along the z-axis from the (memory-mapped where
+    possible) image data object. Each block is processed independently and written
+    into a pre-allocated output nifti file on disk. Therefore, peak memory is bounded
+    by the block size and does not depend on the size of the whole run. All methods
+    of ScaleTimeseries and FilterTimeseries operate voxel-wise along the time axis,
+    so that the result is the same as applying the method to the whole array. If a
+    mask is given, only in-mask voxels are gathered into a MaskedTimeseries and
+    processed at once. Voxels outside of the mask are set to zero.
+
+    Parameters
+    ----------
+    file_in : str
+        File name of 4D time series.
+    file_out : str
+        File name of output time series.
+    method : str
+        Name of the method in ScaleTimeseries or FilterTimeseries, e.g. "psc" or
+        "detrend".
+    *args
+        Positional arguments passed to the method.
+    TR : float, optional
+        Repetition time in s. If given, FilterTimeseries is used. The default is
+        None.
+    block_size : int, optional
+        Number of slices along the z-axis which are processed at once. The default
+        is 8.
+    dtype : type, optional
+        Data type for processing and of the output file. The default is np.float32.
+    n_jobs : int, optional
+        Number of worker processes for filtering methods. The default is 1.
+    file_mask : str, optional
+        File name of a binary mask (e.g. from skullstrip_epi). The default is
+        None.
+    **kwargs
+        Keyword arguments passed to the method.
+
+    Returns
+    -------
+    None.
+
+    """
+    img = nb.load(file_in)
+    if file_mask is not None:
+        ts = MaskedTimeseries.from_file(file_in, file_mask, block_size)
+        ts.data = ts.data.astype(dtype)
+        ts.apply(method, *args, TR=TR, n_jobs=n_jobs, **kwargs)
+        ts.to_file(file_out, img.affine, img.header, dtype)
+        return
+
+    nz = img.shape[2]
+    with nifti_memmap(file_out, img.shape, img.affine, img.header, dtype) as arr_out:
+        for z0 in range(0, nz, block_size):
+            z1 = min(z0 + block_size, nz)
+            arr = np.asarray(img.dataobj[:, :, z0:z1, :], dtype=dtype)
+            ts = (FilterTimeseries(arr, TR, n_jobs) if TR is not None
+                  else ScaleTimeseries(arr))
+            arr_out[:, :, z0:z1, :] = getattr(ts, method)(*args, **kwargs)
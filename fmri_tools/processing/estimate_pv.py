@@ -6,16 +6,25 @@ import os
 # external inputs
 import numpy as np
 import nibabel as nb
+from scipy.sparse import csr_matrix
 
 
-def estimate_pv(input_target, input_border, path_output, name_output):
+def estimate_pv(input_target, input_border, path_output, name_output,
+                normalize=False):
     """Estimate PV.
 
     This function estimates the partial volume contribution in each image voxel 
     of a target image from an upsampled binary image depicting the GM/WM or 
     GM/CSF border. Partial voluming is estimated by downsampling the binary 
     image using a moving-average like algorithm and calculating the ratio of 
-    both binary elements within each target voxel.    
+    both binary elements within each target voxel. The fractional overlap 
+    weights of high-resolution voxels at the border of each target voxel are 
+    separable. Therefore, the block-wise weighted sums are computed by 
+    successive contractions of the border image with one sparse weight matrix 
+    per axis. Nans in the border image are excluded and, by default, the 
+    weighted sum is divided by the number of valid voxels in the block. 
+    Optionally, the weighted sum is normalized by the sum of weights of valid 
+    voxels instead.
 
     Parameters
     ----------
@@ -27,6 +36,9 @@ def estimate_pv(input_target, input_border, path_output, name_output):
         Path where output is saved.
     name_output : str
         Basename of output image.
+    normalize : bool, optional
+        Normalize by the sum of weights instead of the number of valid voxels.
+        The default is False.
 
     Returns
     -------
@@ -42,113 +54,65 @@ def estimate_pv(input_target, input_border, path_output, name_output):
     # downsampling parameters
     matrix_up = border.header["dim"][1:4]
     matrix_down = target.header["dim"][1:4]
-    magn_factor = matrix_up / matrix_down
-
-    # sampling steps
-    p = np.arange(0, matrix_down[0] * magn_factor[0], magn_factor[0])
-    q = np.arange(0, matrix_down[1] * magn_factor[1], magn_factor[1])
-    r = np.arange(0, matrix_down[2] * magn_factor[2], magn_factor[2])
-
-    # initialise matrices
-    M = np.zeros(target.header["dim"][1:4])
-    start_weight = np.zeros(3)
-    end_weight = np.zeros(3)
-
-    # downsampling using a moving-average like algorithm
-    for i in range(len(p)):
-
-        # weightings (start_weight)
-        if np.mod(p[i], 1) != 0:
-            start_weight[0] = 1 - np.mod(p[i], 1)
-        else:
-            start_weight[0] = 1
-
-        # weightings (end_weight)
-        if i == len(p) - 1:
-            end_weight[0] = 1
-        else:
-            if np.mod(p[i + 1], 1) != 0:
-                end_weight[0] = np.mod(p[i + 1], 1)
-            else:
-                end_weight[0] = 1
-
-        for j in range(len(q)):
-
-            # weightings (start_weight)
-            if np.mod(q[j], 1) != 0:
-                start_weight[1] = 1 - np.mod(q[j], 1)
-            else:
-                start_weight[1] = 1
-
-            # weightings (end_weight)
-            if j == len(q) - 1:
-                end_weight[1] = 1
-            else:
-                if np.mod(q[j + 1], 1) != 0:
-                    end_weight[1] = np.mod(q[j + 1], 1)
-                else:
-                    end_weight[1] = 1
-
-            for k in range(len(r)):
-
-                # weightings (start_weight)
-                if np.mod(r[k], 1) != 0:
-                    start_weight[2] = 1 - np.mod(r[k], 1)
-                else:
-                    start_weight[2] = 1
-
-                # weightings (end_weight)
-                if k == len(r) - 1:
-                    end_weight[2] = 1
-                else:
-                    if np.mod(r[k + 1], 1) != 0:
-                        end_weight[2] = np.mod(r[k + 1], 1)
-                    else:
-                        end_weight[2] = 1
-
-                # p-coordinates
-                if i == len(p) - 1:
-                    x = np.arange(np.round(p[-1] - 0.5), matrix_up[0],
-                                  1).astype(int)
-                else:
-                    x = np.arange(np.round(p[i] - 0.5),
-                                  np.round(p[i + 1] - 0.5), 1).astype(int)
-
-                # q-coordinates
-                if j == len(q) - 1:
-                    y = np.arange(np.round(q[-1] - 0.5), matrix_up[1],
-                                  1).astype(int)
-                else:
-                    y = np.arange(np.round(q[j] - 0.5),
-                                  np.round(q[j + 1] - 0.5), 1).astype(int)
-
-                # r-coordinates
-                if k == len(r) - 1:
-                    z = np.arange(np.round(r[-1] - 0.5), matrix_up[2],
-                                  1).astype(int)
-                else:
-                    z = np.arange(np.round(r[k] - 0.5),
-                                  np.round(r[k + 1] - 0.5), 1).astype(int)
-
-                # define submatrix
-                X = border_array[x, :, :]
-                X = X[:, y, :]
-                X = X[:, :, z]
-
-                # apply weightings
-                X[0, :, :] = start_weight[0] * X[0, :, :]
-                X[:, 0, :] = start_weight[1] * X[:, 0, :]
-                X[:, :, 0] = start_weight[2] * X[:, :, 0]
-                X[-1, :, :] = end_weight[0] * X[-1, :, :]
-                X[:, -1, :] = end_weight[1] * X[:, -1, :]
-                X[:, :, -1] = end_weight[2] * X[:, :, -1]
-
-                X = np.reshape(X, np.size(X))
-                X = X[~np.isnan(X)]
-
-                # voxel value in target space
-                M[i, j, k] = np.sum(X) / len(X)
+
+    # weight matrices for each axis
+    weights = []
+    blocks = []
+    for n_up, n_down in zip(matrix_up, matrix_down):
+        w, b = _block_weights(n_up, n_down)
+        weights.append(w)
+        blocks.append(b)
+
+    # downsampling using separable weighted block sums
+    valid = ~np.isnan(border_array)
+    border_array[~valid] = 0
+    M = _contract(border_array, weights)
+    if normalize:
+        norm = _contract(valid.astype(np.float64), weights)
+    else:
+        norm = _contract(valid.astype(np.float64), blocks)
+    M = np.divide(M, norm, out=np.full_like(M, np.nan), where=norm != 0)
 
     # save data
     output = nb.Nifti1Image(M, target.affine, target.header)
     nb.save(output, os.path.join(path_output, name_output + "_pve.nii"))
+
+
+def _block_weights(n_up, n_down):
+    """Sparse matrices of fractional overlap weights and block membership of
+    high-resolution voxels for each low-resolution voxel along one axis."""
+
+    magn_factor = n_up / n_down
+    p = np.arange(0, n_down * magn_factor, magn_factor)
+
+    # block boundaries
+    start = np.round(p - 0.5).astype(int)
+    end = np.append(start[1:], n_up)
+
+    # partial weights of first and last voxel in each block
+    start_weight = np.where(np.mod(p, 1) != 0, 1 - np.mod(p, 1), 1)
+    end_weight = np.ones(len(p))
+    end_weight[:-1] = np.where(np.mod(p[1:], 1) != 0, np.mod(p[1:], 1), 1)
+
+    n = end - start
+    row = np.repeat(np.arange(len(p)), n)
+    col = np.arange(np.sum(n)) - np.repeat(np.cumsum(n) - n, n) + np.repeat(start, n)
+    w = np.ones(len(col))
+    w[np.cumsum(n) - n] *= start_weight
+    w[np.cumsum(n) - 1] *= end_weight
+
+    shape = (len(p), n_up)
+    return csr_matrix((w, (row, col)), shape=shape), \
+        csr_matrix((np.ones(len(col)), (row, col)), shape=shape)
+
+
+def _contract(arr, mats):
+    """Apply one sparse matrix along each axis of a 3D array."""
+
+    for axis, mat in enumerate(mats):
+        arr = np.moveaxis(arr, axis, 0)
+        shape = np.shape(arr)
+        arr = mat.dot(arr.reshape(shape[0], -1)).reshape((-1,) + shape[1:])
+        arr = np.moveaxis(arr, 0, axis)
+
+    return arr
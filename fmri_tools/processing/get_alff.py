@@ -4,25 +4,85 @@
 import os
 
 # external inputs
+import numpy as np
 import nibabel as nb
+from numpy.fft import rfft, rfftfreq
 from scipy.stats import zscore
-from nipype.interfaces.afni.preprocess import Bandpass
-from nipype.interfaces.afni.utils import TStat, Calc
 
 # local inputs
 from ..io.get_filename import get_filename
 
 
-def get_alff(file_in, TR, path_output, hp_freq=0.01, lp_freq=0.08, cleanup=True):
+def compute_alff(arr, TR, hp_freq=0.01, lp_freq=0.08):
+    """Compute ALFF and the total temporal standard deviation of time series.
+
+    Both quantities are computed in one pass from a batched real FFT along the
+    time axis. Before the FFT, a quadratic trend is removed (same as AFNI
+    3dBandpass). By Parseval's theorem, the standard deviation of the ideal
+    bandpass filtered time series is given by the power within the frequency
+    band. The total standard deviation is computed from the linearly detrended
+    time series (same as AFNI 3dTstat -stdev).
+
+    Parameters
+    ----------
+    arr : np.ndarray, shape=(V,T)
+        Voxel-wise time series.
+    TR : float
+        Repetition time in s.
+    hp_freq : float, optional
+        Highpass cutoff frequency in Hz. The default is 0.01.
+    lp_freq : float, optional
+        Lowpass cutoff frequency in Hz. The default is 0.08.
+
+    Returns
+    -------
+    alff : np.ndarray, shape=(V,)
+        Standard deviation of bandpass filtered time series.
+    std_total : np.ndarray, shape=(V,)
+        Standard deviation of unfiltered time series.
+
+    """
+
+    arr = np.asarray(arr, dtype=np.float64)
+    nt = arr.shape[1]
+
+    # orthonormal polynomial basis up to second order
+    t = np.linspace(-1, 1, nt)
+    q, _ = np.linalg.qr(np.column_stack((np.ones(nt), t, t**2)))
+
+    # linear and quadratic detrending
+    arr_lin = arr - arr.dot(q[:, :2]).dot(q[:, :2].T)
+    arr_quad = arr_lin - np.outer(arr_lin.dot(q[:, 2]), q[:, 2])
+
+    # one-sided power spectrum
+    freq = rfftfreq(nt, TR)
+    w = np.full(len(freq), 2.0)
+    w[0] = 1
+    if not np.mod(nt, 2):
+        w[-1] = 1
+    w[(freq < hp_freq) | (freq > lp_freq)] = 0
+    power = np.abs(rfft(arr_quad, axis=1)) ** 2
+
+    alff = np.sqrt(power.dot(w) / (nt * (nt - 1)))
+    std_total = np.sqrt(np.sum(arr_lin**2, axis=1) / (nt - 1))
+
+    return alff, std_total
+
+
+def get_alff(file_in, TR, path_output, hp_freq=0.01, lp_freq=0.08, cleanup=True,
+             file_mask=None, block_size=8):
     """Get ALFF.
 
-    This function calculates ALFF and fALFF from a preprocessed (motion 
-    correction, nuisance regression, etc.) resting-state time series. ALFF is 
-    computed by bandpass filtering the time series and computing the voxel-wise 
-    standard deviation of the filtered time series. fALFF is computed by 
-    dividing ALFF by the voxel-wise standard deviation of the unfiltered time 
-    series. Additionally, ALFF and fALFF are expressed in z-score. This function 
-    follows the script found in [1].
+    This function calculates ALFF, fALFF and mALFF from a preprocessed (motion
+    correction, nuisance regression, etc.) resting-state time series. ALFF is
+    the voxel-wise standard deviation of the bandpass filtered time series.
+    fALFF is computed by dividing ALFF by the voxel-wise standard deviation of
+    the unfiltered time series. mALFF is ALFF divided by its mean within the
+    mask. Additionally, ALFF and fALFF are expressed in z-score. This function
+    follows the script found in [1]. All quantities are computed in-process
+    (see `compute_alff`) from blocks of slices along the z-axis, which are
+    streamed from the image data object. Therefore, the whole time series is
+    never loaded into memory.
 
     Parameters
     ----------
@@ -37,7 +97,15 @@ def get_alff(file_in, TR, path_output, hp_freq=0.01, lp_freq=0.08, cleanup=True)
     lp_freq : float, optional
         Lowpass cutoff frequency in Hz. The default is 0.08.
     cleanup : bool, optional
-        Delete intermediate files. The default is True.
+        Delete intermediate files. No intermediate files are written anymore
+        and the argument is only kept for backwards compatibility. The default
+        is True.
+    file_mask : str, optional
+        Binary mask. If not given, all voxels with non-constant time series are
+        used. The default is None.
+    block_size : int, optional
+        Number of slices along the z-axis which are processed at once. The
+        default is 8.
 
     Returns
     -------
@@ -45,7 +113,7 @@ def get_alff(file_in, TR, path_output, hp_freq=0.01, lp_freq=0.08, cleanup=True)
 
     References
     -------
-    .. [1] https://github.com/FCP-INDI/C-PAC/blob/master/CPAC/alff/alff.py    
+    .. [1] https://github.com/FCP-INDI/C-PAC/blob/master/CPAC/alff/alff.py
 
     """
 
@@ -56,59 +124,43 @@ def get_alff(file_in, TR, path_output, hp_freq=0.01, lp_freq=0.08, cleanup=True)
     # get path and filename
     _, file, _ = get_filename(file_in)
 
-    # filtering
-    bandpass = Bandpass()
-    bandpass.inputs.in_file = file_in
-    bandpass.inputs.apply_inverse = hp_freq
-    bandpass.inputs.apply = lp_freq
-    bandpass.inputs.tr = TR
-    bandpass.inputs.outputtype = 'NIFTI'
-    bandpass.inputs.out_file = os.path.join(path_output, file + "_filtered.nii")
-    bandpass.run()
-
-    # standard deviation over frequency
-    stddev_filtered = TStat()
-    stddev_filtered.inputs.in_file = os.path.join(path_output, file + "_filtered.nii")
-    stddev_filtered.inputs.args = "-stdev"
-    stddev_filtered.inputs.outputtype = 'NIFTI'
-    stddev_filtered.inputs.out_file = os.path.join(path_output, 'alff.nii')
-    stddev_filtered.run()
-
-    # standard deviation of the unfiltered nuisance corrected image
-    stddev_unfiltered = TStat()
-    stddev_unfiltered.inputs.in_file = file_in
-    stddev_unfiltered.inputs.args = "-stdev"
-    stddev_unfiltered.inputs.outputtype = 'NIFTI'
-    stddev_unfiltered.inputs.out_file = os.path.join(path_output, 'temp.nii')
-    stddev_unfiltered.run()
-
-    # falff calculations
-    falff = Calc()
-    falff.inputs.in_file_a = os.path.join(path_output, 'alff.nii')
-    falff.inputs.in_file_b = os.path.join(path_output, 'temp.nii')
-    falff.inputs.args = '-float'
-    falff.inputs.expr = '(1.0*a)/(1.0*b)'
-    falff.inputs.outputtype = 'NIFTI'
-    falff.inputs.out_file = os.path.join(path_output, 'falff.nii')
-    falff.run()
-
-    # alff in z-score
-    alff_img = nb.load(os.path.join(path_output, "alff.nii"))
-    alff_array = alff_img.get_fdata()
-    alff_array = zscore(alff_array, axis=None)
-
-    output = nb.Nifti1Image(alff_array, alff_img.affine, alff_img.header)
-    nb.save(output, os.path.join(path_output, "alff_z.nii"))
-
-    # falff in z-score
-    falff_img = nb.load(os.path.join(path_output, "falff.nii"))
-    falff_array = falff_img.get_fdata()
-    falff_array = zscore(falff_array, axis=None)
-
-    output = nb.Nifti1Image(falff_array, falff_img.affine, falff_img.header)
-    nb.save(output, os.path.join(path_output, "falff_z.nii"))
-
-    # cleanup
-    if cleanup:
-        os.remove(os.path.join(path_output, "temp.nii"))
-        os.remove(os.path.join(path_output, file + "_filtered.nii"))
+    # load data
+    img = nb.load(file_in)
+    nx, ny, nz = img.shape[:3]
+    if file_mask:
+        mask = np.asarray(nb.load(file_mask).dataobj) > 0
+    else:
+        mask = np.ones((nx, ny, nz), dtype=bool)
+
+    alff_array = np.zeros((nx, ny, nz))
+    falff_array = np.zeros((nx, ny, nz))
+    for z0 in range(0, nz, block_size):
+        z1 = min(z0 + block_size, nz)
+        coords = np.nonzero(mask[:, :, z0:z1])
+        if not len(coords[0]):
+            continue
+
+        arr = np.asarray(img.dataobj[:, :, z0:z1, :])[coords]
+        alff, std_total = compute_alff(arr, TR, hp_freq, lp_freq)
+        alff_array[:, :, z0:z1][coords] = alff
+        falff_array[:, :, z0:z1][coords] = np.divide(
+            alff, std_total, out=np.zeros_like(alff), where=std_total != 0
+        )
+
+    # mean normalized alff
+    mask[alff_array == 0] = False
+    malff_array = alff_array / np.mean(alff_array[mask]) if np.any(mask) \
+        else alff_array
+
+    # write output
+    header = img.header.copy()
+    header.set_data_dtype(np.float32)
+    for name, arr in zip(["alff", "falff", "malff"],
+                         [alff_array, falff_array, malff_array]):
+        output = nb.Nifti1Image(arr.astype(np.float32), img.affine, header)
+        nb.save(output, os.path.join(path_output, name + ".nii"))
+
+        if name != "malff":
+            output = nb.Nifti1Image(zscore(arr, axis=None).astype(np.float32),
+                                    img.affine, header)
+            nb.save(output, os.path.join(path_output, name + "_z.nii"))
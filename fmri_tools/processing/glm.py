@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+# python standard library inputs
+import os
+from functools import partial
+
+# external inputs
+import numpy as np
+import nibabel as nb
+
+# local inputs
+from ..io.get_filename import get_filename
+from ..io.hdf5 import read_hdf5, write_hdf5
+from ..io.surf import write_mgh
+from ..utils.parallel import apply_parallel
+
+__all__ = ["GLM", "run_glm"]
+
+
+class GLM:
+    """Ordinary least squares (OLS) or prewhitened general linear model.
+
+    A design matrix which is shared by all voxels (or vertices) is fitted to an
+    array of time series with dimensions voxel x time point. The design matrix
+    is decomposed once by a QR decomposition so that betas and residual sums of
+    squares of all time series are computed by matrix multiplications, which
+    are applied in chunks of voxels (optionally in parallel). Time series are
+    converted to double precision chunk by chunk. For prewhitening,
+    a global AR(1) coefficient is estimated from the pooled OLS residuals of all
+    time series and data and design are whitened before the final fit.
+
+    Parameters
+    ----------
+    design : np.ndarray, shape=(T,K)
+        Design matrix (including intercept if required).
+    prewhiten : bool, optional
+        Prewhiten data and design with a global AR(1) model. The default is
+        False.
+    chunk_size : int, optional
+        Number of time series per chunk. The default is 10000.
+    n_jobs : int, optional
+        Number of worker processes (-1: all cores). The default is 1.
+
+    Raises
+    ------
+    ValueError
+        If the design matrix is rank deficient.
+
+    """
+
+    def __init__(self, design, prewhiten=False, chunk_size=10000, n_jobs=1):
+        self.design = np.reshape(design, (len(design), -1)).astype(np.float64)
+        self.prewhiten = prewhiten
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.nt, self.nk = np.shape(self.design)
+        if np.linalg.matrix_rank(self.design) < self.nk:
+            raise ValueError("Design matrix is rank deficient!")
+
+        self.rho = 0.0
+        self.beta = None
+        self.sigma2 = None
+
+    @property
+    def dof(self):
+        """Residual degrees of freedom."""
+        return self.nt - self.nk
+
+    @property
+    def whitening_matrix(self):
+        """Whitening matrix of the AR(1) model (Prais-Winsten transformation)."""
+        w = np.eye(self.nt) - self.rho * np.eye(self.nt, k=-1)
+        w[0, 0] = np.sqrt(1 - self.rho**2)
+        return w
+
+    @property
+    def design_whitened(self):
+        """Whitened design matrix."""
+        return self.whitening_matrix.dot(self.design)
+
+    @property
+    def cov_unscaled(self):
+        """Unscaled covariance matrix of the betas, i.e., inv(X'X)."""
+        _, r = np.linalg.qr(self.design_whitened)
+        r_inv = np.linalg.inv(r)
+        return r_inv.dot(r_inv.T)
+
+    def fit(self, arr):
+        """Fit model to time series.
+
+        Parameters
+        ----------
+        arr : np.ndarray, shape=(V,T)
+            Time series.
+
+        Returns
+        -------
+        GLM
+            Fitted model.
+
+        """
+        arr = self._check(arr)
+
+        if self.prewhiten:
+            self.rho = 0.0
+            q, _ = np.linalg.qr(self.design)
+            res = self._map(partial(_ar1_sums, q=q), arr)
+            self.rho = np.sum(res[:, 0]) / np.sum(res[:, 1])
+
+        w = self.whitening_matrix if self.rho else None
+        q, r = np.linalg.qr(self.design_whitened)
+        res = self._map(partial(_ols, q=q, r=r, w=w), arr)
+        self.beta = res[:, :-1]
+        self.sigma2 = res[:, -1] / self.dof
+
+        return self
+
+    def residuals(self, arr):
+        """Residuals of the (unwhitened) time series.
+
+        Parameters
+        ----------
+        arr : np.ndarray, shape=(V,T)
+            Time series used for fitting.
+
+        Returns
+        -------
+        np.ndarray, shape=(V,T)
+            Residual time series.
+
+        """
+        arr = self._check(arr)
+        res = np.empty(arr.shape)
+        for i in range(0, len(arr), self.chunk_size):
+            res[i:i + self.chunk_size] = arr[i:i + self.chunk_size] - \
+                self.beta[i:i + self.chunk_size].dot(self.design.T)
+
+        return res
+
+    def t_contrast(self, contrast):
+        """Compute t-statistic of a contrast vector.
+
+        Parameters
+        ----------
+        contrast : np.ndarray, shape=(K,)
+            Contrast vector.
+
+        Returns
+        -------
+        effect : np.ndarray, shape=(V,)
+            Contrast estimate.
+        t : np.ndarray, shape=(V,)
+            t-statistic.
+
+        """
+        c = np.asarray(contrast, dtype=np.float64).ravel()
+        effect = self.beta.dot(c)
+        var = self.sigma2 * c.dot(self.cov_unscaled).dot(c)
+        t = np.divide(effect, np.sqrt(var), out=np.zeros_like(effect),
+                      where=var > 0)
+
+        return effect, t
+
+    def f_contrast(self, contrast):
+        """Compute F-statistic of a contrast matrix.
+
+        Parameters
+        ----------
+        contrast : np.ndarray, shape=(Q,K)
+            Contrast matrix.
+
+        Returns
+        -------
+        np.ndarray, shape=(V,)
+            F-statistic.
+
+        """
+        c = np.reshape(contrast, (-1, self.nk)).astype(np.float64)
+        effect = self.beta.dot(c.T)
+        cov_inv = np.linalg.pinv(c.dot(self.cov_unscaled).dot(c.T))
+        num = np.sum(effect.dot(cov_inv) * effect, axis=1) / len(c)
+
+        return np.divide(num, self.sigma2, out=np.zeros_like(num),
+                         where=self.sigma2 > 0)
+
+    def _check(self, arr):
+        """Check dimensions of time series array."""
+        arr = np.reshape(arr, (-1, np.shape(arr)[-1]))
+        if arr.shape[1] != self.nt:
+            raise ValueError("Number of time points does not match design matrix!")
+        return arr
+
+    def _map(self, func, arr):
+        """Apply row-wise function in chunks of time series."""
+        return apply_parallel(func, arr, self.n_jobs, self.chunk_size)
+
+
+def _ols(arr, q, r, w=None):
+    """Betas and residual sum of squares of each row from the QR decomposition
+    of the design matrix."""
+    arr = np.asarray(arr, dtype=np.float64)
+    if w is not None:
+        arr = arr.dot(w.T)
+    proj = arr.dot(q)
+    beta = np.linalg.solve(r, proj.T).T
+    rss = np.sum(arr**2, axis=1) - np.sum(proj**2, axis=1)
+
+    return np.column_stack((beta, np.maximum(rss, 0)))
+
+
+def _ar1_sums(arr, q):
+    """Lag-1 and lag-0 sums of OLS residuals of each row given the orthonormal
+    basis of the design matrix."""
+    arr = np.asarray(arr, dtype=np.float64)
+    res = arr - arr.dot(q).dot(q.T)
+
+    return np.column_stack((np.sum(res[:, 1:] * res[:, :-1], axis=1),
+                            np.sum(res**2, axis=1)))
+
+
+def run_glm(file_in, design, contrasts, path_output, prewhiten=False,
+            file_mask=None, chunk_size=10000, n_jobs=1):
+    """Run GLM.
+
+    This function fits a GLM to a time series and writes beta, contrast and
+    t-maps for t-contrasts (contrast vectors) and F-maps for F-contrasts
+    (contrast matrices). Supported inputs are nifti volumes (x, y, z, time),
+    mgh surface files (vertex, 1, 1, time) and hdf5 files (vertex, time or
+    vertex, time, layer). Outputs are written in the same format as the input.
+
+    Parameters
+    ----------
+    file_in : str
+        Time series.
+    design : np.ndarray, shape=(T,K)
+        Design matrix.
+    contrasts : dict
+        Dictionary of contrast names and contrast vectors or matrices.
+    path_output : str
+        Path where output is written.
+    prewhiten : bool, optional
+        Prewhiten data with a global AR(1) model. The default is False.
+    file_mask : str, optional
+        Only time series within the mask are fitted. The mask must contain one
+        element per time series. The default is None.
+    chunk_size : int, optional
+        Number of time series per chunk. The default is 10000.
+    n_jobs : int, optional
+        Number of worker processes (-1: all cores). The default is 1.
+
+    Raises
+    ------
+    ValueError
+        If the file extension is not supported or if the mask size does not
+        match the number of time series.
+
+    Returns
+    -------
+    glm : GLM
+        Fitted model.
+
+    """
+
+    # make output folder
+    if not os.path.exists(path_output):
+        os.makedirs(path_output)
+
+    # load data
+    _, name, ext = get_filename(file_in)
+    if ext in [".h5", ".hdf5"]:
+        arr, affine, header = read_hdf5(file_in)
+        arr = np.moveaxis(arr, 1, -1)
+        shape = np.shape(arr)[:-1]
+        arr = np.reshape(arr, (-1, np.shape(arr)[-1]))
+
+        def _write(file_out, res):
+            write_hdf5(file_out + ext, np.reshape(res, shape)[:, None], affine,
+                       header)
+    elif ext in [".nii", ".nii.gz", ".mgh", ".mgz"]:
+        img = nb.load(file_in)
+        shape = img.shape[:-1]
+        affine, header = img.affine, img.header
+        arr = None
+
+        def _write(file_out, res):
+            res = np.reshape(res, shape).astype(np.float32)
+            if ext in [".mgh", ".mgz"]:
+                write_mgh(file_out + ".mgh", res.ravel(), affine, header)
+            else:
+                nb.save(nb.Nifti1Image(res, affine), file_out + ext)
+    else:
+        raise ValueError("Unsupported file format: " + str(ext))
+
+    n_rows = int(np.prod(shape))
+    mask = np.ones(n_rows, dtype=bool)
+    if file_mask:
+        mask = np.asarray(nb.load(file_mask).dataobj).ravel() > 0
+        if len(mask) != n_rows:
+            raise ValueError("Mask size does not match number of time series!")
+
+    # gather time series in mask in blocks along the first axis
+    if arr is None:
+        n_block = max(chunk_size // max(n_rows // shape[0], 1), 1)
+        arr = np.empty((np.sum(mask), img.shape[-1]), dtype=np.float32)
+        i = 0
+        for x0 in range(0, shape[0], n_block):
+            x1 = min(x0 + n_block, shape[0])
+            mask_block = np.reshape(mask, (shape[0], -1))[x0:x1].ravel()
+            arr_block = np.asarray(img.dataobj[x0:x1], dtype=np.float32)
+            arr_block = np.reshape(arr_block, (-1, img.shape[-1]))[mask_block]
+            arr[i:i + len(arr_block)] = arr_block
+            i += len(arr_block)
+    else:
+        arr = arr[mask]
+
+    # fit model
+    glm = GLM(design, prewhiten, chunk_size, n_jobs).fit(arr)
+
+    def _scatter(res):
+        out = np.zeros(len(mask))
+        out[mask] = res
+        return out
+
+    for i in range(glm.nk):
+        _write(os.path.join(path_output, name + "_beta_" + str(i)),
+               _scatter(glm.beta[:, i]))
+
+    for key, c in contrasts.items():
+        if np.ndim(c) == 1:
+            effect, t = glm.t_contrast(c)
+            _write(os.path.join(path_output, name + "_con_" + key),
+                   _scatter(effect))
+            _write(os.path.join(path_output, name + "_t_" + key), _scatter(t))
+        else:
+            _write(os.path.join(path_output, name + "_F_" + key),
+                   _scatter(glm.f_contrast(c)))
+
+    return glm
@@ -7,25 +7,30 @@ import datetime
 # external inputs
 import numpy as np
 import nibabel as nb
-from nighres.registration import apply_coordinate_mappings
 
 # local inputs
+from ..cmap.coordinate_mapping import CoordinateMapping
 from ..io.get_filename import get_filename
+from ..io.vol import nifti_memmap
 from ..utils.resample_volume import resample_volume
 
 
 def apply_registration(file_in, cmap_in, file_out, interpolation="linear",
-                       r=[0.4, 0.4, 0.4]):
+                       r=[0.4, 0.4, 0.4], padding="zero", t_block=16):
     """Apply registration.
 
-    This function applies a coordinate mapping to a volume. Optionally, the 
-    voxel size of the output volume can be changed. This is achieved by 
-    adjusting the coordinate mapping to the new voxel size before application.    
+    This function applies a coordinate mapping to a volume or a time series.
+    Optionally, the voxel size of the output volume can be changed. This is
+    achieved by adjusting the coordinate mapping to the new voxel size before
+    application. The interpolation footprint of the coordinate mapping is
+    computed once as sparse sampling matrix, which is applied to blocks of time
+    points by a single sparse matrix product per block. The output is written
+    block-wise into a single (4D) float32 volume.
 
     Parameters
     ----------
     file_in : str
-        Filename of input volume.
+        Filename of input volume or time series.
     cmap_in : str
         Filename of coordinate mapping.
     file_out : str
@@ -35,6 +40,11 @@ def apply_registration(file_in, cmap_in, file_out, interpolation="linear",
     r : list, optional
         Destination voxel size after upsampling (performed if not None). The 
         default is [0.4,0.4,0.4].
+    padding : str, optional
+        Padding of coordinates outside of the input volume (zero or closest).
+        The default is "zero".
+    t_block : int, optional
+        Number of time points which are transformed at once. The default is 16.
 
     Returns
     -------
@@ -45,7 +55,7 @@ def apply_registration(file_in, cmap_in, file_out, interpolation="linear",
 
     # make output folder     
     path_output = os.path.dirname(file_out)
-    if not os.path.exists(path_output):
+    if path_output and not os.path.exists(path_output):
         os.makedirs(path_output)
 
     # filename for temporary cmap copy
@@ -71,39 +81,36 @@ def apply_registration(file_in, cmap_in, file_out, interpolation="linear",
         cmap = nb.load(file_tmp)
         mask = nb.load(file_tmp2)
 
-        cmap_array = cmap.get_fdata()
-        mask_array = mask.get_fdata()
+        cmap_array = cmap.get_fdata(dtype=np.float32)
+        mask_array = np.sum(mask.get_fdata(dtype=np.float32), axis=3) != 0
+        cmap_array[~mask_array] = 0
 
-        mask_array = np.sum(mask_array, axis=3)
-        mask_array[mask_array != 0] = 1
+        cmap = CoordinateMapping(cmap_array, cmap.affine, cmap.header)
 
-        cmap_array[:, :, :, 0][mask_array == 0] = 0
-        cmap_array[:, :, :, 1][mask_array == 0] = 0
-        cmap_array[:, :, :, 2][mask_array == 0] = 0
-
-        cmap = nb.Nifti1Image(cmap_array, cmap.affine, cmap.header)
+        # remove temporary files
+        os.remove(file_tmp)
+        os.remove(file_tmp2)
 
     else:
 
-        cmap = nb.load(cmap_in)
+        cmap = CoordinateMapping.from_file(cmap_in)
+
+    # sampling matrix
+    img = nb.load(file_in)
+    mat = cmap.sampling_matrix(img.shape[:3], interpolation, padding)
 
     # apply coordinate mapping
-    res = apply_coordinate_mappings(image=file_in,  # input
-                                    mapping1=cmap,  # cmap
-                                    interpolation=interpolation,  # nearest or linear
-                                    padding="zero",  # closest, zero or max
-                                    save_data=False,  # save output data to file (boolean)
-                                    overwrite=False,  # overwrite existing results (boolean)
-                                    output_dir=None,  # output directory
-                                    file_name=None,  # base name with file extension for output
-                                    )
-
-    # write output
-    nb.save(res["result"], file_out)
-
-    # remove temporary files
-    if r:
-        os.remove(file_tmp)
-        os.remove(file_tmp2)
+    nt = img.shape[3] if len(img.shape) > 3 else 1
+    shape_out = cmap.shape + img.shape[3:4]
+    with nifti_memmap(file_out, shape_out, cmap.affine,
+                      cmap.header) as arr_out:
+        arr_out = arr_out.reshape(cmap.shape + (nt,), order="F")
+        for t0 in range(0, nt, t_block):
+            t1 = min(t0 + t_block, nt)
+            arr = img.dataobj[..., t0:t1] if nt > 1 else img.dataobj
+            arr = np.asarray(arr, dtype=np.float32)
+            res = mat.dot(np.reshape(arr, (-1, t1 - t0)))
+            arr_out[..., t0:t1] = res.reshape(cmap.shape + (t1 - t0,))
+
+    return nb.load(file_out)
 
-    return res["result"]
@@ -53,14 +53,15 @@ def get_thickness(boundaries_in, ref_in, hemi, path_output, r=[0.4, 0.4, 0.4]):
         sh.copyfile(ref_in, os.path.join(path_output, "ref.nii"))
 
     # make coordinate mapping
-    cmap = generate_coordinate_mapping(boundaries_in, pad=0)
-    cmap.header["dim"][0] = 1
+    cmap = generate_coordinate_mapping(boundaries_in, pad=0, lazy=True)
 
     # get voxel to vertex ras coordinate transformation
     vox2ras_tkr, _ = read_vox2ras_tkr(os.path.join(path_output, "ref.nii"))
 
     # apply transformation to cmap
-    ras_array = apply_affine_chunked(vox2ras_tkr, cmap.get_fdata())
+    ras_array = np.zeros(cmap.shape + (3,), dtype=np.float32)
+    for z0, z1, coords in cmap.blocks():
+        ras_array[:, :, z0:z1] = apply_affine_chunked(vox2ras_tkr, coords)
 
     # split coordinates into single dimensions
     x_ras = nb.Nifti1Image(ras_array[:, :, :, 0], cmap.affine, cmap.header)
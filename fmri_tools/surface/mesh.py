@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import itertools
 import functools
 import numpy as np
 import nibabel as nb
@@ -477,58 +476,24 @@ class Mesh:
 
         """
 
-        # get indices which will be removed
-        ind_tmp = np.arange(len(self.verts))
-        ind_remove = list(set(ind_tmp) - set(ind_keep))
-        ind_remove = sorted(ind_remove, reverse=True)
-
-        # get new vertices
-        vtx = self.verts[ind_keep, :]
+        nverts = len(self.verts)
+        ind_keep = np.asarray(ind_keep, dtype=np.int64)
 
-        # get new faces
-        fac_keep = np.zeros(len(self.faces))
-        fac_keep += np.in1d(self.faces[:, 0], ind_keep)
-        fac_keep += np.in1d(self.faces[:, 1], ind_keep)
-        fac_keep += np.in1d(self.faces[:, 2], ind_keep)
-        fac = self.faces[fac_keep == 3, :]
-
-        # reindex faces
-        loop_status = 0
-        loop_length = len(ind_remove)
-        for i in range(loop_length):
-            # print status
-            counter = np.floor(i / loop_length * 100)
-            if counter != loop_status:
-                print("sort faces: " + str(counter) + " %")
-                loop_status = counter
-
-            tmp = fac[fac >= ind_remove[i]] - 1
-            fac[fac >= ind_remove[i]] = tmp
-
-        # get indices which will be cleaned
-        ind_vtx = np.arange(len(vtx))
-        ind_fac = list(itertools.chain(*fac))
-        ind_fac = list(set(ind_fac))
-        ind_remove = list(set(ind_vtx) - set(ind_fac))
-        ind_remove = sorted(ind_remove, reverse=True)
+        # only keep faces whose vertices are all kept
+        mask = np.zeros(nverts, dtype=bool)
+        mask[ind_keep] = True
+        fac = self.faces[np.all(mask[self.faces], axis=1), :]
 
         # remove singularities (vertices without faces)
-        loop_status = 0
-        loop_length = len(ind_remove)
-        for i in range(loop_length):
-            # print status
-            counter = np.floor(i / loop_length * 100)
-            if counter != loop_status:
-                print("clean faces: " + str(counter) + " %")
-                loop_status = counter
-
-            # remove vertex and index
-            vtx = np.delete(vtx, ind_remove[i], 0)
-            ind_keep = np.delete(ind_keep, ind_remove[i], 0)
-
-            # sort faces
-            tmp = fac[fac >= ind_remove[i]] - 1
-            fac[fac >= ind_remove[i]] = tmp
+        mask[:] = False
+        mask[fac] = True
+        ind_keep = ind_keep[mask[ind_keep]]
+
+        # reindex faces by lookup
+        ind_lookup = np.full(nverts, -1, dtype=np.int64)
+        ind_lookup[ind_keep] = np.arange(len(ind_keep))
+        vtx = self.verts[ind_keep, :]
+        fac = ind_lookup[fac]
 
         self.verts = np.array(vtx)
         self.faces = np.array(fac)
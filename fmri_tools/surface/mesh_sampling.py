@@ -65,7 +65,7 @@ def mesh_sampling(surf_in, vol_in, write_output=False, path_output="",
         default is [0.4,0.4,0.4].
     interp_upsample : str, optional
         Interpolation method if volume is upsampled. Possible arguments are NN, 
-        Li, Cu and Bk. The default is "Cu".
+        Li, Cu and cubic. The default is "Cu".
     cleanup : bool, optional
         Remove intermediate files. The default is True.
 
@@ -6,13 +6,24 @@ import argparse
 # external inputs
 import numpy as np
 import nibabel as nb
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import minimum_filter1d, maximum_filter1d
 
+# local inputs
+from fmri_tools.io.vol import nifti_memmap
 
-def calc_mip(file_in, file_out, size, axis=2, mode="min"):
+
+def calc_mip(file_in, file_out, size, axis=2, mode="min", q=50, chunk_size=64):
     """Minimum/Maximum intensity projection of a 3D nifti image. For each slice along
     the specified axis, the maximum or minimum intensity is computed from a number of
     neighboring slices around the current slice. The number of neighboring slices in
-    each direction is defined by the size parameter.
+    each direction is defined by the size parameter, i.e., the window covers the
+    slices from i-size to i+size-1 and is truncated at the volume borders.
+    Additionally, mean and percentile projections within the same window can be
+    computed. Minimum and maximum are computed with running filters, which do not
+    depend on the window size (van Herk/Gil-Werman), and the mean with cumulative
+    sums. The volume is processed in chunks along a non-projected axis, which are
+    read from the image data object and written into a pre-allocated output file.
 
     Parameters
     ----------
@@ -25,7 +36,13 @@ def calc_mip(file_in, file_out, size, axis=2, mode="min"):
     axis : int, optional
         Axis along which to compute the intensity projection.
     mode : str, optional
-        Mode (min, max).
+        Mode (min, max, mean, percentile).
+    q : float, optional
+        Percentile in the range [0, 100] (only used for percentile mode). The
+        default is 50.
+    chunk_size : int, optional
+        Number of slices along the chunk axis which are processed at once. The
+        default is 64.
 
     Returns
     -------
@@ -36,32 +53,51 @@ def calc_mip(file_in, file_out, size, axis=2, mode="min"):
     if axis < 0 or axis > 2:
         raise ValueError("Axis must be between 0 and 2.")
 
-    # load input image
-    data = nb.load(file_in)
-    dim = data.header["dim"][axis + 1]
-    arr = data.get_fdata()
-
-    arr = np.moveaxis(arr, axis, 0)
-    res = np.zeros_like(arr)
-    for i in range(dim):
-        index_low = i - size
-        if index_low < 0:
-            index_low = 0
+    if mode not in ["min", "max", "mean", "percentile"]:
+        raise ValueError("Mode not supported")
 
-        index_high = i + size
-        if index_high > dim:
-            index_high = dim
+    if size < 1:
+        raise ValueError("Size must be at least 1.")
 
-        if mode == "min":
-            res[i,:,:] = np.min(arr[index_low:index_high,:,:], axis=0)
-        elif mode == "max":
-            res[i,:,:] = np.max(arr[index_low:index_high,:,:], axis=0)
-        else:
-            raise ValueError("Mode not supported")
-
-    res = np.moveaxis(res, 0, axis)
-    output = nb.Nifti1Image(res, data.affine, data.header)
-    nb.save(output, file_out)
+    # load input image
+    data = nb.load(file_in)
+    shape = data.shape[:3]
+
+    # chunk along the last non-projected axis
+    axis_chunk = [i for i in range(3) if i != axis][-1]
+    with nifti_memmap(file_out, shape, data.affine, data.header) as res:
+        for i0 in range(0, shape[axis_chunk], chunk_size):
+            i1 = min(i0 + chunk_size, shape[axis_chunk])
+            index = [slice(None)] * 3
+            index[axis_chunk] = slice(i0, i1)
+            index = tuple(index)
+
+            arr = np.asarray(data.dataobj[index], dtype=np.float64)
+            res[index] = _projection(arr, size, axis, mode, q)
+
+
+def _projection(arr, size, axis, mode, q):
+    """Running projection along one axis with windows [i-size, i+size-1]."""
+    if mode == "min":
+        return minimum_filter1d(arr, 2 * size, axis=axis, mode="nearest")
+    if mode == "max":
+        return maximum_filter1d(arr, 2 * size, axis=axis, mode="nearest")
+
+    arr = np.moveaxis(arr, axis, -1)
+    n = arr.shape[-1]
+    lo = np.maximum(np.arange(n) - size, 0)
+    hi = np.minimum(np.arange(n) + size, n)
+    if mode == "mean":
+        arr_sum = np.zeros(arr.shape[:-1] + (n + 1,))
+        np.cumsum(arr, axis=-1, out=arr_sum[..., 1:])
+        res = (arr_sum[..., hi] - arr_sum[..., lo]) / (hi - lo)
+    else:
+        pad = [(0, 0)] * (arr.ndim - 1) + [(size, size - 1)]
+        arr_pad = np.pad(arr, pad, constant_values=np.nan)
+        win = sliding_window_view(arr_pad, 2 * size, axis=-1)
+        res = np.nanpercentile(win, q, axis=-1)
+
+    return np.moveaxis(res, -1, axis)
 
 
 if __name__ == "__main__":
@@ -74,7 +110,9 @@ if __name__ == "__main__":
     out_help = "output file name."
     size_help = "number of included slices in each direction."
     axis_help = "projection axis."
-    mode_help = "mode (min, max)."
+    mode_help = "mode (min, max, mean, percentile)."
+    q_help = "percentile for percentile mode (default: 50)."
+    chunk_help = "number of slices processed at once (default: 64)."
 
     # parse arguments from command line
     parser = argparse.ArgumentParser(description=parser_description)
@@ -83,7 +121,10 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--size', type=int, help=size_help)
     parser.add_argument('-a', '--axis', type=int, help=axis_help)
     parser.add_argument('-m', '--mode', type=str, help=mode_help)
+    parser.add_argument('-q', '--percentile', type=float, default=50, help=q_help)
+    parser.add_argument('-c', '--chunk', type=int, default=64, help=chunk_help)
     args = parser.parse_args()
 
     # run function
-    calc_mip(args.in_, args.out, args.size, args.axis, args.mode)
+    calc_mip(args.in_, args.out, args.size, args.axis, args.mode, args.percentile,
+             args.chunk)
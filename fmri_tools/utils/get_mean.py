@@ -2,17 +2,19 @@
 
 # python standard library inputs
 import os
-import copy
 
 # external inputs
-import numpy as np
 import nibabel as nb
 
+# local inputs
+from .running_stats import stream_stats, stream_median
+
 
 def get_mean(file_in, path_output, name_output, method="mean"):
     """Get mean.
 
-    This function computes the mean image of one or more time series.
+    This function computes the mean image of one or more time series. Time series
+    are streamed from disk so that runs are never concatenated in memory.
 
     Parameters
     ----------
@@ -40,48 +42,16 @@ def get_mean(file_in, path_output, name_output, method="mean"):
     if not os.path.exists(path_output):
         os.makedirs(path_output)
 
-    if len(np.shape(file_in)) > 0:
-
-        # get dimensions
-        data_img = nb.load(file_in[0])
-
-        x_size = data_img.header["dim"][1]
-        y_size = data_img.header["dim"][2]
-        z_size = data_img.header["dim"][3]
-
-        t_size = 0
-        for i in range(len(file_in)):
-            data_img = nb.load(file_in[i])
-            t_size += data_img.header["dim"][4]
-
-        data_all_array = np.zeros([x_size, y_size, z_size, t_size])
-        t_start = 0
-        for i in range(len(file_in)):
-            data_img = nb.load(file_in[i])
-            data_array = data_img.get_fdata()
-            t_end = data_img.header["dim"][4] + t_start
-            data_all_array[:, :, :, t_start:t_end] = data_array
-            t_start = copy.deepcopy(t_end)
-
-    else:
-
-        # load data
-        data_img = nb.load(file_in)
-        data_all_array = data_img.get_fdata()
-
     # calculate mean
     if method == "mean":
-        data_mean_array = np.mean(data_all_array, axis=3)
+        data_mean_array = stream_stats(file_in).mean
     elif method == "median":
-        data_mean_array = np.median(data_all_array, axis=3)
+        data_mean_array = stream_median(file_in)
     else:
         raise ValueError("Choose a valid mean type!")
 
     # write output
-    if len(np.shape(file_in)) > 0:
-        data_img = nb.load(file_in[0])
-    else:
-        data_img = nb.load(file_in)
+    data_img = nb.load(file_in[0] if isinstance(file_in, (list, tuple)) else file_in)
     data_img.header["dim"][0] = 3
     data_img.header["dim"][4] = 1
 
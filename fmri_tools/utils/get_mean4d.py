@@ -8,10 +8,13 @@ import numpy as np
 import nibabel as nb
 
 
-def get_mean4d(file_in, path_output="", name_output="", write_output=False):
+def get_mean4d(file_in, path_output="", name_output="", write_output=False,
+               t_block=32):
     """Get mean 4D.
 
-    This function computes the mean time series of one or more time series.    
+    This function computes the mean time series of one or more time series. 
+    Time series are accumulated in blocks of volumes read from the image data 
+    objects so that only the output array is held in memory.
 
     Parameters
     ----------
@@ -23,6 +26,8 @@ def get_mean4d(file_in, path_output="", name_output="", write_output=False):
         Output file name without file extension. The default is "".
     write_output : bool, optional
         Write nifti volume. The default is False.
+    t_block : int, optional
+        Number of volumes which are read at once. The default is 32.
 
     Returns
     -------
@@ -39,11 +44,15 @@ def get_mean4d(file_in, path_output="", name_output="", write_output=False):
     # get dimensions
     data_img = nb.load(file_in[0])
 
-    res_array = np.zeros_like(data_img.get_fdata())
-    for i in range(len(file_in)):
-        res_array += nb.load(file_in[i]).get_fdata()
+    res_array = np.zeros(data_img.shape)
+    for f in file_in:
+        img = nb.load(f)
+        nt = img.shape[3]
+        for t0 in range(0, nt, t_block):
+            t1 = min(t0 + t_block, nt)
+            res_array[..., t0:t1] += np.asarray(img.dataobj[..., t0:t1])
 
-    res_array = res_array / len(file_in)
+    res_array /= len(file_in)
 
     # write mean time series
     output = nb.Nifti1Image(res_array, data_img.affine, data_img.header)
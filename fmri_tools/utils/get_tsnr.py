@@ -1,20 +1,19 @@
 # -*- coding: utf-8 -*-
 
-# python standard library inputs
-import os
-
-# external inputs
-import numpy as np
-import nibabel as nb
-
 # local inputs
 from ..io.get_filename import get_filename
+from ..preprocessing.timeseries import MaskedTimeseries
+from .running_stats import write_stats
 
 
-def get_tsnr(file_in, tsnr_max=200, write_output=False, path_output=""):
+def get_tsnr(file_in, tsnr_max=200, write_output=False, path_output="",
+             file_mask=None):
     """Get tSNR.
     
-    This function computes the tsnr of one time series.
+    This function computes the tsnr of one time series. The time series is 
+    streamed from disk in blocks of volumes. If a mask is given, only in-mask 
+    voxels are gathered and tsnr is zero outside of the mask. Use write_stats 
+    to get mean, std and tsnr maps from the same pass.
 
     Parameters
     ----------
@@ -27,6 +26,8 @@ def get_tsnr(file_in, tsnr_max=200, write_output=False, path_output=""):
         Write output nifti file. The default is False.
     path_output : str, optional
         Path where to save mean image The default is "".
+    file_mask : str, optional
+        Binary mask (e.g. from skullstrip_epi). The default is None.
 
     Returns
     -------
@@ -35,36 +36,13 @@ def get_tsnr(file_in, tsnr_max=200, write_output=False, path_output=""):
     
     """
     
-    # make subfolders
-    if write_output and not os.path.exists(path_output):
-        os.makedirs(path_output)
-    
     # get filename
     _, file, ext = get_filename(file_in)
 
-    # load time series
-    data_img = nb.load(file_in)
-    data_array = data_img.get_fdata()
-    
-    # get mean and std
-    data_mean_array = np.mean(data_array, axis=3)
-    data_std_array = np.std(data_array, axis=3)
-    data_std_array[data_std_array == 0] = np.nan  # set zeroes to nan
-    
-    # get tsnr of time series
-    data_tsnr_array = data_mean_array / data_std_array
-    data_tsnr_array[np.isnan(data_tsnr_array)] = 0
-    
-    # threshold tsnr
-    if tsnr_max:
-        data_tsnr_array[data_tsnr_array > tsnr_max] = tsnr_max
-    
-    # write output    
-    if write_output:
-        data_img.header["dim"][0] = 3
-        data_img.header["dim"][4] = 1
+    # get tsnr of time series (zero where std is zero) and write output
+    mask = None if file_mask is None else MaskedTimeseries.load_mask(file_mask)
+    data_tsnr_array = write_stats(file_in, path_output if write_output else None,
+                                  file, maps=("tsnr",), tsnr_max=tsnr_max, ext=ext,
+                                  mask=mask)["tsnr"]
 
-        data_img = nb.Nifti1Image(data_tsnr_array, data_img.affine, data_img.header)
-        nb.save(data_img, os.path.join(path_output, "tsnr_"+file+ext))
-    
     return data_tsnr_array
@@ -2,8 +2,19 @@
 
 # external inputs
 import numpy as np
+import nibabel as nb
+from scipy.interpolate import InterpolatedUnivariateSpline as Interp
+from scipy.sparse import csr_matrix
 
-__all__ = ["linear_interpolation3d", "nn_interpolation3d"]
+__all__ = [
+    "linear_interpolation3d",
+    "nn_interpolation3d",
+    "interpolation_weights3d",
+    "sampling_matrix3d",
+    "SamplingCache",
+    "resampling_matrix1d",
+    "resample1d",
+]
 
 
 def linear_interpolation3d(x, y, z, arr_c):
@@ -100,6 +111,333 @@ def nn_interpolation3d(x, y, z, arr_c):
     return c
 
 
+def interpolation_weights3d(x, y, z, dims, method="linear"):
+    """Compute flat voxel indices and weights to sample a 3D volume at an array of
+    coordinates. Sampled values are obtained by a weighted sum over the voxels of the
+    flattened (C-ordered) volume. Corner voxels outside of the volume and coordinates
+    containing nans get zero weight, i.e., points outside of the volume are sampled as
+    zero.
+
+    Parameters
+    ----------
+    x : (N,) np.ndarray
+        x-coordinates in voxel space.
+    y : (N,) np.ndarray
+        y-coordinates in voxel space.
+    z : (N,) np.ndarray
+        z-coordinates in voxel space.
+    dims : tuple
+        Tuple containing volume dimensions in x-, y- and z-direction.
+    method : str, optional (linear | nearest)
+        Interpolation method (linear or nearest neighbor interpolation).
+
+    Raises
+    ------
+    ValueError
+        If `method` is not supported.
+
+    Returns
+    -------
+    ind : (N,K) np.ndarray
+        Flat voxel indices of the K=8 (linear) or K=1 (nearest) contributing voxels.
+    w : (N,K) np.ndarray
+        Corresponding interpolation weights.
+
+    """
+
+    pts = np.stack((x, y, z), axis=1).astype(np.float64)
+    dims = np.asarray(dims[:3], dtype=np.int64)
+    valid = np.all(np.isfinite(pts), axis=1)
+    pts[~valid] = 0
+
+    if method == "nearest":
+        corners = np.round(pts).astype(np.int64)[:, None, :]
+        w = np.ones((len(pts), 1))
+    elif method == "linear":
+        p0 = np.floor(pts).astype(np.int64)
+        d = pts - p0
+        offset = np.array(
+            [[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)], dtype=np.int64
+        )
+        corners = p0[:, None, :] + offset[None, :, :]
+        w = np.prod(np.where(offset[None, :, :], d[:, None, :], 1 - d[:, None, :]), 2)
+    else:
+        raise ValueError("Unknown interpolation method: " + str(method))
+
+    # remove corners outside of the volume
+    inside = np.all((corners >= 0) & (corners < dims), axis=2)
+    inside &= valid[:, None]
+    corners = np.clip(corners, 0, dims - 1)
+    ind = np.ravel_multi_index(tuple(np.moveaxis(corners, 2, 0)), tuple(dims))
+    w[~inside] = 0
+
+    return ind, w
+
+
+def sampling_matrix3d(x, y, z, dims, method="linear"):
+    """Sparse sampling operator which maps a flattened (C-ordered) 3D volume onto an
+    array of coordinates. Points outside of the volume are sampled as zero.
+
+    Parameters
+    ----------
+    x : (N,) np.ndarray
+        x-coordinates in voxel space.
+    y : (N,) np.ndarray
+        y-coordinates in voxel space.
+    z : (N,) np.ndarray
+        z-coordinates in voxel space.
+    dims : tuple
+        Tuple containing volume dimensions in x-, y- and z-direction.
+    method : str, optional (linear | nearest)
+        Interpolation method (linear or nearest neighbor interpolation).
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix, shape=(N, X*Y*Z)
+        Sparse sampling matrix.
+
+    """
+
+    ind, w = interpolation_weights3d(x, y, z, dims, method)
+
+    return _weights_to_csr(ind, w, int(np.prod(dims[:3])))
+
+
+class SamplingCache:
+    """Cache of interpolation weights for a fixed volume grid.
+
+    Interpolation weights are stored per voxel coordinate. If several point sets are
+    sampled from volumes with the same grid (e.g. all layer surfaces of one subject),
+    weights of coinciding points are computed only once. Additionally, loaded volume
+    arrays are kept in memory to prevent reloading the same file.
+
+    Parameters
+    ----------
+    dims : tuple
+        Tuple containing volume dimensions in x-, y- and z-direction.
+    method : str, optional (linear | nearest)
+        Interpolation method (linear or nearest neighbor interpolation).
+
+    """
+
+    def __init__(self, dims, method="linear"):
+        self.dims = tuple(int(i) for i in dims[:3])
+        self.method = method
+        self._keys = np.empty(0, dtype=np.dtype((np.void, 24)))
+        self._ind = None
+        self._w = None
+        self._volumes = {}
+
+    def weights(self, pts):
+        """Get flat voxel indices and interpolation weights for an array of voxel
+        coordinates. Missing entries are computed and added to the cache.
+
+        Parameters
+        ----------
+        pts : (N,3) np.ndarray
+            Coordinates in voxel space.
+
+        Returns
+        -------
+        ind : (N,K) np.ndarray
+            Flat voxel indices of contributing voxels.
+        w : (N,K) np.ndarray
+            Corresponding interpolation weights.
+
+        """
+
+        pts = np.ascontiguousarray(pts, dtype=np.float64)
+        keys = pts.view(self._keys.dtype).ravel()
+
+        hit = np.zeros(len(pts), dtype=bool)
+        pos = np.zeros(len(pts), dtype=np.int64)
+        if len(self._keys):
+            pos = np.searchsorted(self._keys, keys)
+            pos[pos == len(self._keys)] = 0
+            hit = self._keys[pos] == keys
+
+        if len(self._keys) and np.all(hit):
+            return self._ind[pos], self._w[pos]
+
+        ind_new, w_new = interpolation_weights3d(
+            pts[~hit, 0], pts[~hit, 1], pts[~hit, 2], self.dims, self.method
+        )
+        if not len(self._keys):
+            ind, w = ind_new, w_new
+        else:
+            ind = np.empty((len(pts), ind_new.shape[1]), dtype=ind_new.dtype)
+            w = np.empty((len(pts), w_new.shape[1]), dtype=w_new.dtype)
+            ind[hit] = self._ind[pos[hit]]
+            w[hit] = self._w[pos[hit]]
+            ind[~hit] = ind_new
+            w[~hit] = w_new
+
+        # update sorted cache
+        keys_all = np.concatenate((self._keys, keys[~hit]))
+        ind_all = ind_new if self._ind is None else np.vstack((self._ind, ind_new))
+        w_all = w_new if self._w is None else np.vstack((self._w, w_new))
+        keys_all, ind_unique = np.unique(keys_all, return_index=True)
+        self._keys = keys_all
+        self._ind = ind_all[ind_unique]
+        self._w = w_all[ind_unique]
+
+        return ind, w
+
+    def operator(self, pts):
+        """Sparse sampling operator which maps a flattened volume onto an array of
+        voxel coordinates.
+
+        Parameters
+        ----------
+        pts : (N,3) np.ndarray
+            Coordinates in voxel space.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix, shape=(N, X*Y*Z)
+            Sparse sampling matrix.
+
+        """
+
+        ind, w = self.weights(pts)
+
+        return _weights_to_csr(ind, w, int(np.prod(self.dims)))
+
+    def sample(self, pts, arr):
+        """Sample a volume with arbitrary trailing dimensions at an array of voxel
+        coordinates.
+
+        Parameters
+        ----------
+        pts : (N,3) np.ndarray
+            Coordinates in voxel space.
+        arr : (X,Y,Z,...) np.ndarray
+            Volume array.
+
+        Returns
+        -------
+        (N,...) np.ndarray
+            Sampled values.
+
+        """
+
+        shape = np.shape(arr)
+        if tuple(shape[:3]) != self.dims:
+            raise ValueError("Volume dimensions do not match the cached grid!")
+        arr = np.reshape(arr, (int(np.prod(self.dims)), -1))
+
+        return (self.operator(pts) @ arr).reshape((len(pts),) + tuple(shape[3:]))
+
+    def volume(self, file_in):
+        """Load volume data once and keep it in memory.
+
+        Parameters
+        ----------
+        file_in : str
+            File name of volume.
+
+        Returns
+        -------
+        np.ndarray
+            Volume array.
+
+        """
+
+        file_in = str(file_in)
+        if file_in not in self._volumes:
+            self._volumes[file_in] = np.asanyarray(nb.load(file_in).dataobj)
+
+        return self._volumes[file_in]
+
+
+def resampling_matrix1d(t_old, t_new, method="cubic"):
+    """Compute a linear operator which resamples time series from one time grid
+    onto another. For a fixed input grid, both interpolation methods are linear in
+    the data. Therefore, the operator only has to be computed once and can be
+    applied to an arbitrary number of time series with a single matrix
+    multiplication.
+
+    Parameters
+    ----------
+    t_old : (T,) np.ndarray
+        Input time grid. Must be regular for fourier interpolation.
+    t_new : (M,) np.ndarray
+        Output time grid.
+    method : str, optional (cubic | fourier)
+        Interpolation method. Cubic computes the interpolating cubic spline (same
+        as InterpolatedUnivariateSpline with k=3). Fourier computes a phase shift
+        (sinc) interpolation, i.e., the band-limited trigonometric interpolant of
+        the periodically continued time series. The default is "cubic".
+
+    Raises
+    ------
+    ValueError
+        If `method` is not supported.
+
+    Returns
+    -------
+    (M,T) np.ndarray
+        Resampling matrix.
+
+    """
+
+    t_old = np.asarray(t_old, dtype=np.float64)
+    t_new = np.asarray(t_new, dtype=np.float64)
+    n = len(t_old)
+
+    if method == "cubic":
+        # the spline of each unit impulse gives one column of the operator
+        eye = np.eye(n)
+        return np.column_stack([Interp(t_old, eye[i], k=3)(t_new) for i in range(n)])
+
+    if method == "fourier":
+        # sum over cos(2*pi*k*(tau-j)/n) with real fft weights
+        tau = (t_new - t_old[0]) / (t_old[1] - t_old[0])
+        k = np.arange(n // 2 + 1)
+        w = np.full(len(k), 2.0) / n
+        w[0] /= 2
+        if not np.mod(n, 2):
+            w[-1] /= 2
+        phi_new = 2 * np.pi * np.outer(tau, k) / n
+        phi_old = 2 * np.pi * np.outer(np.arange(n), k) / n
+        return (np.cos(phi_new) * w).dot(np.cos(phi_old).T) + (
+            np.sin(phi_new) * w
+        ).dot(np.sin(phi_old).T)
+
+    raise ValueError("Unknown interpolation method: " + str(method))
+
+
+def resample1d(arr, mat):
+    """Apply a resampling matrix to each row of a 2D array. The function is
+    picklable in combination with functools.partial and can therefore be used with
+    `apply_parallel`.
+
+    Parameters
+    ----------
+    arr : (N,T) np.ndarray
+        Array of time series.
+    mat : (M,T) np.ndarray
+        Resampling matrix.
+
+    Returns
+    -------
+    (N,M) np.ndarray
+        Resampled time series.
+
+    """
+
+    return np.asarray(arr).dot(np.asarray(mat).T)
+
+
+def _weights_to_csr(ind, w, nvox):
+    """Convert flat voxel indices and weights to a sparse sampling matrix."""
+
+    n, k = np.shape(ind)
+    indptr = np.arange(0, n * k + 1, k)
+
+    return csr_matrix((w.ravel(), ind.ravel(), indptr), shape=(n, nvox))
+
+
 def _careful_divide(v, v0, v1):
     """Only divide if v0 and v1 are different from each other."""
 
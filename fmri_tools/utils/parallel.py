@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# python standard library inputs
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# external inputs
+import numpy as np
+
+__all__ = ["apply_parallel"]
+
+
+def apply_parallel(func, arr, n_jobs=1, chunk_size=None):
+    """Apply a function to chunks of a voxel x time array in parallel.
+
+    The first (voxel) axis of the input array is split into chunks which are
+    dispatched to a pool of worker processes. Input and output arrays are held
+    in shared memory buffers so that no array data has to be pickled. Only the
+    function itself is sent to the workers, i.e., it has to be picklable (e.g.
+    a module-level function or a functools.partial thereof). The function has
+    to operate row-wise, i.e., each row of the output only depends on the same
+    row of the input.
+
+    Parameters
+    ----------
+    func : callable
+        Function which maps an (N,T) array onto an (N,...) array.
+    arr : np.ndarray, shape=(V,T)
+        Input array.
+    n_jobs : int, optional
+        Number of worker processes. If set to -1, all available cores are used.
+        With n_jobs=1, the function is applied directly without a process pool.
+        The default is 1.
+    chunk_size : int, optional
+        Number of rows per chunk. If None, the array is split into 4 chunks per
+        worker. The default is None.
+
+    Returns
+    -------
+    np.ndarray, shape=(V,...)
+        Output array.
+
+    """
+
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    arr = np.ascontiguousarray(arr)
+    nv = len(arr)
+    if n_jobs <= 1 or nv < 2:
+        return func(arr)
+
+    if chunk_size is None:
+        chunk_size = int(np.ceil(nv / (4 * n_jobs)))
+
+    # determine output shape and data type from the first row
+    tmp = np.asarray(func(arr[:1]))
+    shape_out = (nv,) + tmp.shape[1:]
+
+    shm_in = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shm_out = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(shape_out)) * tmp.dtype.itemsize, 1)
+    )
+    try:
+        arr_in = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm_in.buf)
+        arr_in[:] = arr
+        spec_in = (shm_in.name, arr.shape, arr.dtype.str)
+        spec_out = (shm_out.name, shape_out, tmp.dtype.str)
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(_worker, func, spec_in, spec_out, i,
+                                min(i + chunk_size, nv))
+                for i in range(0, nv, chunk_size)
+            ]
+            for f in futures:
+                f.result()
+
+        res = np.ndarray(shape_out, dtype=tmp.dtype, buffer=shm_out.buf).copy()
+        del arr_in
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
+
+    return res
+
+
+def _worker(func, spec_in, spec_out, start, stop):
+    """Apply function to one chunk of the shared input array and write the
+    result into the shared output array."""
+
+    shm_in = shared_memory.SharedMemory(name=spec_in[0])
+    shm_out = shared_memory.SharedMemory(name=spec_out[0])
+    try:
+        arr_in = np.ndarray(spec_in[1], dtype=spec_in[2], buffer=shm_in.buf)
+        arr_out = np.ndarray(spec_out[1], dtype=spec_out[2], buffer=shm_out.buf)
+        arr_out[start:stop] = func(arr_in[start:stop])
+        del arr_in, arr_out
+    finally:
+        shm_in.close()
+        shm_out.close()
@@ -2,24 +2,33 @@
 
 # python standard library inputs
 import os
+from functools import partial
 
 # external inputs
 import numpy as np
 import nibabel as nb
 from sh import gunzip
-from scipy.interpolate import InterpolatedUnivariateSpline as Interp
 
 # local inputs
 from ..io.get_filename import get_filename
+from ..io.vol import nifti_memmap
+from ..preprocessing.timeseries import MaskedTimeseries
+from .interpolation import resampling_matrix1d, resample1d
+from .parallel import apply_parallel
 
 
 def regrid_time_series(file_in, path_output, tr_old, tr_new, t_start=0,
-                       nvol_remove=0):
+                       nvol_remove=0, block_size=8, n_jobs=1, file_mask=None):
     """Regrid time series.
 
     This function interpolates the time series onto a new time grid using cubic 
-    interpolation. Only for writing the new TR in the header of the output time 
-    series, AFNI has to be included in the search path.    
+    interpolation. The spline interpolation from the input to the output time 
+    grid is computed once as resampling matrix and applied to blocks of slices 
+    along the z-axis, which are read from the image data object and written 
+    into a pre-allocated output file. Therefore, peak memory is bounded by the 
+    block size. If a mask is given, only in-mask voxels of each block are 
+    gathered and interpolated and voxels outside of the mask are set to zero. 
+    The new TR is written into the header of the output time series.
 
     Parameters
     ----------
@@ -35,6 +44,14 @@ def regrid_time_series(file_in, path_output, tr_old, tr_new, t_start=0,
         Shift time series in s (t_start >= 0 and <= TR_old). The default is 0.
     nvol_remove : int, optional
         Remove volumes at the end of the time series.
+    block_size : int, optional
+        Number of slices along the z-axis which are processed at once. The 
+        default is 8.
+    n_jobs : int, optional
+        Number of worker processes used to interpolate chunks of voxels in
+        parallel (-1: all cores). The default is 1.
+    file_mask : str, optional
+        Binary mask (e.g. from skullstrip_epi). The default is None.
 
     Returns
     -------
@@ -50,68 +67,55 @@ def regrid_time_series(file_in, path_output, tr_old, tr_new, t_start=0,
 
     # load data
     data = nb.load(file_in)
-    nx = data.header["dim"][1]
-    ny = data.header["dim"][2]
-    nz = data.header["dim"][3]
-    nt = data.header["dim"][4]
+    nx, ny, nz, nt = data.shape[:4]
+    if file_mask is None:
+        mask = np.ones((nx, ny, nz), dtype=bool)
+    else:
+        mask = MaskedTimeseries.load_mask(file_mask)
 
     # get time grid
     tt = tr_old * nt  # total acquisition time
     tr_append = np.floor(t_start / tr_old + 1).astype(int) * tr_old  # number of appended TRs in input array
+    n_append = int(tr_append / tr_old)
 
     # input grid
-    t_old = np.arange(-tr_append, tt + tr_append, tr_old) + t_start
+    t_old = np.arange(nt + 2 * n_append) * tr_old - tr_append + t_start
 
-    # output grid
+    # output grid without appended volumes
     t_new = np.arange(0, tt + tr_append, tr_new)
-    t_new_append = np.flip(np.arange(0, -tr_append, -tr_new)[1:])
-    if not len(t_new_append):
-        t_new_append = -tr_new
-    t_new = np.append(t_new_append, t_new)
-
-    # load array with appended volumes
-    n_append = int(tr_append / tr_old)
-    data_array = np.zeros((nx, ny, nz, nt + 2 * n_append))
-    data_array[:, :, :, n_append:-n_append] = data.get_fdata()
-    for i in range(n_append):
-        data_array[:, :, :, i] = data.get_fdata()[:, :, :, 0]
-        data_array[:, :, :, -(i + 1)] = data.get_fdata()[:, :, :, -1]
-
-    # temporal interpolation
-    data_array_regrid = np.zeros((nx, ny, nz, len(t_new)))
-    for x in range(nx):
-        for y in range(ny):
-            for z in range(nz):
-                cubic_interper = Interp(t_old, data_array[x, y, z, :], k=3)
-                data_array_regrid[x, y, z, :] = cubic_interper(t_new)
-
-    # delete appended volumes
-    vols_keep1 = t_new >= 0
-    vols_keep2 = t_new < tt
-    vols_keep = vols_keep1 * vols_keep2
-    data_array_regrid = data_array_regrid[:, :, :, vols_keep]
-
-    # clean corrected array
-    data_array_regrid[np.isnan(data_array_regrid)] = 0
-    data_array_regrid[data_array_regrid < 0] = 0
+    t_new = t_new[t_new < tt]
 
     # remove volumes at the end
     if nvol_remove:
-        data_array_regrid = data_array_regrid[:, :, :, :-nvol_remove]
+        t_new = t_new[:-nvol_remove]
+
+    # resampling matrix
+    mat = resampling_matrix1d(t_old, t_new, "cubic")
 
     # update data header
-    data.header["dim"][4] = np.shape(data_array_regrid)[3]
-    data.header["datatype"] = 16
-
-    # write output
-    output = nb.Nifti1Image(data_array_regrid, data.affine, data.header)
-    nb.save(output,
-            os.path.join(path_output, name_input + "_upsampled" + ext_input))
-
-    # change TR in header
-    os.system("3drefit " +
-              "-TR " + str(tr_new) + " " +
-              os.path.join(path_output, name_input + "_upsampled" + ext_input))
+    header = data.header.copy()
+    header.set_zooms(header.get_zooms()[:3] + (tr_new,))
+
+    # temporal interpolation
+    file_out = os.path.join(path_output, name_input + "_upsampled" + ext_input)
+    with nifti_memmap(file_out, (nx, ny, nz, len(t_new)), data.affine, header,
+                      np.float32) as arr_out:
+        for z0 in range(0, nz, block_size):
+            z1 = min(z0 + block_size, nz)
+
+            # gather in-mask voxels of block with appended volumes
+            ts = MaskedTimeseries(data.dataobj[:, :, z0:z1, :], mask[:, :, z0:z1])
+            if not ts.nv:
+                continue
+            arr = np.pad(ts.data, ((0, 0), (n_append, n_append)), "edge")
+
+            arr_regrid = apply_parallel(partial(resample1d, mat=mat), arr, n_jobs)
+
+            # clean corrected array
+            arr_regrid[np.isnan(arr_regrid)] = 0
+            arr_regrid[arr_regrid < 0] = 0
+
+            arr_out[:, :, z0:z1, :] = ts.scatter(arr_regrid)
 
 
 def regrid_time_series_afni(file_in, n=2):
@@ -2,23 +2,58 @@
 
 # python standard library inputs
 import os
-import datetime
-from shutil import copyfile
+import hashlib
+from collections import OrderedDict
 
 # external inputs
 import numpy as np
-from sh import gunzip
+import nibabel as nb
+from scipy.ndimage import map_coordinates, spline_filter
+from scipy.sparse import csr_matrix
 
 # local inputs
-from ..io.get_filename import get_filename
+from ..io.vol import nifti_memmap
 
+__all__ = ["resample_volume", "resample_affine"]
 
-def resample_volume(file_in, file_out, dxyz=[0.4, 0.4, 0.4], rmode="Cu"):
+# interpolation order of each resampling mode (None: cubic lagrange)
+_RMODE = {
+    "NN": 0,
+    "nearest": 0,
+    "Li": 1,
+    "Linear": 1,
+    "linear": 1,
+    "cubic": 3,
+    "Cu": None,
+}
+
+# unsupported afni interpolation modes
+_RMODE_UNSUPPORTED = {
+    "Bk": "blocky interpolation (afni) is not supported, use NN, Li or Cu",
+}
+
+# memoized outputs as {(input stat, voxel size, mode): (filename, mtime)} and
+# content hashes of inputs as {input stat: hash}, both bounded to the most
+# recently used entries
+_CACHE_SIZE = 32
+_CACHE = OrderedDict()
+_HASH = OrderedDict()
+
+
+def resample_volume(file_in, file_out, dxyz=[0.4, 0.4, 0.4], rmode="Cu",
+                    block_size=16, cache=True):
     """Resample volume.
 
-    This function resamples a nifti volume using the afni function 3dresample. 
-    Before running the function, set the afni environment by calling AFNI in 
-    the terminal.    
+    This function resamples a nifti volume to a new voxel size. The resampled
+    grid covers the same field of view as the input grid (same as the afni
+    function 3dresample), i.e., outer voxel edges of both grids coincide. Data
+    is interpolated on blocks of slices of the output grid along the z-axis and
+    written block-wise to disk. All volumes of 4D inputs are resampled. Results
+    are memoized by the input file (path, size and modification time or, for
+    copies of a previous input, content hash), the voxel size and the
+    interpolation mode, i.e., repeated calls with the same input only rewrite the
+    previously written output in the format of the output filename. Only the
+    most recently used results are memoized.
 
     Parameters
     ----------
@@ -27,42 +62,213 @@ def resample_volume(file_in, file_out, dxyz=[0.4, 0.4, 0.4], rmode="Cu"):
     file_out : str
         Nifti output filename.
     dxyz : list, optional
-        Array of target resolution in single dimensions. The default is 
+        Array of target resolution in single dimensions. The default is
         [0.4, 0.4, 0.4].
     rmode : str, optional
-        Interpolation methods (Linear, NN, Cu, Bk). The default is "Cu".
+        Interpolation methods (NN or nearest, Li or linear, cubic for cubic
+        b-splines, Cu for cubic lagrange polynomials as in afni). Blocky
+        interpolation (Bk) of afni is not supported. The default is "Cu".
+    block_size : int, optional
+        Number of output slices which are interpolated at once. The default is
+        16.
+    cache : bool, optional
+        Use and update memoized results. The default is True.
+
+    Raises
+    ------
+    ValueError
+        If `rmode` is not supported.
 
     Returns
     -------
     None.
-    
+
+    """
+
+    if rmode in _RMODE_UNSUPPORTED:
+        raise ValueError("Interpolation mode " + rmode + ": " +
+                         _RMODE_UNSUPPORTED[rmode] + "!")
+    if rmode not in _RMODE:
+        raise ValueError("Unknown interpolation mode: " + str(rmode))
+
+    # memoized output
+    key = (_file_stat(file_in), tuple(float(d) for d in dxyz[:3]), rmode)
+    file_cache = _lookup(key) if cache else None
+    if file_cache:
+        if os.path.abspath(file_cache) != os.path.abspath(file_out):
+            nb.save(nb.load(file_cache), file_out)
+        return
+
+    # load data
+    img = nb.load(file_in)
+    arr = np.asanyarray(img.dataobj)
+    shape_in = arr.shape[:3]
+    arr = arr.reshape(shape_in + (-1,))
+    dtype = arr.dtype if _RMODE[rmode] == 0 else np.float32
+
+    # target grid
+    shape_out, affine_out = resample_affine(shape_in, img.affine, dxyz)
+    scale = np.diag(np.linalg.inv(img.affine).dot(affine_out))[:3]
+    coords = [(np.arange(n) + 0.5) * s - 0.5 for n, s in zip(shape_out, scale)]
+
+    # prefilter cubic b-splines once for the whole volume (edge padding as in
+    # scipy.ndimage.map_coordinates)
+    if _RMODE[rmode] == 3:
+        npad = 12
+        arr = np.pad(arr, ((npad, npad),) * 3 + ((0, 0),), mode="edge")
+        arr = np.stack([spline_filter(arr[..., i].astype(np.float64), 3,
+                                      mode="nearest")
+                        for i in range(arr.shape[3])], axis=-1)
+        coords = [c + npad for c in coords]
+
+    with nifti_memmap(file_out, shape_out + img.shape[3:], affine_out,
+                      img.header, dtype) as arr_out:
+        arr_out = arr_out.reshape(shape_out + (arr.shape[3],), order="F")
+        for z0 in range(0, shape_out[2], block_size):
+            z1 = min(z0 + block_size, shape_out[2])
+            if _RMODE[rmode] is None:
+                res = _lagrange3d(arr, coords[0], coords[1], coords[2][z0:z1])
+            else:
+                grid = np.meshgrid(coords[0], coords[1], coords[2][z0:z1],
+                                   indexing="ij")
+                res = np.stack([map_coordinates(arr[..., i], grid,
+                                                order=_RMODE[rmode],
+                                                mode="nearest",
+                                                prefilter=False)
+                                for i in range(arr.shape[3])], axis=-1)
+            arr_out[:, :, z0:z1, :] = res
+
+    if cache:
+        _store(_CACHE, key, (file_out, os.stat(file_out).st_mtime_ns))
+
+
+def resample_affine(shape, affine, dxyz):
+    """Compute matrix size and affine of a resampled grid with new voxel size
+    which covers the same field of view as the input grid.
+
+    Parameters
+    ----------
+    shape : tuple
+        Matrix size of the input grid.
+    affine : np.ndarray, shape=(4,4)
+        Affine transformation matrix of the input grid.
+    dxyz : list
+        Target voxel size.
+
+    Returns
+    -------
+    shape_out : tuple
+        Matrix size of the resampled grid.
+    affine_out : np.ndarray, shape=(4,4)
+        Affine transformation matrix of the resampled grid.
+
     """
 
-    # get path and file extension of input file
-    path_in, _, ext_in = get_filename(file_in)
-
-    # make temporary copy of input file
-    tmp1 = np.random.randint(0, 10, 5)
-    tmp1 = ''.join(str(i) for i in tmp1)
-    tmp2 = datetime.datetime.now().strftime("%S%f")
-    tmp_string = tmp1 + tmp2
-    file_tmp = os.path.join(path_in, "tmp_" + tmp_string + ext_in)
-
-    if not os.path.exists(file_tmp) and not os.path.exists(file_tmp[:-3]):
-        copyfile(file_in, file_tmp)
-    else:
-        raise FileExistsError("Temporary file already exists!")
-
-    if os.path.splitext(file_tmp)[1] == ".gz":
-        gunzip(file_tmp)
-        file_tmp = os.path.splitext(file_tmp)[0]
-
-    # resample volume
-    os.system("3dresample " +
-              "-dxyz " + str(dxyz[0]) + " " + str(dxyz[1]) + " " + str(dxyz[2]) + " " +
-              "-rmode " + str(rmode) + " " +
-              "-inset " + file_tmp + " " +
-              "-prefix " + file_out)
-
-    # remove temporary copy
-    os.remove(file_tmp)
+    zooms = np.sqrt(np.sum(affine[:3, :3] ** 2, axis=0))
+    scale = np.asarray(dxyz[:3], dtype=np.float64) / zooms
+    shape_out = tuple(int(max(np.round(n / s), 1))
+                      for n, s in zip(shape[:3], scale))
+
+    # voxel centers of the new grid in voxel coordinates of the input grid
+    m = np.eye(4)
+    m[:3, :3] = np.diag(scale)
+    m[:3, 3] = 0.5 * scale - 0.5
+
+    return shape_out, affine.dot(m)
+
+
+def _lagrange3d(arr, x, y, z):
+    """Separable cubic lagrange interpolation at grid points x, y and z of an
+    array with trailing dimension. Only input slices required for z are used."""
+
+    mat = [_lagrange_matrix(c, n) for c, n in zip([x, y, z], arr.shape[:3])]
+    cols = np.unique(mat[2].indices)
+    arr = arr[:, :, cols[0]:cols[-1] + 1].astype(np.float64)
+    mat[2] = mat[2][:, cols[0]:cols[-1] + 1]
+
+    for i in range(3):
+        arr = np.moveaxis(arr, i, 0)
+        shape = arr.shape
+        arr = mat[i].dot(arr.reshape(shape[0], -1)).reshape((-1,) + shape[1:])
+        arr = np.moveaxis(arr, 0, i)
+
+    return arr
+
+
+def _lagrange_matrix(c, n):
+    """Sparse 1D cubic lagrange interpolation matrix. Indices outside of the
+    grid are clamped to the edge."""
+
+    c0 = np.floor(c).astype(int)
+    f = c - c0
+    w = np.column_stack(((-f * (f - 1) * (f - 2)) / 6,
+                         ((f + 1) * (f - 1) * (f - 2)) / 2,
+                         (-(f + 1) * f * (f - 2)) / 2,
+                         ((f + 1) * f * (f - 1)) / 6))
+    ind = np.clip(c0[:, None] + np.arange(-1, 3), 0, n - 1)
+    rows = np.repeat(np.arange(len(c)), 4)
+
+    return csr_matrix((w.ravel(), (rows, ind.ravel())), shape=(len(c), n))
+
+
+def _lookup(key):
+    """Filename of a valid memoized output. Inputs are identified by their file
+    stat. Only if a previous input of the same size exists at another path or
+    was modified, content hashes are compared."""
+
+    for k in [key] + [k for k in _CACHE if k != key and k[1:] == key[1:] and
+                      k[0][1] == key[0][1]]:
+        if k not in _CACHE:
+            continue
+        file_cache, mtime = _CACHE[k]
+        if not os.path.exists(file_cache) or \
+                os.stat(file_cache).st_mtime_ns != mtime:
+            del _CACHE[k]
+            continue
+        if k == key:
+            _CACHE.move_to_end(k)
+            return file_cache
+        file_hash = _file_hash(k[0])
+        if file_hash is not None and file_hash == _file_hash(key[0]):
+            _CACHE.move_to_end(k)
+            return file_cache
+
+    return None
+
+
+def _file_stat(file_in):
+    """Absolute path, size and modification time of a file."""
+
+    stat = os.stat(file_in)
+
+    return os.path.abspath(file_in), stat.st_size, stat.st_mtime_ns
+
+
+def _file_hash(file_stat, chunk_size=2**20):
+    """SHA-1 hash of file content. Hashes are memoized by file stat and are
+    only valid while the file is unchanged."""
+
+    if file_stat in _HASH:
+        _HASH.move_to_end(file_stat)
+        return _HASH[file_stat]
+    if not os.path.exists(file_stat[0]) or _file_stat(file_stat[0]) != file_stat:
+        return None
+
+    h = hashlib.sha1()
+    with open(file_stat[0], "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    return _store(_HASH, file_stat, h.hexdigest())
+
+
+def _store(cache, key, value):
+    """Insert an entry into a memoization dictionary and drop the least recently
+    used entries beyond the cache size."""
+
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _CACHE_SIZE:
+        cache.popitem(last=False)
+
+    return value
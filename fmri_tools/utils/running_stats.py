@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# python standard library inputs
+import os
+
+# external inputs
+import numpy as np
+import nibabel as nb
+
+# local inputs
+from ..preprocessing.timeseries import MaskedTimeseries
+
+__all__ = ["RunningStats", "stream_stats", "write_stats", "stream_median"]
+
+
+class RunningStats:
+    """Running voxel-wise statistics over time.
+
+    Mean and variance are accumulated over blocks of time points with the
+    parallel variant of Welford's algorithm [1]_, i.e., mean and sum of squared
+    deviations of each block are computed separately and merged with the
+    accumulated statistics. This is numerically stable even if many runs with
+    different baseline are combined.
+
+    Parameters
+    ----------
+    shape : tuple
+        Spatial shape of the data.
+
+    References
+    ----------
+    .. [1] Chan TF, et al. Algorithms for computing the sample variance:
+       analysis and recommendations. Am Stat 37(3), 242--247 (1983).
+
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.n = 0
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+
+    @property
+    def var(self):
+        """Temporal variance."""
+        return self.m2 / self.n if self.n else np.zeros(self.shape)
+
+    @property
+    def std(self):
+        """Temporal standard deviation."""
+        return np.sqrt(self.var)
+
+    @property
+    def tsnr(self):
+        """Temporal signal-to-noise ratio (zero where std is zero)."""
+        std = self.std
+        return np.divide(self.mean, std, out=np.zeros(self.shape), where=std != 0)
+
+    def update(self, arr):
+        """Merge a block of time points (last axis) into the statistics."""
+        arr = np.asarray(arr, dtype=np.float64)
+        n_b = arr.shape[-1]
+        if not n_b:
+            return self
+        mean_b = np.mean(arr, axis=-1)
+        m2_b = np.sum((arr - mean_b[..., np.newaxis]) ** 2, axis=-1)
+
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta**2 * self.n * n_b / n
+        self.n = n
+
+        return self
+
+
+def _iter_blocks(file_in, t_block):
+    """Iterate over blocks of time points of one or more files."""
+    if not isinstance(file_in, (list, tuple)):
+        file_in = [file_in]
+    for f in file_in:
+        img = nb.load(f)
+        nt = img.shape[3] if len(img.shape) > 3 else 1
+        for t0 in range(0, nt, t_block):
+            t1 = min(t0 + t_block, nt)
+            yield np.asarray(img.dataobj[..., t0:t1], dtype=np.float64).reshape(
+                img.shape[:3] + (t1 - t0,)
+            )
+
+
+def stream_stats(file_in, t_block=32, mask=None):
+    """Compute voxel-wise mean, standard deviation and tSNR of one or more time
+    series in a single pass. Time series are read in blocks of volumes from the
+    image data objects so that peak memory is bounded by the block size. If a
+    mask is given, statistics are only accumulated for in-mask voxels and are
+    zero outside of the mask.
+
+    Parameters
+    ----------
+    file_in : str or list
+        Single file or list of files.
+    t_block : int, optional
+        Number of volumes which are read at once. The default is 32.
+    mask : np.ndarray, optional
+        3D binary mask. The default is None.
+
+    Returns
+    -------
+    RunningStats
+        Accumulated statistics.
+
+    """
+
+    ts = None if mask is None else MaskedTimeseries(None, mask)
+    stats = None
+    for arr in _iter_blocks(file_in, t_block):
+        arr = arr if ts is None else ts.gather(arr)
+        stats = RunningStats(arr.shape[:-1]) if stats is None else stats
+        stats.update(arr)
+
+    if ts is not None:
+        stats_masked = stats
+        stats = RunningStats(ts.mask.shape)
+        stats.n = stats_masked.n
+        stats.mean = ts.scatter(stats_masked.mean)
+        stats.m2 = ts.scatter(stats_masked.m2)
+
+    return stats
+
+
+def write_stats(file_in, path_output, name_output, maps=("mean", "std", "tsnr"),
+                tsnr_max=None, ext=".nii", t_block=32, mask=None):
+    """Write voxel-wise mean, standard deviation and tSNR maps of one or more time
+    series. All maps are computed from a single streaming pass over the files (see
+    stream_stats) and are written as <map>_<name_output><ext> with the header of
+    the first file.
+
+    Parameters
+    ----------
+    file_in : str or list
+        Single file or list of files.
+    path_output : str or None
+        Path where maps are saved. If None, maps are only returned.
+    name_output : str
+        Output file name without file extension.
+    maps : tuple, optional
+        Maps which are written (mean, std, tsnr). The default is
+        ("mean", "std", "tsnr").
+    tsnr_max : float, optional
+        Threshold unrealistic high tsnr values (applied if set > 0). The default
+        is None.
+    ext : str, optional
+        Output file extension. The default is ".nii".
+    t_block : int, optional
+        Number of volumes which are read at once. The default is 32.
+    mask : np.ndarray, optional
+        3D binary mask. The default is None.
+
+    Raises
+    ------
+    ValueError
+        If `maps` contains an unknown map.
+
+    Returns
+    -------
+    dict
+        Computed maps.
+
+    """
+
+    if not set(maps) <= {"mean", "std", "tsnr"}:
+        raise ValueError("Unknown map: " + str(maps))
+
+    stats = stream_stats(file_in, t_block, mask)
+    res = {m: getattr(stats, m) for m in maps}
+    if "tsnr" in res:
+        res["tsnr"][np.isnan(res["tsnr"])] = 0
+        if tsnr_max:
+            res["tsnr"][res["tsnr"] > tsnr_max] = tsnr_max
+
+    if path_output is not None:
+        if path_output and not os.path.exists(path_output):
+            os.makedirs(path_output)
+        img = nb.load(file_in[0] if isinstance(file_in, (list, tuple)) else file_in)
+        header = img.header.copy()
+        header["dim"][0] = 3
+        header["dim"][4] = 1
+        for m, arr in res.items():
+            nb.save(nb.Nifti1Image(arr, img.affine, header),
+                    os.path.join(path_output, m + "_" + name_output + ext))
+
+    return res
+
+
+def stream_median(file_in, block_size=4):
+    """Compute the voxel-wise temporal median of one or more time series. The
+    median needs all time points of a voxel. Therefore, blocks of slices along
+    the z-axis are gathered from all files at once, i.e., peak memory is bounded
+    by the block size and does not depend on the number of slices.
+
+    Parameters
+    ----------
+    file_in : str or list
+        Single file or list of files.
+    block_size : int, optional
+        Number of slices along the z-axis which are processed at once. The
+        default is 4.
+
+    Returns
+    -------
+    np.ndarray
+        Median array.
+
+    """
+
+    if not isinstance(file_in, (list, tuple)):
+        file_in = [file_in]
+    img = [nb.load(f) for f in file_in]
+    nx, ny, nz = img[0].shape[:3]
+    arr_median = np.zeros((nx, ny, nz))
+    for z0 in range(0, nz, block_size):
+        z1 = min(z0 + block_size, nz)
+        arr = np.concatenate(
+            [np.asarray(i.dataobj[:, :, z0:z1, ...], dtype=np.float64).reshape(
+                nx, ny, z1 - z0, -1) for i in img],
+            axis=3,
+        )
+        arr_median[:, :, z0:z1] = np.median(arr, axis=3)
+
+    return arr_median
@@ -3,14 +3,10 @@
 Make visual fieldsign map
 
 The purpose of the following script is to make a visual fieldsign map from
-sampled phase-encoded retinotopy data. The script needs an installation of
-freesurfer.
+sampled phase-encoded retinotopy data.
 
 """
 
-# python standard library inputs
-import os
-
 # local inputs
 from fmri_tools.mapping.vfs import get_vfs
 
@@ -31,6 +27,3 @@ path_output = "/data/pt_01880/Experiment1_ODC/p3/retinotopy/avg/surf/"
 get_vfs(input_sphere, input_white, input_patch, input_aparc, hemi, ecc_real,
         ecc_imag, pol_real, pol_imag, path_output, fwhm_ecc=4.0, fwhm_pol=2.0,
         fwhm_vfs=8.0, cleanup=True)
-
-# remove generated tmp.dat file
-os.remove(os.path.join(os.getcwd(), "tmp.dat"))
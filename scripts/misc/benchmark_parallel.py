@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark parallel backend
+
+This scripts measures the scaling of voxel-wise time series filtering with the
+number of worker processes. A random time series array is filtered with
+different numbers of workers and the runtime and speedup relative to a single
+process are printed to the console.
+
+"""
+
+# python standard library inputs
+import time
+
+# external inputs
+import numpy as np
+
+# local inputs
+from fmri_tools.preprocessing.timeseries import FilterTimeseries
+
+# input
+dims = (100, 100, 40, 300)  # array dimensions
+TR = 2.0  # repetition time in s
+cutoff_sec = 180  # highpass cutoff in s
+n_jobs = [1, 2, 4, 8, 16, 32]  # number of worker processes
+n_repeat = 3  # best of n repetitions
+
+# do not edit below
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    arr = rng.standard_normal(dims)
+
+    t_ref = None
+    print(f"{'n_jobs':>6} {'detrend [s]':>12} {'butter [s]':>12} {'speedup':>8}")
+    for n in n_jobs:
+        t_detrend = []
+        t_butter = []
+        for _ in range(n_repeat):
+            t0 = time.perf_counter()
+            FilterTimeseries(arr, TR, n).detrend(cutoff_sec)
+            t1 = time.perf_counter()
+            FilterTimeseries(arr, TR, n).bandpass_butterworth(None, cutoff_sec)
+            t2 = time.perf_counter()
+            t_detrend.append(t1 - t0)
+            t_butter.append(t2 - t1)
+
+        t_total = min(t_detrend) + min(t_butter)
+        t_ref = t_total if t_ref is None else t_ref
+        print(f"{n:>6} {min(t_detrend):>12.3f} {min(t_butter):>12.3f} "
+              f"{t_ref / t_total:>8.2f}")
@@ -4,8 +4,7 @@ Bold correction of VASO data
 
 This scripts corrects a vaso time series for bold contamination. First, both
 time series are upsampled to a common time grid. BOLD correction is performed by
-dividing both time series. In the end, unrealistic vaso values are removed. The
-script needs an installation of afni.
+dividing both time series. In the end, unrealistic vaso values are removed.
 
 """
 
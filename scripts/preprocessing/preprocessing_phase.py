@@ -31,7 +31,7 @@ from nighres.intensity import phase_unwrapping
 # local inputs
 from fmri_tools.io.get_filename import get_filename
 from fmri_tools.utils.get_mean import get_mean
-from fmri_tools.utils.get_std import get_std
+from fmri_tools.utils.running_stats import write_stats
 from fmri_tools.preprocessing.deweight_mask import deweight_mask
 from fmri_tools.matlab import MatlabCommand
 
@@ -151,12 +151,10 @@ nb.save(output, os.path.join(path_phase, name_phase_temp + ext_phase))
 # get mean time series
 get_mean(os.path.join(path_magn, name_magn_temp + ext_magn), path_magn,
          name_magn, method="mean")
-get_mean(os.path.join(path_phase, name_phase_temp + ext_phase), path_phase,
-         name_phase, method="mean")
 
-# phase variance over time
-get_std(os.path.join(path_phase, name_phase_temp + ext_phase), path_phase,
-        name_phase)
+# phase mean and variance over time (single pass)
+write_stats(os.path.join(path_phase, name_phase_temp + ext_phase), path_phase,
+            name_phase, maps=("mean", "std"))
 
 # rescale phase data
 phase_img = nb.load(os.path.join(path_phase, "mean_" + name_phase + ext_phase))
@@ -2,16 +2,14 @@
 """
 Percent signal change conversion
 
-This scripts converts timeseries data into percent signal change.
+This scripts converts timeseries data into percent signal change. If a brain
+mask is given (e.g. from skullstrip_epi), only in-mask voxels are processed.
 
 """
 
-# external inputs
-import nibabel as nb
-
 # local inputs
 from fmri_tools.io.get_filename import get_filename
-from fmri_tools.preprocessing.timeseries import ScaleTimeseries
+from fmri_tools.preprocessing.timeseries import apply_chunked
 
 # input
 file_in = [
@@ -25,13 +23,11 @@ file_in = [
     "/data/pt_01880/Experiment1_ODC/p4/retinotopy2/ecc_contracting/data.nii",
 ]
 cutoff_psc = 50
+file_mask = None  # binary mask in the space of the time series
 
 # do not edit below
 
 for f in file_in:
-    data = nb.load(f)
-    scale = ScaleTimeseries(data.get_fdata())
-    arr_scaled = scale.psc(cutoff_psc)
-    output = nb.Nifti1Image(arr_scaled, data.affine, data.header)
     path, basename, ext = get_filename(f)
-    nb.save(output, f"{path}/p{basename}{ext}")
+    apply_chunked(f, f"{path}/p{basename}{ext}", "psc", cutoff_psc,
+                  file_mask=file_mask)
@@ -12,8 +12,9 @@ baseline condition. The CNR of the whole session is taken as the average across
 single runs. Similar computations of CNR can be found in Scheffler et al.
 (2016). If the outlier input array is not empty, outlier volumes are discarded
 from the analysis. Optionally, the time series can be filtered by a highpass
-filter. The input images should be in nifti format. The script needs an
-installation of afni.
+filter. If a brain mask is given (e.g. from skullstrip_epi), only in-mask voxels
+are gathered and CNR is zero outside of the mask. The input images should be in
+nifti format. The script needs an installation of afni.
 
 """
 
@@ -29,6 +30,7 @@ import nibabel as nb
 from fmri_tools.io.get_filename import get_filename
 from fmri_tools.processing.get_onset_vols import get_onset_vols
 from fmri_tools.matlab import MatlabCommand
+from fmri_tools.preprocessing.timeseries import MaskedTimeseries
 
 # input data
 img_input = [
@@ -58,6 +60,7 @@ cond_input = [
 ]
 
 outlier_input = []
+file_mask = None  # binary mask in the space of the time series
 
 # parameters
 condition0 = "rest"  # baseline condition
@@ -89,7 +92,13 @@ header = data_img.header
 affine = data_img.affine
 
 # get image dimension
-dim = data_img.header["dim"][1:4]
+dim = tuple(data_img.header["dim"][1:4])
+
+# get mask
+if file_mask is None:
+    mask = np.ones(dim, dtype=bool)
+else:
+    mask = MaskedTimeseries.load_mask(file_mask)
 
 # get outlier dummy array if not outlier input
 if not len(outlier_input):
@@ -118,18 +127,18 @@ for i in range(len(img_input)):
         # change input to highpass filtered time series
         name_file = "b" + name_file
 
-    # open baseline corrected data
+    # gather in-mask voxels of baseline corrected data
     data_img = nb.load(os.path.join(path_file, name_file + ext_file))
-    data_array = data_img.get_fdata()
+    ts = MaskedTimeseries(data_img.dataobj, mask)
 
     # sort volumes to conditions
-    data_condition0 = data_array[:, :, :, onsets0]
-    data_condition1 = data_array[:, :, :, onsets1]
+    data_condition0 = ts.data[:, onsets0]
+    data_condition1 = ts.data[:, onsets1]
 
     # mean
-    data_condition0_mean = np.mean(data_condition0, axis=3)
-    data_condition1_mean = np.mean(data_condition1, axis=3)
-    data_condition0_std = np.std(data_condition0, axis=3)
+    data_condition0_mean = np.mean(data_condition0, axis=1)
+    data_condition1_mean = np.mean(data_condition1, axis=1)
+    data_condition0_std = np.std(data_condition0, axis=1)
     data_condition0_std[data_condition0_std == 0] = np.nan
 
     # percent signal change
@@ -137,7 +146,7 @@ for i in range(len(img_input)):
     cnr[np.isnan(cnr)] = 0
 
     # sum volumes for each run
-    mean_cnr += cnr
+    mean_cnr += ts.scatter(cnr)
 
 # divide by number of runs
 mean_cnr /= len(img_input)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.utils.calc_mip import calc_mip
+
+FUNC = {
+    "min": np.min,
+    "max": np.max,
+    "mean": np.mean,
+    "percentile": lambda x, axis: np.percentile(x, 30, axis=axis),
+}
+
+
+def _reference(arr, size, axis, mode):
+    """Projection of each slice over the window [i-size, i+size-1]."""
+    arr = np.moveaxis(arr, axis, 0)
+    res = np.zeros_like(arr)
+    for i in range(arr.shape[0]):
+        window = arr[max(i - size, 0):min(i + size, arr.shape[0])]
+        res[i] = FUNC[mode](window, axis=0)
+    return np.moveaxis(res, 0, axis)
+
+
+@pytest.mark.parametrize("mode", ["min", "max", "mean", "percentile"])
+@pytest.mark.parametrize("axis, size", [(0, 1), (2, 3)])
+def test_calc_mip(tmp_path, mode, axis, size):
+    arr = np.random.default_rng(0).random((7, 6, 9))
+    file_in = tmp_path / "data.nii"
+    file_out = tmp_path / "mip.nii"
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_in)
+
+    calc_mip(str(file_in), str(file_out), size, axis, mode, q=30, chunk_size=2)
+    res = nb.load(file_out).get_fdata()
+    np.testing.assert_allclose(res, _reference(arr, size, axis, mode),
+                               atol=1e-12)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy.ndimage import map_coordinates
+
+# local inputs
+from fmri_tools.cmap.coordinate_mapping import CoordinateMapping
+from fmri_tools.registration.apply_registration import apply_registration
+
+SHAPE = (9, 8, 40)  # more slices than the default block size
+
+
+def _reference(vol, cmap):
+    """Sample each volume at the cmap coordinates with zero padding."""
+    coords = np.moveaxis(cmap, -1, 0)
+    res = np.stack([map_coordinates(vol[..., t], coords, order=1,
+                                    mode="grid-constant")
+                    for t in range(vol.shape[3])], axis=-1)
+    res[np.all(cmap == 0, axis=-1)] = 0
+    return res
+
+
+@pytest.fixture
+def vol():
+    return np.random.default_rng(0).random(SHAPE + (3,)).astype(np.float32)
+
+
+@pytest.mark.parametrize("shift", [(0, 0, 0), (0.3, -0.6, 1.2)])
+def test_sampling_matrix(vol, shift):
+    cmap = CoordinateMapping(shape=SHAPE).to_array() + np.float32(shift)
+    mat = CoordinateMapping(cmap).sampling_matrix(SHAPE, block_size=16)
+    res = mat.dot(vol.reshape(-1, vol.shape[3])).reshape(SHAPE + (-1,))
+    np.testing.assert_allclose(res, _reference(vol, cmap), atol=1e-5)
+
+
+def test_sampling_matrix_identity_apply(vol):
+    cmap = CoordinateMapping(shape=SHAPE)
+    mat = cmap.sampling_matrix(SHAPE, block_size=16)
+    res = mat.dot(vol.reshape(-1, vol.shape[3])).reshape(SHAPE + (-1,))
+    ref = cmap.apply(vol)
+    ref[0, 0, 0] = 0  # background voxel
+    np.testing.assert_allclose(res, ref, atol=1e-5)
+
+
+def test_apply_registration(vol, tmp_path):
+    cmap = CoordinateMapping(shape=SHAPE).to_array() + np.float32([0.3, 0, 1.2])
+    file_in = str(tmp_path / "vol.nii")
+    file_cmap = str(tmp_path / "cmap.nii")
+    file_out = str(tmp_path / "out.nii")
+    nb.save(nb.Nifti1Image(vol, np.eye(4)), file_in)
+    nb.save(nb.Nifti1Image(cmap, np.eye(4)), file_cmap)
+
+    apply_registration(file_in, file_cmap, file_out, r=None, t_block=2)
+    res = nb.load(file_out).get_fdata()
+    np.testing.assert_allclose(res, _reference(vol, cmap), atol=1e-5)
+
+
+def test_inverse_background():
+    ident = CoordinateMapping(shape=SHAPE).to_array()
+    cmap = ident + np.float32([2, 0, 0])
+    cmap[:, :, :10] = 0  # background target voxels
+    res = CoordinateMapping(cmap).inverse(SHAPE).to_array()
+
+    ref = np.zeros_like(ident)
+    ref[2:, :, 10:] = ident[:-2, :, 10:]
+    np.testing.assert_allclose(res, ref, atol=1e-5)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.processing.estimate_pv import estimate_pv
+
+SHAPE_UP = (10, 7, 9)
+SHAPE_DOWN = (4, 3, 4)
+
+
+def _axis(n_up, n_down, i):
+    """High-resolution indices and overlap weights of one target voxel."""
+    p = np.arange(0, n_down * n_up / n_down, n_up / n_down)
+    end = np.round(p[i + 1] - 0.5) if i < len(p) - 1 else n_up
+    ind = np.arange(np.round(p[i] - 0.5), end).astype(int)
+    w = np.ones(len(ind))
+    w[0] *= 1 - np.mod(p[i], 1) if np.mod(p[i], 1) else 1
+    if i < len(p) - 1 and np.mod(p[i + 1], 1):
+        w[-1] *= np.mod(p[i + 1], 1)
+    return ind, w
+
+
+def _reference(arr, normalize):
+    """Weighted block average of each target voxel excluding nans."""
+    res = np.zeros(SHAPE_DOWN)
+    for i, j, k in np.ndindex(SHAPE_DOWN):
+        ind, w = zip(*[_axis(n_up, n_down, c) for n_up, n_down, c
+                       in zip(SHAPE_UP, SHAPE_DOWN, (i, j, k))])
+        x = arr[np.ix_(*ind)]
+        w = w[0][:, None, None] * w[1][None, :, None] * w[2][None, None, :]
+        valid = ~np.isnan(x)
+        norm = np.sum(w[valid]) if normalize else np.sum(valid)
+        res[i, j, k] = np.sum(w[valid] * x[valid]) / norm
+    return res
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_estimate_pv(tmp_path, normalize):
+    rng = np.random.default_rng(0)
+    arr = (rng.random(SHAPE_UP) > 0.5).astype(np.float64)
+    arr[rng.random(SHAPE_UP) > 0.9] = np.nan
+    file_target = tmp_path / "target.nii"
+    file_border = tmp_path / "border.nii"
+    nb.save(nb.Nifti1Image(np.zeros(SHAPE_DOWN), np.eye(4)), file_target)
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_border)
+
+    estimate_pv(str(file_target), str(file_border), str(tmp_path), "border",
+                normalize)
+    res = nb.load(tmp_path / "border_pve.nii").get_fdata()
+    np.testing.assert_allclose(res, _reference(arr, normalize), atol=1e-12)
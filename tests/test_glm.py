@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.processing.glm import GLM, run_glm
+
+NT = 80
+
+
+@pytest.fixture
+def design():
+    t = np.arange(NT)
+    return np.column_stack((np.sin(2 * np.pi * t / 20), t / NT, np.ones(NT)))
+
+
+@pytest.fixture
+def arr(design):
+    rng = np.random.default_rng(0)
+    beta = rng.standard_normal((50, design.shape[1]))
+    noise = rng.standard_normal((50, NT))
+    noise[:, 1:] += 0.4 * noise[:, :-1]  # autocorrelated noise
+    return beta.dot(design.T) + noise
+
+
+def _lstsq(design, arr, contrast):
+    """Betas and t-values of each row by ordinary least squares."""
+    beta, _, _, _ = np.linalg.lstsq(design, arr.T, rcond=None)
+    res = arr.T - design.dot(beta)
+    sigma2 = np.sum(res**2, axis=0) / (len(design) - design.shape[1])
+    var = sigma2 * contrast.dot(np.linalg.inv(design.T.dot(design))).dot(contrast)
+    return beta.T, contrast.dot(beta) / np.sqrt(var)
+
+
+def test_ols(design, arr):
+    c = np.array([1, 0, 0])
+    beta, t = _lstsq(design, arr, c)
+    glm = GLM(design, chunk_size=7).fit(arr)
+    np.testing.assert_allclose(glm.beta, beta, atol=1e-10)
+    np.testing.assert_allclose(glm.t_contrast(c)[1], t, atol=1e-10)
+
+
+def test_prewhiten(design, arr):
+    c = np.array([1, 0, 0])
+    glm = GLM(design, prewhiten=True, chunk_size=7).fit(arr)
+    assert 0 < glm.rho < 1
+    w = glm.whitening_matrix
+    beta, t = _lstsq(w.dot(design), arr.dot(w.T), c)
+    np.testing.assert_allclose(glm.beta, beta, atol=1e-10)
+    np.testing.assert_allclose(glm.t_contrast(c)[1], t, atol=1e-10)
+
+
+def test_run_glm(design, arr, tmp_path):
+    file_in = str(tmp_path / "data.nii")
+    file_mask = str(tmp_path / "mask.nii")
+    mask = np.zeros(50, dtype=bool)
+    mask[::3] = True
+    nb.save(nb.Nifti1Image(arr.reshape(5, 2, 5, NT).astype(np.float32),
+                           np.eye(4)), file_in)
+    nb.save(nb.Nifti1Image(mask.reshape(5, 2, 5).astype(np.uint8), np.eye(4)),
+            file_mask)
+
+    run_glm(file_in, design, {"sin": [1, 0, 0]}, str(tmp_path), False,
+            file_mask, chunk_size=4)
+    _, t = _lstsq(design, arr.astype(np.float32)[mask].astype(np.float64),
+                  np.array([1, 0, 0]))
+    res = nb.load(str(tmp_path / "data_t_sin.nii")).get_fdata().ravel()
+    np.testing.assert_allclose(res[mask], t, rtol=1e-5)
+    np.testing.assert_array_equal(res[~mask], 0)
+
+
+def test_run_glm_mask_size(design, arr, tmp_path):
+    file_in = str(tmp_path / "data.nii")
+    file_mask = str(tmp_path / "mask.nii")
+    nb.save(nb.Nifti1Image(arr.reshape(5, 2, 5, NT), np.eye(4)), file_in)
+    nb.save(nb.Nifti1Image(np.ones((5, 2, 4), dtype=np.uint8), np.eye(4)),
+            file_mask)
+    with pytest.raises(ValueError):
+        run_glm(file_in, design, {}, str(tmp_path), file_mask=file_mask)
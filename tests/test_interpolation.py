@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import pytest
+from numpy.fft import fft, fftfreq
+from scipy.interpolate import InterpolatedUnivariateSpline as Interp
+
+# local inputs
+from fmri_tools.utils.interpolation import resampling_matrix1d, resample1d
+
+T_OLD = np.arange(20) * 2.0 - 1.5
+T_NEW = np.arange(-1.5, 36.5, 0.7)
+
+
+@pytest.fixture
+def arr():
+    return np.random.default_rng(0).standard_normal((5, len(T_OLD)))
+
+
+def _fourier(x, tau):
+    """Band-limited trigonometric interpolation at fractional sample indices."""
+    n = len(x)
+    x_fft = fft(x)
+    k = fftfreq(n, 1 / n)
+    res = np.zeros(len(tau))
+    for i, t in enumerate(tau):
+        phase = np.exp(2j * np.pi * k * t / n)
+        if not np.mod(n, 2):
+            phase[n // 2] = np.cos(np.pi * t)
+        res[i] = np.real(np.sum(x_fft * phase)) / n
+    return res
+
+
+def test_resampling_matrix1d_cubic(arr):
+    ref = np.array([Interp(T_OLD, x, k=3)(T_NEW) for x in arr])
+    res = resample1d(arr, resampling_matrix1d(T_OLD, T_NEW, "cubic"))
+    np.testing.assert_allclose(res, ref, atol=1e-10)
+
+
+@pytest.mark.parametrize("n", [19, 20])
+def test_resampling_matrix1d_fourier(arr, n):
+    arr = arr[:, :n]
+    tau = (T_NEW - T_OLD[0]) / (T_OLD[1] - T_OLD[0])
+    ref = np.array([_fourier(x, tau) for x in arr])
+    res = resample1d(arr, resampling_matrix1d(T_OLD[:n], T_NEW, "fourier"))
+    np.testing.assert_allclose(res, ref, atol=1e-10)
+
+
+def test_resampling_matrix1d_unknown(arr):
+    with pytest.raises(ValueError):
+        resampling_matrix1d(T_OLD, T_NEW, "linear")
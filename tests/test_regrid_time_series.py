@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy.interpolate import InterpolatedUnivariateSpline as Interp
+
+# local inputs
+from fmri_tools.utils.regrid_time_series import regrid_time_series
+
+TR_OLD = 3.0
+TR_NEW = 1.0
+
+
+def _reference(arr, t_start, nvol_remove):
+    """Cubic spline interpolation of each voxel time series with appended
+    first and last volumes."""
+    nt = arr.shape[3]
+    tt = TR_OLD * nt
+    n_append = int(np.floor(t_start / TR_OLD + 1))
+    arr_pad = np.pad(arr, ((0, 0), (0, 0), (0, 0), (n_append, n_append)), "edge")
+    t_old = np.arange(nt + 2 * n_append) * TR_OLD - n_append * TR_OLD + t_start
+    t_new = np.arange(0, tt, TR_NEW)
+    if nvol_remove:
+        t_new = t_new[:-nvol_remove]
+
+    res = np.zeros(arr.shape[:3] + (len(t_new),))
+    for x, y, z in np.ndindex(arr.shape[:3]):
+        res[x, y, z] = Interp(t_old, arr_pad[x, y, z], k=3)(t_new)
+
+    res[np.isnan(res)] = 0
+    res[res < 0] = 0
+    return res
+
+
+@pytest.mark.parametrize("t_start, nvol_remove", [(0, 0), (1.5, 2)])
+def test_regrid_time_series(tmp_path, t_start, nvol_remove):
+    arr = 100 + 10 * np.random.default_rng(0).standard_normal((3, 2, 5, 10))
+    file_in = tmp_path / "data.nii"
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_in)
+
+    regrid_time_series(str(file_in), str(tmp_path), TR_OLD, TR_NEW, t_start,
+                       nvol_remove, block_size=2)
+    img = nb.load(tmp_path / "data_upsampled.nii")
+    np.testing.assert_allclose(img.get_fdata(),
+                               _reference(arr, t_start, nvol_remove), rtol=1e-6)
+    assert img.header.get_zooms()[3] == TR_NEW
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# python standard library inputs
+from itertools import product
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.cmap.remove_edge_cmap import remove_edge_cmap
+
+SHAPE = (8, 9, 10)
+
+
+def _reference(arr, edge_threshold, min_threshold, neighborhood):
+    """Compare each voxel with its neighbours in the input coordinate mapping
+    and mask the result."""
+    res = arr.copy()
+    n_max = {6: 1, 18: 2, 26: 3}[neighborhood]
+    for i, j, k, t in np.ndindex(arr.shape):
+        for di, dj, dk in product([-1, 0, 1], repeat=3):
+            n = abs(di) + abs(dj) + abs(dk)
+            c = (i + di, j + dj, k + dk)
+            if not 0 < n <= n_max or not all(0 <= x < s for x, s in zip(c, SHAPE)):
+                continue
+            if np.abs(arr[c + (t,)] - arr[i, j, k, t]) > edge_threshold:
+                res[i, j, k, t] = np.nan
+    res[np.isnan(res)] = 0
+
+    mask = np.all(res[..., :3] != 0, axis=3)
+    mask &= np.any(res[..., :3] >= min_threshold, axis=3)
+    res[..., :3] *= mask[..., np.newaxis]
+    return res
+
+
+@pytest.mark.parametrize("neighborhood", [6, 18, 26])
+def test_remove_edge_cmap(tmp_path, neighborhood):
+    rng = np.random.default_rng(0)
+    arr = np.zeros(SHAPE + (3,))
+    arr[1:7, 2:8, 1:9] = np.moveaxis(np.indices((6, 6, 8)), 0, -1) + 4.0
+    arr += rng.random(arr.shape) * (arr != 0)
+    arr[rng.random(SHAPE) > 0.95] += 20  # outliers
+    arr[2, 3, 4, 1] = np.nan
+    file_in = tmp_path / "cmap.nii"
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_in)
+
+    remove_edge_cmap(str(file_in), neighborhood=neighborhood, block_size=3)
+    res = nb.load(tmp_path / "cmap_edge.nii").get_fdata()
+    np.testing.assert_allclose(res, _reference(arr, 5, 5, neighborhood),
+                               atol=1e-12)
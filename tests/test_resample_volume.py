@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.utils import resample_volume as rv
+
+SHAPE = (10, 11, 12)
+DXYZ = [0.5, 0.5, 0.5]
+
+
+@pytest.fixture
+def file_ramp(tmp_path):
+    x, y, z = np.indices(SHAPE)
+    arr = (x + 2 * y + 3 * z).astype(np.float32)
+    file_in = str(tmp_path / "ramp.nii")
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_in)
+    return file_in
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    rv._CACHE.clear()
+    rv._HASH.clear()
+
+
+def _coords():
+    """Output voxel centers in input voxel coordinates."""
+    return np.meshgrid(*[(np.arange(2 * n) + 0.5) * 0.5 - 0.5 for n in SHAPE],
+                       indexing="ij")
+
+
+@pytest.mark.parametrize("rmode, margin, atol", [
+    ("Li", 0, 1e-5),
+    ("Cu", 1, 1e-5),
+    ("cubic", 3, 1e-2),  # edge padding of the b-spline prefilter
+])
+def test_ramp(file_ramp, tmp_path, rmode, margin, atol):
+    file_out = str(tmp_path / "out.nii")
+    rv.resample_volume(file_ramp, file_out, DXYZ, rmode, block_size=5)
+    res = nb.load(file_out).get_fdata()
+
+    x, y, z = _coords()
+    interior = np.all([(c >= margin) & (c <= n - 1 - margin)
+                       for c, n in zip([x, y, z], SHAPE)], axis=0)
+    ref = x + 2 * y + 3 * z
+    assert res.shape == ref.shape
+    np.testing.assert_allclose(res[interior], ref[interior], atol=atol)
+
+
+def test_nearest(file_ramp, tmp_path):
+    file_out = str(tmp_path / "out.nii")
+    rv.resample_volume(file_ramp, file_out, DXYZ, "NN")
+    res = nb.load(file_out).get_fdata()
+
+    ind = [np.clip(np.round(c), 0, n - 1).astype(int)
+           for c, n in zip(_coords(), SHAPE)]
+    ref = nb.load(file_ramp).get_fdata()[tuple(ind)]
+    np.testing.assert_array_equal(res, ref)
+
+
+def test_unsupported_mode(file_ramp, tmp_path):
+    with pytest.raises(ValueError, match="Bk"):
+        rv.resample_volume(file_ramp, str(tmp_path / "out.nii"), DXYZ, "Bk")
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+def test_cache_hit(file_ramp, tmp_path, monkeypatch, ext):
+    file_ref = str(tmp_path / "ref.nii")
+    file_out = str(tmp_path / ("out" + ext))
+    rv.resample_volume(file_ramp, file_ref, DXYZ)
+
+    def _fail(*args):
+        raise AssertionError("memoized output was not used")
+
+    monkeypatch.setattr(rv, "_lagrange3d", _fail)
+    rv.resample_volume(file_ramp, file_out, DXYZ)
+    with open(file_out, "rb") as f:
+        assert (f.read(2) == b"\x1f\x8b") == ext.endswith(".gz")
+    np.testing.assert_array_equal(nb.load(file_out).get_fdata(),
+                                  nb.load(file_ref).get_fdata())
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+def test_output_format(file_ramp, tmp_path, ext):
+    file_out = str(tmp_path / ("out" + ext))
+    rv.resample_volume(file_ramp, file_out, DXYZ, cache=False)
+    with open(file_out, "rb") as f:
+        assert (f.read(2) == b"\x1f\x8b") == ext.endswith(".gz")
+    assert nb.load(file_out).shape == tuple(2 * n for n in SHAPE)
+    assert not rv._CACHE
+
+
+def test_cache_size(file_ramp, tmp_path, monkeypatch):
+    monkeypatch.setattr(rv, "_CACHE_SIZE", 2)
+    for i, d in enumerate([0.5, 0.6, 0.7]):
+        rv.resample_volume(file_ramp, str(tmp_path / f"out{i}.nii"), [d] * 3)
+    assert len(rv._CACHE) == 2
+    assert all(k[1] != (0.5, 0.5, 0.5) for k in rv._CACHE)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.utils.get_mean import get_mean
+from fmri_tools.utils.running_stats import write_stats
+
+
+@pytest.fixture
+def runs(tmp_path):
+    rng = np.random.default_rng(0)
+    arr = [1000 * i + rng.random((3, 4, 2, 10 + i)) for i in range(3)]
+    files = []
+    for i, a in enumerate(arr):
+        files.append(tmp_path / f"run{i}.nii")
+        nb.save(nb.Nifti1Image(a, np.eye(4)), files[-1])
+    return files, np.concatenate(arr, axis=3)
+
+
+def test_write_stats(runs, tmp_path):
+    files, arr = runs
+    res = write_stats(files, tmp_path / "out", "all", t_block=4)
+    ref = {
+        "mean": np.mean(arr, axis=3),
+        "std": np.std(arr, axis=3),
+        "tsnr": np.mean(arr, axis=3) / np.std(arr, axis=3),
+    }
+    for m in ref:
+        np.testing.assert_allclose(res[m], ref[m], rtol=1e-10)
+        res_file = nb.load(tmp_path / "out" / f"{m}_all.nii").get_fdata()
+        np.testing.assert_allclose(res_file, ref[m], rtol=1e-10)
+
+
+def test_write_stats_unknown_map(runs):
+    with pytest.raises(ValueError):
+        write_stats(runs[0], None, "all", maps=("var",))
+
+
+def test_get_mean_path(runs, tmp_path):
+    files, _ = runs
+    get_mean(files[0], tmp_path, "run0")
+    res = nb.load(tmp_path / "mean_run0.nii").get_fdata()
+    ref = nb.load(files[0]).get_fdata().mean(axis=3)
+    np.testing.assert_allclose(res, ref, rtol=1e-10)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+from scipy.interpolate import InterpolatedUnivariateSpline as Interp
+
+# local inputs
+from fmri_tools.preprocessing.slice_timing_correction import \
+    slice_timing_correction
+
+TR_OLD = 2.0
+TR_NEW = 1.0
+
+
+def _reference(arr, slice_order):
+    """Cubic spline interpolation of each voxel time series with appended
+    first and last volume."""
+    nx, ny, nz, nt = arr.shape
+    arr_pad = np.pad(arr, ((0, 0), (0, 0), (0, 0), (1, 1)), "edge")
+    ta = TR_OLD / nz
+    tt = TR_OLD * nt
+    tr_append = np.floor(TR_OLD / TR_NEW) * TR_NEW
+    t_new = np.arange(-tr_append, tt + tr_append, TR_NEW)
+    t_new = t_new[(t_new >= 0) & (t_new < tt)]
+
+    res = np.zeros((nx, ny, nz, len(t_new)))
+    for z in range(nz):
+        t = np.arange(nt + 2) * TR_OLD + z * ta - TR_OLD
+        for x in range(nx):
+            for y in range(ny):
+                res[x, y, slice_order[z]] = Interp(
+                    t, arr_pad[x, y, slice_order[z]], k=3)(t_new)
+
+    res[np.isnan(res)] = 0
+    return np.clip(res, np.min(arr), np.max(arr))
+
+
+@pytest.mark.parametrize("order", ["ascending", "descending"])
+def test_slice_timing_correction(tmp_path, order):
+    arr = 100 + np.random.default_rng(0).standard_normal((3, 2, 4, 12))
+    file_in = tmp_path / "data.nii"
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_in)
+
+    slice_timing_correction(str(file_in), TR_OLD, TR_NEW, order)
+    res = nb.load(tmp_path / "adata.nii").get_fdata()
+
+    slice_order = np.arange(4) if order == "ascending" else np.arange(3, -1, -1)
+    np.testing.assert_allclose(res, _reference(arr, slice_order), atol=1e-10)
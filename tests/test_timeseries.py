@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+from numpy.fft import fft, ifft
+from scipy.ndimage import gaussian_filter
+from nilearn.signal import clean
+
+# local inputs
+from fmri_tools.preprocessing.timeseries import FilterTimeseries, ScaleTimeseries, \
+    MaskedTimeseries, apply_chunked
+
+TR = 2.0
+
+
+@pytest.fixture
+def arr():
+    rng = np.random.default_rng(0)
+    return 100 + rng.standard_normal((4, 3, 2, 64))
+
+
+@pytest.fixture
+def mask():
+    return np.random.default_rng(1).random((4, 3, 2)) > 0.4
+
+
+def _loop(arr, func):
+    """Apply a function to the time series of each voxel."""
+    res = np.zeros_like(arr)
+    for ix, iy, iz in np.ndindex(arr.shape[:-1]):
+        res[ix, iy, iz] = func(arr[ix, iy, iz])
+    return res
+
+
+@pytest.mark.parametrize("store_dc", [False, True])
+def test_detrend(arr, store_dc):
+    cutoff_sec = 30
+    sigma = cutoff_sec / (np.sqrt(8 * np.log(2)) * TR)
+    ref = arr - _loop(arr, lambda x: gaussian_filter(x, sigma))
+    if store_dc:
+        ref += np.mean(arr, axis=3, keepdims=True)
+
+    res = FilterTimeseries(arr.copy(), TR).detrend(cutoff_sec, store_dc)
+    np.testing.assert_allclose(res, ref, atol=1e-10)
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_lowpass_gaussian(arr, normalize):
+    sigma = 4.0
+    nt = arr.shape[3]
+    x = np.linspace(-int(nt / 2), int(nt / 2), nt) * TR
+    f = [1 / (sigma * np.sqrt(2 * np.pi)) * np.exp(-(t**2) / (2 * sigma**2))
+         for t in x]
+    f_fft = np.abs(fft(f))
+    if normalize:
+        f_fft /= np.max(f_fft)
+    ref = _loop(arr, lambda ts: np.real(ifft(fft(ts) * f_fft)))
+
+    res = FilterTimeseries(arr.copy(), TR).lowpass_gaussian(sigma, normalize)
+    np.testing.assert_allclose(res, ref, atol=1e-10)
+
+
+@pytest.mark.parametrize("cutoff_low, cutoff_high",
+                         [(10, 100), (10, None), (None, 100)])
+def test_bandpass_butterworth(arr, cutoff_low, cutoff_high):
+    low_pass = 1.0 / cutoff_low if cutoff_low is not None else None
+    high_pass = 1.0 / cutoff_high if cutoff_high is not None else None
+    ref = _loop(arr, lambda ts: clean(ts[:, None], filter="butterworth",
+                                      detrend=False, standardize=None, t_r=TR,
+                                      low_pass=low_pass,
+                                      high_pass=high_pass)[:, 0])
+
+    res = FilterTimeseries(arr.copy(), TR).bandpass_butterworth(cutoff_low,
+                                                                cutoff_high)
+    np.testing.assert_allclose(res, ref, atol=1e-10)
+
+
+def test_bandpass_butterworth_no_filter(arr):
+    with pytest.warns(UserWarning):
+        res = FilterTimeseries(arr.copy(), TR).bandpass_butterworth(None, None)
+    np.testing.assert_array_equal(res, arr)
+
+
+@pytest.mark.parametrize("block_size", [1, 8])
+def test_masked_round_trip(arr, mask, block_size):
+    ts = MaskedTimeseries(arr, mask, block_size)
+    assert ts.data.shape == (np.sum(mask), arr.shape[3])
+    np.testing.assert_array_equal(ts.data, arr[mask])
+    np.testing.assert_array_equal(ts.scatter(), arr * mask[..., np.newaxis])
+
+
+def test_masked_file_round_trip(arr, mask, tmp_path):
+    file_data = str(tmp_path / "data.nii")
+    file_mask = str(tmp_path / "mask.nii")
+    file_out = str(tmp_path / "out.nii")
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_data)
+    nb.save(nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)), file_mask)
+
+    ts = MaskedTimeseries.from_file(file_data, file_mask, block_size=1)
+    ts.to_file(file_out, np.eye(4), dtype=np.float64)
+    res = nb.load(file_out).get_fdata()
+    np.testing.assert_array_equal(res, arr * mask[..., np.newaxis])
+
+
+def test_masked_apply(arr, mask):
+    ref = ScaleTimeseries(arr.copy()).psc()
+    res = MaskedTimeseries(arr, mask).apply("psc")
+    np.testing.assert_allclose(res, ref[mask], atol=1e-10)
+
+
+def test_apply_chunked_mask(arr, mask, tmp_path):
+    file_data = str(tmp_path / "data.nii")
+    file_mask = str(tmp_path / "mask.nii")
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_data)
+    nb.save(nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)), file_mask)
+
+    apply_chunked(file_data, str(tmp_path / "ref.nii"), "detrend", 30, TR=TR)
+    apply_chunked(file_data, str(tmp_path / "res.nii"), "detrend", 30, TR=TR,
+                  file_mask=file_mask)
+    ref = nb.load(str(tmp_path / "ref.nii")).get_fdata()
+    res = nb.load(str(tmp_path / "res.nii")).get_fdata()
+    np.testing.assert_allclose(res, ref * mask[..., np.newaxis], rtol=1e-5)
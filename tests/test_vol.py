@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# python standard library inputs
+import os
+
+# external inputs
+import numpy as np
+import nibabel as nb
+import pytest
+
+# local inputs
+from fmri_tools.io.vol import nifti_memmap
+
+
+@pytest.fixture
+def arr():
+    return np.random.default_rng(0).random((5, 6, 7, 3)).astype(np.float32)
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+def test_nifti_memmap(arr, tmp_path, ext):
+    file_out = str(tmp_path / ("out" + ext))
+    with nifti_memmap(file_out, arr.shape, np.eye(4)) as arr_out:
+        arr_out[:] = arr
+
+    np.testing.assert_array_equal(nb.load(file_out).get_fdata(), arr)
+    assert os.listdir(tmp_path) == ["out" + ext]
+
+
+def test_nifti_memmap_sibling(arr, tmp_path):
+    # an uncompressed sibling must not be overwritten by a compressed output
+    file_nii = str(tmp_path / "out.nii")
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_nii)
+    with nifti_memmap(str(tmp_path / "out.nii.gz"), arr.shape, np.eye(4)) as a:
+        a[:] = 2 * arr
+
+    np.testing.assert_array_equal(nb.load(file_nii).get_fdata(), arr)
+    np.testing.assert_array_equal(
+        nb.load(str(tmp_path / "out.nii.gz")).get_fdata(), 2 * arr)
+
+
+@pytest.mark.parametrize("ext", [".nii", ".nii.gz"])
+def test_nifti_memmap_inplace(arr, tmp_path, ext):
+    # the input is read while the output is written to the same file
+    file_in = str(tmp_path / ("data" + ext))
+    nb.save(nb.Nifti1Image(arr, np.eye(4)), file_in)
+    img = nb.load(file_in)
+    with nifti_memmap(file_in, arr.shape, img.affine, img.header) as arr_out:
+        for z in range(arr.shape[2]):
+            arr_out[:, :, z] = 2 * np.asarray(img.dataobj[:, :, z])
+
+    np.testing.assert_array_equal(nb.load(file_in).get_fdata(), 2 * arr)